@@ -2,23 +2,29 @@
 Library and software package to help manipulate and work with VQsX.
 """
 
+import importlib
+
 # Constant values and utilities
 from .constants import Colors
 from .constants import name_to_index, index_to_name, name_to_str, str_to_name
 from .constants import RGBColor, ColorMap, map_color
+from .constants import BRIGHTNESS_LEVELS, PALETTE, PALETTE_LUT, palette_array
 from .constants import Instructions
 from .constants import inst_to_int, int_to_inst, inst_to_name
 from .constants import SetOriginValues, sov_to_int, int_to_sov, sov_to_str, str_to_sov
 from .constants import StatusFlags
 from .constants import STATUS_ZERO, STATUS_HALTED, STATUS_NEXT, STATUS_FAULT
 from .constants import status_stringify
-from .constants import VQSXI_MAGIC
+from .constants import VQSXI_MAGIC, VQSXI_HEADER_SIZE
 
 from .types import VQsXException
 from .types import VQsXExecutorException, VQsXImageEngineException
 from .types import InvalidVQsXiMagicException, VQsXiBadFieldException, VQsXiBytecodeUnderflowException
 from .types import VQsXAssemblerException
 from .types import VQsXInvalidLabelException
+from .types import VQsXAssemblerSyntaxException, VQsXUndefinedLabelException
+from .types import VQsXTemplateException, VQsXBuilderException
+from .types import VQsXOptimizerException, VQsXGeometryException
 
 from .observers import VQsXObserver, VQsXaObserver, VQsXStubObserver
 
@@ -26,26 +32,64 @@ from .vm import NullOpBehavior
 from .vm import ByteCodeStream
 from .vm import VQsXExecutor, ImageEngine
 
-from .asm import Assembler, Builder
-from .disasm import Disassembler
+from .link import link, wrap_vqsxi, unwrap_vqsxi # Up front, so the function always wins over the submodule of the same name
+
+# Everything else is imported on first use, so importing vqsx stays cheap and doesn't need Tk
+_LAZY : dict[str, str] = {
+    "Assembler": "asm", "JumpTranslation": "asm",
+    "Fragment": "asm", "FragmentCache": "asm",
+    "Builder": "asm", "BuilderMark": "asm",
+    "Parameter": "asm", "Template": "asm",
+    "Disassembler": "disasm", "Disassembled": "disasm",
+    "BasicBlock": "disasm", "ControlFlowGraph": "disasm", "ARRAY_FIELDS": "disasm",
+    "Verification": "verify", "VerificationIssue": "verify", "StackDepths": "verify", "fast_path_eligible": "verify",
+    "peephole": "optimize", "outline": "optimize",
+    "Segment": "geometry", "SEGMENT_FIELDS": "geometry", "Geometry": "geometry", "GeometryEvaluator": "geometry",
+    "PenState": "geometry", "CutPoint": "geometry", "cut_points": "geometry", "evaluate_parallel": "geometry",
+    "SchedulingPolicy": "scheduler", "Progress": "scheduler", "Scheduler": "scheduler",
+    "Raster": "raster", "MonoRaster": "raster",
+
+    "TurtleObserver": "observerlib", "obsrv": "observerlib",
+    "Packed": "observerlib",
+}
+_SUBMODULES : frozenset[str] = frozenset(("asm", "disasm", "verify", "optimize", "link", "geometry", "scheduler",
+                                          "raster", "render", "shared", "observerlib"))
+
+def __getattr__(name : str):
+    """
+    Import the submodule a name lives in on first use.
+    """
+    if name in _LAZY:
+        value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
-from .observerlib import TurtleObserver, obsrv
-from .observerlib import Packed
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__) | _SUBMODULES)
 
 __all__ = ["Colors",
            "name_to_index", "index_to_name", "name_to_str", "str_to_name",
            "RGBColor", "ColorMap", "map_color", 
+           "BRIGHTNESS_LEVELS", "PALETTE", "PALETTE_LUT", "palette_array",
            "Instructions", 
            "SetOriginValues", "sov_to_int", "int_to_sov", "sov_to_str", "str_to_sov",
            "StatusFlags",
            "STATUS_ZERO", "STATUS_HALTED", "STATUS_NEXT", "STATUS_FAULT",
            "inst_to_int", "int_to_inst", "inst_to_name",
            "status_stringify",
-           "VQSXI_MAGIC",
+           "VQSXI_MAGIC", "VQSXI_HEADER_SIZE",
 
            "VQsXException",
            "VQsXExecutorException", "VQsXImageEngineException",
-           "InvalidVQsXiMagicException", "VQsXiBadFieldException", "VQsXiByteCodeUnderflowException",
+           "InvalidVQsXiMagicException", "VQsXiBadFieldException", "VQsXiBytecodeUnderflowException",
+           "VQsXAssemblerException", "VQsXInvalidLabelException",
+           "VQsXAssemblerSyntaxException", "VQsXUndefinedLabelException",
+           "VQsXTemplateException", "VQsXBuilderException",
+           "VQsXOptimizerException", "VQsXGeometryException",
 
            "VQsXObserver", "VQsXaObserver", "VQsXStubObserver",
            
@@ -53,8 +97,19 @@ __all__ = ["Colors",
            "ByteCodeStream",
            "VQsXExecutor", "ImageEngine",
 
-           "Assembler", "Builder",
-           "Disassembler",
+           "Assembler", "JumpTranslation",
+           "Fragment", "FragmentCache",
+           "Builder", "BuilderMark",
+           "Parameter", "Template",
+           "Disassembler", "Disassembled",
+           "BasicBlock", "ControlFlowGraph", "ARRAY_FIELDS",
+           "Verification", "VerificationIssue", "StackDepths", "fast_path_eligible",
+           "peephole", "outline",
+           "link", "wrap_vqsxi", "unwrap_vqsxi",
+           "Segment", "SEGMENT_FIELDS", "Geometry", "GeometryEvaluator",
+           "PenState", "CutPoint", "cut_points", "evaluate_parallel",
+           "SchedulingPolicy", "Progress", "Scheduler",
+           "Raster", "MonoRaster",
 
            "TurtleObserver", "obsrv", 
            "Packed"
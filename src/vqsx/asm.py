@@ -2,33 +2,248 @@
 Library for constructing VQsX binaries.
 """
 
-from .constants import Instructions, SetOriginValues, Colors
+from .constants import ENDIANESS, Instructions, SetOriginValues, Colors
+from .constants import MnemonicMapping, OperandMapping, INSTRUCTION_LENGTHS
 from .constants import INSTRUCTION_PACK, INSTRUCTION_BINARYOP1_PACK, INSTRUCTION_BINARYOP8_PACK, INSTRUCTION_UNARY1_PACK, INSTRUCTION_UNARY8_PACK, INSTRUCTION_UNARYF_PACK
+from .constants import INSTRUCTION_RAWBINARYOP1_PACK, INSTRUCTION_RAWBINARYOP8_PACK, INSTRUCTION_RAWUNARY1_PACK, INSTRUCTION_RAWUNARY8_PACK, INSTRUCTION_RAWUNARYF_PACK
 from . import types as vqsxtypes
-import io, contextlib, struct, functools
+import io, os, contextlib, struct, functools
+import enum, re, types
+import hashlib, json, tempfile, time
+import typing
+import collections.abc as cabc
 from typing import Self, Iterator, Generator
-import shlex
 
-__all__ = ["Assembler", "Builder"]
+__all__ = ["Assembler", "JumpTranslation", "Fixup",
+           "Fragment", "FragmentCache",
+           "Builder", "BuilderMark",
+           "Parameter", "PatchPoint", "Template"]
+
+@enum.unique
+class JumpTranslation(enum.StrEnum):
+    """
+    Enum for how the assembler translates the JUMP and CALL syntactic sugar.
+    """
+    AUTO = "auto" # Let the assembler choose. This assembler chooses IPC, as IPC based jumps and calls keep the binary position independent.
+    IPC = "ipc" # Only use JUMPIPC and CALLIPC
+    MST = "mst" # Only use JUMPMST and CALLMST
+
+class Fixup(typing.NamedTuple):
+    """
+    Class for representing a reference to a label whose address has to be patched in.
+    """
+    offset : int # Offset of the operand to patch
+    label : str # Label that is referred to
+    base : int # Address that the patched value is relative to
+    line : int # Source line of the reference, for error reporting
+    relative : bool = False # Whether the base moves along with the code when it is relocated, which is the case for IPC offsets
+
+class Fragment(typing.NamedTuple):
+    """
+    Class for representing a relocatable piece of assembled binary, such as an included file.
+
+    Label addresses and fixup offsets are relative to the start of the fragment. None of the references to labels are patched in, not even those to labels of the fragment itself.
+    Linking a fragment is appending its binary, defining its labels and patching its fixups.
+    """
+    bytecode : bytes
+    labels : dict[str, int] # Exported labels and their offsets
+    fixups : tuple[Fixup, ...] # References to labels, inside or outside of the fragment
+    deps : tuple[tuple[str, str], ...] # Files included by the fragment and the digests of their contents
+
+def _digest(content : bytes) -> str:
+    """
+    Content hash used by the fragment cache.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+class FragmentCache(object):
+    """
+    On-disk cache for the fragments of included files.
+
+    Fragments are keyed by the hash of the content of the included file, so an unchanged file is never lexed again. The fragment also records the hashes of the files it includes in turn, and is only reused when those are unchanged too.
+    Fragments are kept in memory as well, so a long-lived assembler doesn't even read them back from disk.
+
+    A cached fragment is a small header, a JSON record of its labels, fixups and included files, and then its raw binary. Nothing in the cache is ever executed, so a tampered cache can at worst produce a wrong binary.
+    """
+    VERSION = 2 # Bump whenever the fragment format or the generated code changes
+    HEADER = struct.Struct("<4sII") # Magic, version and length of the JSON record
+    MAGIC = b"VQsF"
+
+    def __init__(self, directory : str | os.PathLike):
+        self.directory : str = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.__fragments : dict[str, Fragment] = {} # Fragments that were loaded or stored, by key
+        self.__digests : dict[str, tuple[int, int, str]] = {} # Digests of files, by path, along with the modification time and size they were computed for
+
+    def __path(self, key : str) -> str:
+        return os.path.join(self.directory, f"{key}.vfrag")
+
+    def key(self, digest : str, jump : "JumpTranslation") -> str:
+        """
+        Obtain the key of a fragment from the digest of the source and how it was assembled.
+        """
+        return f"{digest}-{jump.value}-{self.VERSION}"
+
+    def digest(self, path : str) -> str:
+        """
+        Obtain the digest of the content of a file.
+
+        The digest is only computed again when the file was modified since.
+        """
+        stat = os.stat(path)
+        known = self.__digests.get(path)
+        if known is not None and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+
+        with open(path, "rb") as f:
+            digest = _digest(f.read())
+        self.__digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def load(self, key : str) -> Fragment | None:
+        """
+        Obtain a cached fragment, if there is one that is still valid.
+        """
+        fragment = self.__fragments.get(key)
+        if fragment is None:
+            try:
+                with open(self.__path(key), "rb") as f:
+                    content = f.read()
+                magic, version, length = self.HEADER.unpack_from(content)
+                if magic != self.MAGIC or version != self.VERSION:
+                    return None
+                start = self.HEADER.size + length
+                record = json.loads(content[self.HEADER.size:start].decode("utf-8"))
+
+                # Rebuilt field by field, so a malformed record is rejected here instead of breaking the assembly later
+                labels = {str(label): int(offset) for label, offset in record["labels"].items()}
+                fixups = tuple(Fixup(int(offset), str(label), int(base), int(line), bool(relative)) for offset, label, base, line, relative in record["fixups"])
+                deps = tuple((str(path), str(digest)) for path, digest in record["deps"])
+            except (OSError, struct.error, ValueError, TypeError, KeyError, AttributeError):
+                return None
+
+            fragment = Fragment(content[start:], labels, fixups, deps)
+            self.__fragments[key] = fragment
+
+        # Verify that the included files haven't changed
+        for path, digest in fragment.deps:
+            try:
+                if self.digest(path) != digest:
+                    return None
+            except OSError:
+                return None
+
+        return fragment
+
+    def store(self, key : str, fragment : Fragment):
+        """
+        Cache a fragment.
+
+        The file is replaced atomically, so several assemblers can share a cache.
+        """
+        self.__fragments[key] = fragment
+
+        record = json.dumps({"labels": fragment.labels, "fixups": [list(fixup) for fixup in fragment.fixups], "deps": [list(dep) for dep in fragment.deps]}).encode("utf-8")
+        with tempfile.NamedTemporaryFile("wb", dir=self.directory, delete=False) as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(record)))
+            f.write(record)
+            f.write(fragment.bytecode)
+        os.replace(f.name, self.__path(key))
+
+# The lexer. Each line is tokenized once with this, the operands are then split with _OPERAND.
+_LINE = re.compile(r"""
+    (?:
+        (?P<label>:[^\s\#;]*)                                           # Label, never indented
+      | [ \t]*\.(?P<directive>[A-Za-z_]\w*)(?P<arguments>[^\#;]*)       # Directive
+      | (?P<indent>[ \t]+)(?P<mnemonic>[A-Za-z][\w-]*)(?P<operands>[^\#;]*) # Instruction, always indented
+    )?
+    \s*;?\s*(?:\#.*)?$
+    """, re.VERBOSE)
+_OPERAND = re.compile(r"[^\s,]+")
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+# Instruction lookup for the assembler. Full names must be fully capitalized while mnemonics may also be in full lowercase.
+_INSTRUCTION_NAMES : dict[str, Instructions] = {}
+for _entry in MnemonicMapping.values():
+    _INSTRUCTION_NAMES[_entry.name.upper()] = _entry.inst
+    _INSTRUCTION_NAMES[_entry.mnemonic.upper()] = _entry.inst
+    _INSTRUCTION_NAMES[_entry.mnemonic] = _entry.inst
+    _INSTRUCTION_NAMES[_entry.inst.name] = _entry.inst
+
+# Explicit absolute jumps and calls. Unlike the JUMP and CALL syntactic sugar, these are never translated.
+_ABSOLUTE_NAMES : dict[str, Instructions] = {
+    "JUMPABS": Instructions.JUMP, "JABS": Instructions.JUMP, "jabs": Instructions.JUMP,
+    "CALLABS": Instructions.CALL, "CABS": Instructions.CALL, "cabs": Instructions.CALL,
+}
+
+# Named operands accepted in place of numbers.
+_NAMED_OPERANDS : dict[Instructions, typing.Mapping[str, int]] = {
+    Instructions.SETORIGIN: SetOriginValues.__members__,
+    Instructions.COLOR: Colors.__members__,
+}
+
+# Jump and call instructions, and the address their operand is relative to.
+_ABSOLUTE, _IPC, _MST = range(3)
+_BRANCHES : dict[Instructions, int] = {
+    Instructions.JUMP: _ABSOLUTE, Instructions.CALL: _ABSOLUTE,
+    Instructions.JUMPIPC: _IPC, Instructions.CALLIPC: _IPC,
+    Instructions.JUMPMST: _MST, Instructions.CALLMST: _MST,
+}
+
+# What the JUMP and CALL syntactic sugar translates into.
+_SUGAR : dict[JumpTranslation, dict[Instructions, Instructions]] = {
+    JumpTranslation.AUTO: {Instructions.JUMP: Instructions.JUMPIPC, Instructions.CALL: Instructions.CALLIPC},
+    JumpTranslation.IPC: {Instructions.JUMP: Instructions.JUMPIPC, Instructions.CALL: Instructions.CALLIPC},
+    JumpTranslation.MST: {Instructions.JUMP: Instructions.JUMPMST, Instructions.CALL: Instructions.CALLMST},
+}
 
 class Assembler(contextlib.AbstractContextManager, object):
     """
     This assembler class is used to assemble VQsX assembly into VQsX binaries.
 
     This assembler is not stateless. It has states that is maintained.
-    """
-    def __init__(self):
-        self.__builder = Builder() # Create an internal builder, which actually generates the binary. The assembler is just an interpreter.
+    Labels are kept in a symbol table, so several sources can be assembled in a row and refer to each other's labels.
 
-        self.reset()
+    The assembler works on a stream of lines. Each line is lexed once and emitted through the internal builder. References to labels that aren't defined yet are emitted as placeholders and recorded as fixups.
+    Fixups are patched as soon as their label is defined, so only the unresolved forward references are kept around.
 
+    If a sink is given, the binary is written to it as it is assembled instead of being kept for dump(). With a seekable sink (such as a file), everything is written out right away and fixups are patched in the sink.
+    With a non-seekable sink (such as a pipe), the binary is held back while there are unresolved forward references.
 
-    def __init_active_label(self):
+    The .include directive assembles the included file into a relocatable fragment, which is linked in place of the directive. Included files are looked up next to the including file and then in the include directories.
+    With a fragment cache, the fragments are cached by the hash of the included file, so only changed files are lexed again.
+
+    The JUMP and CALL syntactic sugar is translated according to the jump translation. Its operand is either a label or an absolute address.
+    The explicit JIPC, CIPC, JMST and CMST instructions also accept labels, a number is used as the raw offset.
+    JABS and CABS (JUMPABS and CALLABS in full) always assemble to the absolute JUMP and CALL, which the sugar never does.
+    IPC offsets are relative to the end of the jump or call instruction, as the IPC has already moved past the operand when it is executed.
+    """
+    FLUSH_THRESHOLD = 1 << 16 # How many bytes are buffered before they are written to the sink
+
+    def __init__(self, jump : JumpTranslation = JumpTranslation.AUTO, sink : typing.BinaryIO | None = None,
+                 include : cabc.Iterable[str] = (), cache : FragmentCache | None = None, relocatable : bool = False,
+                 profile : bool = False):
         """
-        Initialize the current active label if not set.
+        Initialization of the assembler.
+
+        jump - how the JUMP and CALL syntactic sugar is translated.
+        sink - where to write the binary to as it is assembled. None keeps it for dump().
+        include - directories to look up included files in.
+        cache - the fragment cache for included files. None disables caching.
+        relocatable - assemble into a relocatable fragment, see fragment().
+        profile - measure the time spent in each phase of the assembly, see timings.
         """
-        if self.__labelstate not in self.__labels:
-            self.__labels[self.__labelstate] = "" # Initialize the currently active label
+        self.__builder = Builder() # Create an internal builder, which actually generates the binary. The assembler is just an interpreter.
+        self.jump : JumpTranslation = JumpTranslation(jump)
+        self.sink = sink
+        self.include : list[str] = list(include)
+        self.cache : FragmentCache | None = cache
+        self.relocatable : bool = relocatable
+        self.__sources : list[str] = [] # Files that are being assembled, the innermost include last
+        self.timings : dict[str, float] | None = {} if profile else None # Seconds spent lexing, emitting, patching fixups and writing out, when profiling
+
+        self.reset()
 
     def reset(self):
         """
@@ -36,15 +251,42 @@ class Assembler(contextlib.AbstractContextManager, object):
         """
         self.__builder.reset()
 
-        self.__labelstate : str | None = None # String variable for keeping the current active label. None is the default, AKA no labels.
-        self.__labels : dict[str | None, str] = {} # Dictionary for labels and their sources
-        self.__init_active_label()
+        self.__labels : dict[str, int] = {} # Symbol table of the labels and their addresses
+        self.__fixups : dict[str, list[Fixup]] = {} # References to labels that are yet to be defined, by label
+        self.__entry : bool = False # Whether the entry point has been declared
+        self.__flushed : int = 0 # How many bytes were already written to the sink
+        self.__deps : dict[str, str] = {} # Files that were included and the digests of their contents
+        self.__packer = struct.Struct(f"{ENDIANESS}{INSTRUCTION_RAWUNARY8_PACK}")
+
+        if self.timings is not None:
+            self.timings.update(lex=0.0, emit=0.0, fixup=0.0, write=0.0)
+
+    @property
+    def sink(self) -> typing.BinaryIO | None:
+        """
+        Where the binary is written to as it is assembled.
+
+        The sink can be swapped between assemblies, so a single assembler can be reused for many sources.
+        """
+        return self.__sink
+
+    @sink.setter
+    def sink(self, sink : typing.BinaryIO | None):
+        self.__sink = sink
+        self.__seekable : bool = sink is not None and sink.seekable()
+
+    @property
+    def deps(self) -> dict[str, str]:
+        """
+        The files that were included and the digests of their contents.
+        """
+        return dict(self.__deps)
 
 
 
     def __enter__(self) -> Self:
         self.__builder.__enter__()
-        pass
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
         """
@@ -52,109 +294,496 @@ class Assembler(contextlib.AbstractContextManager, object):
         """
         self.reset()
         return self.__builder.__exit__(exc_type, exc_val, exc_tb)
-    
 
-    def __cleanse(self, iterator : Iterator[str]) -> Generator[str, None, None]:
+
+    @property
+    def labels(self) -> types.MappingProxyType:
+        """
+        The symbol table of the assembler. Maps each label to its address.
+        """
+        return types.MappingProxyType(self.__labels)
+
+    def tell(self) -> int:
+        """
+        Obtain the address of the next instruction to be assembled.
+        """
+        return self.__flushed + self.__builder.tell()
+
+
+    def __define_label(self, label : str, count : int):
+        """
+        Verify a label and define it at the current address.
+        """
+        if label == ":": # Verify that the label is not just ':'
+            raise vqsxtypes.VQsXInvalidLabelException("Label missing terminating ':'!", label, count)
+        if not label.endswith(":"): # Verify that the label does not ends with :
+            raise vqsxtypes.VQsXInvalidLabelException("Label missing terminating ':'!", label, count)
+
+        # Process the label
+        name : str = label[1:-1]
+        if name == "":
+            raise vqsxtypes.VQsXInvalidLabelException("Label is empty!", label, count)
+        if not _IDENTIFIER.fullmatch(name):
+            raise vqsxtypes.VQsXInvalidLabelException("Label is not a valid identifier!", label, count)
+
+        self.__bind(name, self.tell(), label, count)
+
+    def __bind(self, name : str, address : int, label : str, count : int):
+        """
+        Define a label at an address and patch the forward references to it.
+        """
+        if name in self.__labels:
+            raise vqsxtypes.VQsXInvalidLabelException("Label is already defined!", label, count)
+
+        self.__labels[name] = address
+
+        if not self.relocatable: # Fragments keep all their references for when they are linked
+            for fixup in self.__fixups.pop(name, ()):
+                self.__patch(fixup, address)
+
+    def __reference(self, fixup : Fixup):
+        """
+        Patch a reference to a label if the label is known, otherwise keep it for when it is defined.
+        """
+        target = None if self.relocatable else self.__labels.get(fixup.label)
+        if target is None:
+            self.__fixups.setdefault(fixup.label, []).append(fixup)
+        else:
+            self.__patch(fixup, target)
+
+    def __directive(self, directive : str, argument : str, line : str, count : int):
+        """
+        Process a directive.
+        """
+        if directive == "include":
+            self.__include(argument.strip(), line, count)
+            return
+
+        if directive == "entry":
+            # The entry point is declared with a jump to it, so it has to come before any code.
+            arguments = _OPERAND.findall(argument)
+            if len(arguments) != 1 or not _IDENTIFIER.fullmatch(arguments[0]):
+                raise vqsxtypes.VQsXAssemblerSyntaxException("The entry directive takes a single label!", line, count)
+            if self.relocatable:
+                raise vqsxtypes.VQsXAssemblerSyntaxException("The entry directive is not allowed in included files!", line, count)
+            if self.__entry or self.tell() != 0:
+                raise vqsxtypes.VQsXAssemblerSyntaxException("The entry directive must come before any code!", line, count)
+
+            self.__entry = True
+            self.__branch(_SUGAR[self.jump][Instructions.JUMP], arguments[0], True, line, count)
+            return
+
+        raise vqsxtypes.VQsXAssemblerSyntaxException(f"Unsupported directive '.{directive}'!", line, count)
+
+    def __include(self, path : str, line : str, count : int):
+        """
+        Link the fragment of an included file in place of the include directive.
+        """
+        if len(path) >= 2 and path[0] + path[-1] in ('""', "<>"): # Unquote
+            path = path[1:-1]
+        if not path:
+            raise vqsxtypes.VQsXAssemblerSyntaxException("The include directive takes a path!", line, count)
+
+        # Look up the file next to the including file, then in the include directories
+        directories = [os.path.dirname(self.__sources[-1]) if self.__sources else os.curdir, *self.include]
+        for directory in directories:
+            candidate = os.path.join(directory, path)
+            if os.path.isfile(candidate):
+                resolved = os.path.realpath(candidate)
+                break
+        else:
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"Included file '{path}' not found!", line, count)
+
+        if resolved in self.__sources:
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"File '{path}' includes itself!", line, count)
+
+        fragment, digest = self.__fragment_of(resolved)
+        self.__deps[resolved] = digest
+        self.__deps.update(fragment.deps)
+        self.__link(fragment, count)
+
+    def __fragment_of(self, path : str) -> tuple[Fragment, str]:
         """
-        An internal method for cleansing assembly source lines of top-level comments.
+        Obtain the fragment of an included file, from the cache if possible.
+
+        Returns the fragment and the digest of the file.
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = _digest(content)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(digest, self.jump)
+            fragment = self.cache.load(key)
+            if fragment is not None:
+                return fragment, digest
+
+        # Cache miss, assemble the included file on its own
+        assembler = Assembler(self.jump, include=self.include, cache=self.cache, relocatable=True)
+        assembler.__sources = [*self.__sources, path]
+        assembler.__assemble_lines(io.StringIO(content.decode("utf-8")))
+        fragment = assembler.fragment()
+
+        if key is not None:
+            self.cache.store(key, fragment)
+        return fragment, digest
+
+    def __link(self, fragment : Fragment, count : int):
+        """
+        Append a fragment, define its labels and relocate its references.
+        """
+        base = self.tell()
+        self.__builder.raw(fragment.bytecode)
+
+        for name, offset in fragment.labels.items():
+            self.__bind(name, base + offset, f":{name}:", count)
+
+        for fixup in fragment.fixups:
+            self.__reference(fixup._replace(offset=fixup.offset + base, base=fixup.base + base if fixup.relative else fixup.base))
+
+    def fragment(self) -> Fragment:
+        """
+        Obtain the assembled binary as a relocatable fragment.
+
+        This is meant for assemblers that are relocatable.
+        """
+        fixups = tuple(fixup for fixups in self.__fixups.values() for fixup in fixups)
+        return Fragment(self.__builder.dump(), dict(self.__labels), fixups, tuple(self.__deps.items()))
+
+    def __branch(self, inst : Instructions, operand : str, sugar : bool, line : str, count : int):
+        """
+        Emit a jump or call to a label or an address.
+
+        For the syntactic sugar, a number is an absolute address. For the explicit instructions, a number is the raw operand.
+        """
+        address = self.tell()
+        kind = _BRANCHES[inst]
+        base = address + INSTRUCTION_LENGTHS[inst] if kind == _IPC else 0
+
+        if _IDENTIFIER.fullmatch(operand):
+            target = None if self.relocatable else self.__labels.get(operand)
+            if target is None: # Forward reference, patch it in later
+                self.__fixups.setdefault(operand, []).append(Fixup(address + 1, operand, base, count, kind == _IPC))
+                target = base
+        else:
+            target = self.__number(operand, INSTRUCTION_RAWUNARY8_PACK, line, count)
+            if not sugar:
+                base = 0
+
+        self.__builder.instruction(inst, target - base)
+
+    def __number(self, operand : str, code : str, line : str, count : int) -> int | float:
         """
+        Convert an operand into a number fitting the raw struct fmt code.
+        """
+        try:
+            if code == INSTRUCTION_RAWUNARYF_PACK:
+                return float(operand)
+            return int(operand, 0)
+        except ValueError:
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"Invalid operand '{operand}'!", line, count) from None
+
+    def __instruction(self, mnemonic : str, operands : list[str], line : str, count : int):
+        """
+        Emit an instruction.
+        """
+        absolute = _ABSOLUTE_NAMES.get(mnemonic)
+        inst = absolute or _INSTRUCTION_NAMES.get(mnemonic)
+        if inst is None:
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"Unknown instruction '{mnemonic}'!", line, count)
+
+        rawfmt = OperandMapping[inst]
+        if len(operands) != len(rawfmt):
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"{mnemonic} takes {len(rawfmt)} operand(s) but {len(operands)} were given!", line, count)
+
+        sugar = absolute is None and inst in (Instructions.JUMP, Instructions.CALL)
+        if sugar:
+            inst = _SUGAR[self.jump][inst]
+        if inst in _BRANCHES:
+            self.__branch(inst, operands[0], sugar, line, count)
+            return
 
-        for line in iterator:
-            if line.startswith("#"): # Cleanse top-level comments
-                continue
+        named = _NAMED_OPERANDS.get(inst)
+        values = []
+        for operand, code in zip(operands, rawfmt):
+            if named is not None and operand in named:
+                values.append(named[operand])
             else:
-                yield line
+                values.append(self.__number(operand, code, line, count))
 
-    def __push_label(self, line : str):
+        try:
+            self.__builder.instruction(inst, *values)
+        except struct.error as e:
+            raise vqsxtypes.VQsXAssemblerSyntaxException(f"Operand out of range! {e}", line, count) from None
+
+    def __lex(self, line : str, count : int) -> re.Match:
         """
-        Push string to label for processing.
+        Lex a single line of assembly.
         """
-        self.__labels[self.__labelstate] = self.__labels[self.__labelstate] + line + "\n"
+        lexed = _LINE.match(line)
+        if lexed is None:
+            raise vqsxtypes.VQsXAssemblerSyntaxException("Invalid syntax! Instructions must be indented while labels must not be.", line, count)
 
-    @functools.singledispatchmethod
-    def assemble(self, assembly : str):
+        return lexed
+
+    def __emit(self, lexed : re.Match, line : str, count : int):
         """
-        Assembles the provided assembly source.
-        This begins the interpreter, which calls the internal builder to build the binary.
+        Emit a single lexed line of assembly.
+        """
+        mnemonic = lexed["mnemonic"]
+        if mnemonic is not None:
+            self.__instruction(mnemonic, _OPERAND.findall(lexed["operands"]), line, count)
+        elif lexed["label"] is not None:
+            self.__define_label(lexed["label"], count)
+        elif lexed["directive"] is not None:
+            self.__directive(lexed["directive"], lexed["arguments"], line, count)
+
+    def __line(self, line : str, count : int):
+        """
+        Lex and emit a single line of assembly.
+        """
+        self.__emit(self.__lex(line, count), line, count)
+
+    def __patch(self, fixup : Fixup, target : int):
+        """
+        Patch a fixup, either in the buffered binary or in the sink if it was already written out.
+        """
+        start = time.perf_counter() if self.timings is not None else 0.0
+
+        value = target - fixup.base
+        if fixup.offset >= self.__flushed:
+            self.__builder.patch(fixup.offset - self.__flushed, self.__packer, value)
+        else:
+            self.sink.seek(fixup.offset)
+            self.sink.write(self.__packer.pack(value))
+            self.sink.seek(0, io.SEEK_END)
+
+        if self.timings is not None: # Fixups are patched while emitting, so their time is moved from emitting to patching
+            elapsed = time.perf_counter() - start
+            self.timings["fixup"] += elapsed
+            self.timings["emit"] -= elapsed
+
+    def flush(self):
+        """
+        Write the buffered binary out to the sink.
+
+        With a non-seekable sink, nothing is written while there are unresolved forward references.
+        """
+        if self.sink is None or (self.__fixups and not self.__seekable):
+            return
+
+        start = time.perf_counter() if self.timings is not None else 0.0
+
+        self.sink.write(self.__builder.dump())
+        self.__flushed += self.__builder.tell()
+        self.__builder.reset()
+
+        if self.timings is not None:
+            self.timings["write"] += time.perf_counter() - start
+
+    def __finish(self):
+        """
+        Verify that every referenced label was defined and flush the rest of the binary.
+        """
+        if self.relocatable: # References to labels outside of a fragment are resolved when it is linked
+            return
+
+        for label, fixups in self.__fixups.items():
+            raise vqsxtypes.VQsXUndefinedLabelException(f"Label '{label}' is never defined!", label, fixups[0].line)
+
+        self.flush()
+
+    def __assemble_lines(self, lines : cabc.Iterable[str]):
+        """
+        Lex and emit the lines as they come, flushing to the sink along the way.
         """
 
-        l = iter(assembly.splitlines()) # Create an iterator over the lines.
-        cleansed = self.__cleanse(l) # Cleanse the lines of comments and create a generator.
+        threshold = self.FLUSH_THRESHOLD if self.sink is not None else None
+        if self.timings is not None:
+            self.__assemble_profiled(lines, threshold)
+            return
 
-        for count, line in enumerate(cleansed): # Loop over the cleansed lines
-            line : str = line # Current line
-            count : int = count # Current line number
+        for count, line in enumerate(lines, 1): # Lex and emit each line
+            self.__line(line, count)
 
-            if line.startswith(":"):
-                tline = shlex.split(line)
-                if len(tline) < 1: # Verify that there is a label
-                    # TODO: Replace this with a real exception
-                    raise vqsxtypes.VQsXAssemblerException("Bad thing.")
+            if threshold is not None and self.__builder.tell() >= threshold:
+                self.flush()
 
-                # Fetch and verify the label
-                label : str = tline[0]
-                if label == ":": # Verify that the label is not just ':'
-                    raise vqsxtypes.VQsXInvalidLabelException("Label missing terminating ':'!", label, count)
-                if not label.endswith(":"): # Verify that the label does not ends with :
-                    raise vqsxtypes.VQsXInvalidLabelException("Label missing terminating ':'!", label, count)
+        self.__finish()
 
+    def __assemble_profiled(self, lines : cabc.Iterable[str], threshold : int | None):
+        """
+        Same as __assemble_lines, while measuring the time spent in each phase.
 
-                # Process the label
-                labelslice : slice = slice(1, len(label)-1, 1)
-                label : str = label[labelslice]
-                if label == "":
-                    raise vqsxtypes.VQsXInvalidLabelException("Label is empty!", labelslice, count)
+        This is kept apart so that assembling without profiling doesn't pay for the clock.
+        """
+        clock = time.perf_counter
+        timings = self.timings
+        for count, line in enumerate(lines, 1):
+            start = clock()
+            lexed = self.__lex(line, count)
+            lexed_at = clock()
+            self.__emit(lexed, line, count)
+            timings["lex"] += lexed_at - start
+            timings["emit"] += clock() - lexed_at
 
-                # Set the active label
-                # Initialize if the label is new
-                self.__labelstate = label
-                self.__init_active_label()
-                continue
+            if threshold is not None and self.__builder.tell() >= threshold:
+                self.flush()
 
-            if line.startswith("."):
-                tline = shlex.split(line)
-                # print(tline)
-                continue
+        self.__finish()
 
-            self.__push_label(line)
+    @functools.singledispatchmethod
+    def assemble(self, lines : cabc.Iterable):
+        """
+        Assembles the provided assembly source lines.
+        This begins the interpreter, which calls the internal builder to build the binary.
+
+        The lines can come from any iterator such as an open file, a pipe or a generator. They are consumed as they come.
+        """
 
+        self.__assemble_lines(lines)
 
+    @assemble.register
+    def __assemble_source(self, assembly : str):
+        """
+        Singledispatch for assembly sources as a string
+        """
 
+        self.__assemble_lines(io.StringIO(assembly)) # Iterates over the lines without splitting them all up front
 
     @assemble.register
     def __assemble_stream(self, file : io.IOBase):
         """
         Singledispatch for files
+
+        Included files are looked up relative to the file.
         """
 
-        self.assemble(file.read())
+        name = getattr(file, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            self.__sources.append(os.path.realpath(name))
+            try:
+                self.__assemble_lines(file)
+            finally:
+                self.__sources.pop()
+        else:
+            self.__assemble_lines(file)
 
     def dump(self) -> bytes:
         """
         Obtain the assembled binary.
         This is just a proxy to the builder, which does the actual job of building the binary.
+
+        When assembling into a sink, this is only what hasn't been written to the sink yet.
         """
         return self.__builder.dump()
 
+class Parameter(typing.NamedTuple):
+    """
+    A named placeholder for an instruction operand.
+
+    Pass a Parameter to a Builder method in place of an operand to turn that operand into a patch point of the built template.
+    The default is what gets written into the recorded binary.
+    The transform, if given, is applied to the value of the parameter before it is patched in. This allows derived operands such as half of a length.
+    """
+    name : str
+    default : int | float = 0
+    transform : typing.Callable[[int | float], int | float] | None = None
+
+class PatchPoint(typing.NamedTuple):
+    """
+    Class for representing the location of a parameterized operand in a template.
+    """
+    offset : int
+    packer : struct.Struct
+    transform : typing.Callable[[int | float], int | float] | None
+
+class Template(object):
+    """
+    A recorded binary with named patch points.
+
+    Templates are created by Builder.template(). Instantiating a template copies the recorded binary once and patches the operands of the given parameters in place.
+    This is a lot cheaper than re-running the Builder calls for each variant.
+    """
+    def __init__(self, bytecode : bytes, patches : dict[str, tuple[PatchPoint, ...]]):
+        """
+        Constructor.
+
+        bytecode - the recorded binary, with the defaults of the parameters written in.
+        patches - the patch points of each parameter.
+        """
+        self.bytecode : bytes = bytes(bytecode)
+        self.patches : dict[str, tuple[PatchPoint, ...]] = dict(patches)
+
+    @property
+    def parameters(self) -> frozenset[str]:
+        """
+        The names of the parameters of the template.
+        """
+        return frozenset(self.patches)
+
+    def instantiate(self, **values : int | float) -> bytearray:
+        """
+        Create a variant of the template.
+
+        Parameters that are not given keep the default they were recorded with.
+        """
+        variant = bytearray(self.bytecode)
+        self.patch(variant, **values)
+        return variant
+
+    def patch(self, buffer : bytearray | memoryview, **values : int | float):
+        """
+        Patch the given parameters into an existing copy of the template.
+
+        This is useful when instantiating variants into a reused buffer.
+        """
+        for name, value in values.items():
+            points = self.patches.get(name)
+            if points is None:
+                raise vqsxtypes.VQsXTemplateException(f"Template has no parameter named '{name}'!", name)
+
+            for offset, packer, transform in points:
+                packer.pack_into(buffer, offset, value if transform is None else transform(value))
+
+class BuilderMark(typing.NamedTuple):
+    """
+    Class for representing a checkpoint of a Builder.
+
+    Rolling back to a mark truncates the binary back to the length it had when the mark was taken.
+    """
+    length : int # Length of the binary
+    patches : int # Number of patch points recorded
+
 class Builder(contextlib.AbstractContextManager, object):
     """
     This class is used to directly assemble VQsX binaries programatically.
     This class directly assembles VQsX binaries without any VQsX assembly being involved.
     Each method call creates a new instruction and appends it.
 
-    This class cannot undo mistakes due to the nature of the building/assembly method that is used internally.
+    This class cannot undo single instructions due to the nature of the building/assembly method that is used internally.
+    It can however roll back to a checkpoint. Use mark() before emitting speculatively, then either rollback() to discard what was emitted since or commit() to keep it.
+    Marks can be nested, transaction() wraps this in a context manager.
+
+    Operands may be given as a Parameter instead of a value. The built binary can then be dumped as a Template, whose variants only differ in those operands.
     """
     def __init__(self, chunks : bytes=None):
         self.bstream = io.BytesIO(chunks)
+        self.bstream.seek(0, io.SEEK_END) # Append after the initial chunks, so offsets and marks count them too
+        self.patches : list[tuple[str, PatchPoint]] = [] # Patch points of the parameters used so far, in order of emission
+        self.marks : list[BuilderMark] = [] # Open checkpoints, innermost last
 
 
     def reset(self):
         self.bstream.close()
         self.bstream = io.BytesIO()
+        self.patches = []
+        self.marks = []
 
     
     def __enter__(self) -> Self:
-        pass
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
         """
@@ -169,6 +798,133 @@ class Builder(contextlib.AbstractContextManager, object):
         Dumps the built/assembled VQsX binary.
         """
         return self.bstream.getvalue()
+
+    def tell(self) -> int:
+        """
+        Obtain the current length of the binary, which is the address of the next instruction.
+        """
+        return self.bstream.tell()
+
+    def raw(self, chunk : bytes) -> Self:
+        """
+        Appends already assembled binary as-is.
+        """
+        self.bstream.write(chunk)
+
+        return self
+
+    def patch(self, offset : int, packer : struct.Struct, value : int | float):
+        """
+        Overwrite an already written operand.
+
+        This is used to fill in placeholders, such as the addresses of labels that weren't known yet.
+        """
+        with self.bstream.getbuffer() as view:
+            packer.pack_into(view, offset, value)
+
+    def template(self) -> Template:
+        """
+        Dumps the built/assembled VQsX binary as a template.
+
+        Each Parameter that was passed as an operand becomes a patch point of the template.
+        """
+        patches : dict[str, list[PatchPoint]] = {}
+        for name, point in self.patches:
+            patches.setdefault(name, []).append(point)
+
+        return Template(self.bstream.getvalue(), {name: tuple(points) for name, points in patches.items()})
+
+
+    def mark(self) -> BuilderMark:
+        """
+        Open a checkpoint at the current end of the binary.
+
+        The returned mark can be passed to rollback(). Marks nest, so a mark taken inside another is an inner transaction.
+        """
+        mark = BuilderMark(self.bstream.tell(), len(self.patches))
+        self.marks.append(mark)
+        return mark
+
+    def rollback(self, mark : BuilderMark | None = None):
+        """
+        Discard everything emitted since the given mark, or since the innermost mark if not given.
+
+        The mark and all the marks nested inside it are closed. This only truncates the binary, so its cost does not depend on how much was emitted.
+        """
+        if not self.marks:
+            raise vqsxtypes.VQsXBuilderException("No checkpoint to roll back to!")
+
+        if mark is None:
+            mark = self.marks[-1]
+
+        # Close the mark along with its inner marks
+        # Search from the innermost mark, as that is what is rolled back most of the time.
+        for index in range(len(self.marks) - 1, -1, -1):
+            if self.marks[index] is mark:
+                del self.marks[index:]
+                break
+        else:
+            raise vqsxtypes.VQsXBuilderException("Checkpoint is not open!")
+
+        self.bstream.seek(mark.length)
+        self.bstream.truncate()
+        del self.patches[mark.patches:]
+
+    def commit(self):
+        """
+        Close the innermost mark and keep everything emitted since.
+        """
+        if not self.marks:
+            raise vqsxtypes.VQsXBuilderException("No checkpoint to commit!")
+
+        self.marks.pop()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Generator[BuilderMark, None, None]:
+        """
+        Context manager for a checkpoint.
+
+        The emitted instructions are committed when the block finishes and rolled back when it raises.
+        Rolling back explicitly inside the block is also allowed.
+        """
+        mark = self.mark()
+        try:
+            yield mark
+        except BaseException:
+            if any(open_mark is mark for open_mark in self.marks): self.rollback(mark)
+            raise
+
+        if self.marks and self.marks[-1] is mark:
+            self.commit()
+
+
+    def __record_parameters(self, rawfmt : str, args : tuple) -> tuple:
+        """
+        Record the patch points of the Parameter operands of the instruction that is about to be written.
+
+        Returns the operands with each Parameter replaced by the value to write for it.
+        """
+        offset = self.bstream.tell() + struct.calcsize(INSTRUCTION_PACK) # Skip the opcode
+        values = []
+        for code, arg in zip(rawfmt, args):
+            packer = struct.Struct(f"{ENDIANESS}{code}")
+            if isinstance(arg, Parameter):
+                self.patches.append((arg.name, PatchPoint(offset, packer, arg.transform)))
+                arg = arg.default if arg.transform is None else arg.transform(arg.default)
+            values.append(arg)
+            offset += packer.size
+        return tuple(values)
+
+    def __write_operands(self, fmt : str, rawfmt : str, inst : Instructions, *args):
+        """
+        DRY up the code: Instructions with operands, which may be parameterized.
+        """
+
+        if Parameter in map(type, args): # Only pay for the parameter bookkeeping when there are parameters
+            args = self.__record_parameters(rawfmt, args)
+
+        en_inst = struct.pack(fmt, inst, *args) # Pack and encode the instruction
+        self.bstream.write(en_inst)
     
 
     def __write_single(self, inst : Instructions):
@@ -184,42 +940,52 @@ class Builder(contextlib.AbstractContextManager, object):
         DRY up the code: Binary 8-bit operand instructions.
         """
 
-        en_inst = struct.pack(INSTRUCTION_BINARYOP1_PACK, inst, arg1, arg2) # Pack and encode the instruction
-        self.bstream.write(en_inst)
+        self.__write_operands(INSTRUCTION_BINARYOP1_PACK, INSTRUCTION_RAWBINARYOP1_PACK, inst, arg1, arg2)
 
     def __write_binary8(self, inst : Instructions, arg1, arg2):
         """
         DRY up the code: Binary 64-bit operand instructions.
         """
 
-        en_inst = struct.pack(INSTRUCTION_BINARYOP8_PACK, inst, arg1, arg2) # Pack and encode the instruction
-        self.bstream.write(en_inst)
+        self.__write_operands(INSTRUCTION_BINARYOP8_PACK, INSTRUCTION_RAWBINARYOP8_PACK, inst, arg1, arg2)
 
     def __write_unary1(self, inst : Instructions, arg):
         """
         DRY up the code: Unary 8-bit operand instructions.
         """
 
-        en_inst = struct.pack(INSTRUCTION_UNARY1_PACK, inst, arg) # Pack and encode the instruction
-        self.bstream.write(en_inst)
+        self.__write_operands(INSTRUCTION_UNARY1_PACK, INSTRUCTION_RAWUNARY1_PACK, inst, arg)
 
     def __write_unary8(self, inst : Instructions, arg):
         """
         DRY up the code: Unary 64-bit operand instructions.
         """
 
-        en_inst = struct.pack(INSTRUCTION_UNARY8_PACK, inst, arg) # Pack and encode the instruction
-        self.bstream.write(en_inst)
+        self.__write_operands(INSTRUCTION_UNARY8_PACK, INSTRUCTION_RAWUNARY8_PACK, inst, arg)
 
     def __write_unaryf(self, inst : Instructions, arg : float):
         """
         DRY up the code: Unary 64-bit IEEE 754 operand instructions.
         """
 
-        en_inst = struct.pack(INSTRUCTION_UNARYF_PACK, inst, arg) # Pack and encode the instruction
-        self.bstream.write(en_inst)
+        self.__write_operands(INSTRUCTION_UNARYF_PACK, INSTRUCTION_RAWUNARYF_PACK, inst, arg)
     
 
+    def instruction(self, inst : Instructions, *operands) -> Self:
+        """
+        Appends any instruction with the given operands.
+
+        The operands must match the operands of the instruction. This is used by the assembler, prefer the named methods otherwise.
+        """
+
+        rawfmt = OperandMapping[inst]
+        if rawfmt:
+            self.__write_operands(f"{INSTRUCTION_PACK}{rawfmt}", rawfmt, inst, *operands)
+        else:
+            self.__write_single(inst)
+
+        return self
+
     def null(self) -> Self:
         """
         Appends a NULL into the binary.
@@ -441,6 +1207,91 @@ class Builder(contextlib.AbstractContextManager, object):
         return self
 
     
+    def jump(self, addr : int) -> Self:
+        """
+        Appends a JUMP instruction.
+        """
+
+        self.__write_unary8(Instructions.JUMP, addr)
+
+        return self
+
+    def call(self, addr : int) -> Self:
+        """
+        Appends a CALL instruction.
+        """
+
+        self.__write_unary8(Instructions.CALL, addr)
+
+        return self
+
+    def jumpipc(self, offset : int) -> Self:
+        """
+        Appends a JUMPIPC instruction.
+
+        The offset is relative to the end of the instruction.
+        """
+
+        self.__write_unary8(Instructions.JUMPIPC, offset)
+
+        return self
+
+    def callipc(self, offset : int) -> Self:
+        """
+        Appends a CALLIPC instruction.
+
+        The offset is relative to the end of the instruction.
+        """
+
+        self.__write_unary8(Instructions.CALLIPC, offset)
+
+        return self
+
+    def jumpmst(self, offset : int) -> Self:
+        """
+        Appends a JUMPMST instruction.
+        """
+
+        self.__write_unary8(Instructions.JUMPMST, offset)
+
+        return self
+
+    def callmst(self, offset : int) -> Self:
+        """
+        Appends a CALLMST instruction.
+        """
+
+        self.__write_unary8(Instructions.CALLMST, offset)
+
+        return self
+
+    def ret(self) -> Self:
+        """
+        Appends a RETURN instruction.
+        """
+
+        self.__write_single(Instructions.RETURN)
+
+        return self
+
+    def halt(self) -> Self:
+        """
+        Appends a HALT instruction.
+        """
+
+        self.__write_single(Instructions.HALT)
+
+        return self
+
+    def waitnext(self) -> Self:
+        """
+        Appends a WAITNEXT instruction.
+        """
+
+        self.__write_single(Instructions.WAITNEXT)
+
+        return self
+
     def nop(self) -> Self:
         """
         Appends an explicit NOP into the binary.
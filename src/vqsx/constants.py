@@ -1,5 +1,5 @@
 import enum
-import io, os
+import io, os, struct
 import typing, types
 
 """
@@ -11,13 +11,15 @@ __all__ = ["Colors",
            "name_to_str","str_to_name",
            "RGBColor", "ColorMap",
            "map_color",
+           "BRIGHTNESS_LEVELS", "PALETTE", "PALETTE_LUT", "palette_array",
 
            "INSTRUCTION_PACK", 
            "INSTRUCTION_RAWBINARYOP1_PACK", "INSTRUCTION_RAWBINARYOP8_PACK", "INSTRUCTION_RAWUNARY1_PACK", "INSTRUCTION_RAWUNARY8_PACK", "INSTRUCTION_RAWUNARYF_PACK",
            "INSTRUCTION_BINARYOP1_PACK", "INSTRUCTION_BINARYOP8_PACK", "INSTRUCTION_UNARY1_PACK", "INSTRUCTION_UNARY8_PACK", "INSTRUCTION_UNARYF_PACK",
            "Instructions",
            "MnemonicEntry", "MnemonicMapping",
-           "inst_to_int", "int_to_inst", "inst_to_name",
+           "OperandMapping", "INSTRUCTION_LENGTHS",
+           "inst_to_int", "int_to_inst", "inst_to_name", "inst_to_operands",
            "is_noop", "is_halt",
 
            "SetOriginValues",
@@ -28,7 +30,8 @@ __all__ = ["Colors",
            "status_stringify",
 
            "VQSXI_MAGIC",
-           "VQSXI_DIM_FORMAT", "VQSXI_CDEPTH_FORMAT"
+           "VQSXI_DIM_FORMAT", "VQSXI_CDEPTH_FORMAT", "VQSXI_BYTECODELEN_FORMAT",
+           "VQSXI_PADDING", "VQSXI_HEADER_SIZE"
            ]
 
 # Special architecture constants
@@ -36,7 +39,6 @@ ENDIANESS = "<" # '<' for little-endian. '>' for big-endian.
 
 # Color constants
 @enum.unique
-@enum.verify(enum.CONTINUOUS)
 class Colors(enum.IntEnum, enum.ReprEnum):
     """
     Constants for defining VQsX color indexes and their names.
@@ -69,8 +71,11 @@ class Colors(enum.IntEnum, enum.ReprEnum):
     LIGHTBROWN = 19
     TAN = 20
     GOLD = 21
+    DEEPERSKYBLUE = 22
 
 COLOR_COUNT = len(Colors)
+if [*Colors] != list(range(COLOR_COUNT)):
+    raise ValueError("index_to_name() and PALETTE index colors by value, so they can't have gaps")
 
 # Color utilities
 def name_to_index(name : Colors) -> int:
@@ -86,7 +91,7 @@ def index_to_name(index : int) -> Colors | None:
     All invalid indexes would result in None being returned.
     """
 
-    if index > 0 and index < COLOR_COUNT:
+    if index >= 0 and index < COLOR_COUNT:
         return Colors(index)
     return None
 
@@ -128,22 +133,54 @@ ColorMap : types.MappingProxyType = types.MappingProxyType({
 
     Colors.BSKYBLUE: RGBColor(0x87, 0xCE, 0xFA),
     Colors.BPURPLE: RGBColor(0xAA, 0x55, 0xFF),
-    Colors.BTEAL: RGBColor(0xAA, 0x55, 0xFF),
+    Colors.BTEAL: RGBColor(0x55, 0xFF, 0xAA),
 
     Colors.AZURE: RGBColor(0xF0, 0xFF, 0xFF),
 
-    Colors.BWHITE: RGBColor(0xFF, 0xFF, 0xFF)
+    Colors.BWHITE: RGBColor(0xFF, 0xFF, 0xFF),
+    Colors.BBEIGE: RGBColor(0xFF, 0xDD, 0x99),
+    Colors.LAVENDER: RGBColor(0xE6, 0xE6, 0xFA),
+    Colors.FUCHSIA: RGBColor(0xFF, 0x00, 0xFF),
+    Colors.OLIVE: RGBColor(0x80, 0x80, 0x00),
+    Colors.BROWN: RGBColor(0x8B, 0x45, 0x13),
+    Colors.LIGHTBROWN: RGBColor(0xBC, 0x8F, 0x8F),
+    Colors.TAN: RGBColor(0xD2, 0xB4, 0x8C),
+    Colors.GOLD: RGBColor(0xFF, 0xD7, 0x00),
+    Colors.DEEPERSKYBLUE: RGBColor(0x55, 0xAA, 0xFF)
 })
 
+BRIGHTNESS_LEVELS = 11 # Brightness goes from 0 (black) to 10 (the full color)
+
+# RGB of every 8-bit color index, reserved indexes are bright red as the specification demands
+PALETTE : tuple[RGBColor, ...] = tuple(ColorMap.get(index_to_name(index), ColorMap[Colors.BRED]) for index in range(256))
+
+# RGB of every color index at every brightness, 3 bytes at ((index * BRIGHTNESS_LEVELS) + brightness) * 3
+PALETTE_LUT : bytes = bytes(channel * brightness // (BRIGHTNESS_LEVELS - 1)
+                            for color in PALETTE for brightness in range(BRIGHTNESS_LEVELS) for channel in color)
+
 def map_color(color : int) -> RGBColor:
     """
     Map index to their colors.
     This function unlike index_to_name, would return the default color of BRED if an index is invalid.
     This default value is conformant to the specification of VQsX.
     """
-    color : Colors | int | None = index_to_name(color)
-    if color is None: color = Colors.BRED
-    return ColorMap[color]
+    if 0 <= color < len(PALETTE):
+        return PALETTE[color]
+    return PALETTE[Colors.BRED]
+
+_palette_array = None
+def palette_array():
+    """
+    PALETTE_LUT as a read-only NumPy array of uint8, indexed by color index, brightness and channel.
+    Shading a whole array of segments is then a single lookup, like palette_array()[colors, brightnesses].
+
+    This requires NumPy.
+    """
+    global _palette_array
+    if _palette_array is None:
+        import numpy as np
+        _palette_array = np.frombuffer(PALETTE_LUT, dtype=np.uint8).reshape(len(PALETTE), BRIGHTNESS_LEVELS, 3)
+    return _palette_array
 
 
 # VQsX Bytecode Utilities
@@ -162,7 +199,6 @@ INSTRUCTION_UNARY8_PACK = f"{ENDIANESS}B{INSTRUCTION_RAWUNARY8_PACK}" # Struct f
 INSTRUCTION_UNARYF_PACK = f"{ENDIANESS}B{INSTRUCTION_RAWUNARYF_PACK}" # Struct fmt argument for packing unary opcodes with a 64-bit IEEE 754 operand.
 
 @enum.unique
-@enum.verify(enum.CONTINUOUS)
 class Instructions(enum.IntEnum, enum.ReprEnum):
     """
     Enum for instructions and their opcodes
@@ -211,6 +247,8 @@ class MnemonicEntry(typing.NamedTuple):
     mnemonic : str
 
 INSTRUCTION_COUNT = len(Instructions)
+if [*Instructions] != list(range(INSTRUCTION_COUNT)):
+    raise ValueError("INSTRUCTION_LENGTHS and the decoding and dispatch tables index instructions by opcode, so they can't have gaps")
 
 MnemonicMapping : types.MappingProxyType = types.MappingProxyType({
     Instructions.NULL: MnemonicEntry(Instructions.NULL, "null", "nul"),
@@ -221,10 +259,75 @@ MnemonicMapping : types.MappingProxyType = types.MappingProxyType({
     Instructions.BRIGHTNESS: MnemonicEntry(Instructions.BRIGHTNESS, "brightness", "bri"),
     Instructions.SCALE: MnemonicEntry(Instructions.SCALE, "scale", "scl"),
     Instructions.COLOR: MnemonicEntry(Instructions.COLOR, "color", "clr"),
-    # FILL
+    Instructions.DRAW: MnemonicEntry(Instructions.DRAW, "draw", "draw"),
+    Instructions.FORWARD: MnemonicEntry(Instructions.FORWARD, "forward", "fwd"),
+    Instructions.BACKWARDS: MnemonicEntry(Instructions.BACKWARDS, "backwards", "bwd"),
+    Instructions.DRAWFORWARD: MnemonicEntry(Instructions.DRAWFORWARD, "drawforward", "dfw"),
+    Instructions.DRAWBACKWARDS: MnemonicEntry(Instructions.DRAWBACKWARDS, "drawbackward", "dbw"),
+    Instructions.ROTATEDEG: MnemonicEntry(Instructions.ROTATEDEG, "rotatedeg", "rotd"),
+    Instructions.ROTATERAD: MnemonicEntry(Instructions.ROTATERAD, "rotaterad", "rotr"),
+    Instructions.ROTATERDEG: MnemonicEntry(Instructions.ROTATERDEG, "rotaterdeg", "rotrd"),
+    Instructions.ROTATERRAD: MnemonicEntry(Instructions.ROTATERRAD, "rotaterrad", "rotrr"),
+    Instructions.ROTATEORIGIN: MnemonicEntry(Instructions.ROTATEORIGIN, "rotateorigin", "roto"),
+    Instructions.ROTATESETORIGIN: MnemonicEntry(Instructions.ROTATESETORIGIN, "rotatesetorigin", "rotso"),
+    Instructions.STPUSH: MnemonicEntry(Instructions.STPUSH, "stpush", "stpush"),
+    Instructions.STPOP: MnemonicEntry(Instructions.STPOP, "stpop", "stpop"),
+    Instructions.PSPUSH: MnemonicEntry(Instructions.PSPUSH, "pspush", "pspush"),
+    Instructions.PSPOP: MnemonicEntry(Instructions.PSPOP, "pspop", "pspop"),
+    Instructions.INITIALIZE: MnemonicEntry(Instructions.INITIALIZE, "initialize", "init"),
+    Instructions.JUMP: MnemonicEntry(Instructions.JUMP, "jump", "jmp"),
+    Instructions.CALL: MnemonicEntry(Instructions.CALL, "call", "call"),
+    Instructions.JUMPIPC: MnemonicEntry(Instructions.JUMPIPC, "jumpipc", "jipc"),
+    Instructions.CALLIPC: MnemonicEntry(Instructions.CALLIPC, "callipc", "cipc"),
+    Instructions.JUMPMST: MnemonicEntry(Instructions.JUMPMST, "jumpmst", "jmst"),
+    Instructions.CALLMST: MnemonicEntry(Instructions.CALLMST, "callmst", "cmst"),
+    Instructions.RETURN: MnemonicEntry(Instructions.RETURN, "return", "ret"),
+    Instructions.HALT: MnemonicEntry(Instructions.HALT, "halt", "halt"),
+    Instructions.WAITNEXT: MnemonicEntry(Instructions.WAITNEXT, "waitnext", "wnxt"),
     Instructions.NOOP: MnemonicEntry(Instructions.NOOP, "no-operation", "nop")
 })
 
+# Operands of each instruction, as raw struct fmt arguments. Operandless instructions have an empty fmt argument.
+OperandMapping : types.MappingProxyType = types.MappingProxyType({
+    Instructions.NULL: "",
+    Instructions.POSITION: INSTRUCTION_RAWBINARYOP8_PACK,
+    Instructions.CENTER: "",
+    Instructions.ORIGIN: "",
+    Instructions.SETORIGIN: INSTRUCTION_RAWUNARY1_PACK,
+    Instructions.BRIGHTNESS: INSTRUCTION_RAWUNARY1_PACK,
+    Instructions.SCALE: INSTRUCTION_RAWUNARY1_PACK,
+    Instructions.COLOR: INSTRUCTION_RAWUNARY1_PACK,
+    Instructions.DRAW: INSTRUCTION_RAWBINARYOP8_PACK,
+    Instructions.FORWARD: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.BACKWARDS: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.DRAWFORWARD: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.DRAWBACKWARDS: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.ROTATEDEG: INSTRUCTION_RAWUNARYF_PACK,
+    Instructions.ROTATERAD: INSTRUCTION_RAWUNARYF_PACK,
+    Instructions.ROTATERDEG: INSTRUCTION_RAWUNARYF_PACK,
+    Instructions.ROTATERRAD: INSTRUCTION_RAWUNARYF_PACK,
+    Instructions.ROTATEORIGIN: "",
+    Instructions.ROTATESETORIGIN: INSTRUCTION_RAWUNARY1_PACK,
+    Instructions.STPUSH: "",
+    Instructions.STPOP: "",
+    Instructions.PSPUSH: "",
+    Instructions.PSPOP: "",
+    Instructions.INITIALIZE: "",
+    Instructions.JUMP: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.CALL: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.JUMPIPC: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.CALLIPC: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.JUMPMST: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.CALLMST: INSTRUCTION_RAWUNARY8_PACK,
+    Instructions.RETURN: "",
+    Instructions.HALT: "",
+    Instructions.WAITNEXT: "",
+    Instructions.NOOP: ""
+})
+
+# Length of each instruction in bytes (opcode and operands), indexed by opcode.
+INSTRUCTION_LENGTHS : tuple[int, ...] = tuple(struct.calcsize(f"{INSTRUCTION_PACK}{OperandMapping[inst]}") for inst in Instructions)
+
 def inst_to_int(inst : Instructions) -> int:
     """
     Function to convert instructions into integers.
@@ -255,6 +358,15 @@ def inst_to_name(inst : Instructions) -> MnemonicEntry | None:
 
     return MnemonicMapping[inst]
 
+def inst_to_operands(inst : Instructions) -> str:
+    """
+    Function to obtain the operands of an instruction.
+
+    Return value is the raw struct fmt argument of the operands, one character per operand. Operandless instructions return an empty string.
+    """
+
+    return OperandMapping[inst]
+
 def is_noop(inst : Instructions, isnull_noop : bool) -> bool:
     """
     Function to check if instruction is a no-op
@@ -333,8 +445,6 @@ def str_to_sov(name : str) -> SetOriginValues:
 # Constants useful for the status register
 # Its used with bitfields and bitmasks
 @enum.unique
-@enum.verify(enum.CONTINUOUS)
-@enum.verify(enum.NAMED_FLAGS)
 class StatusFlags(enum.IntFlag, enum.ReprEnum):
     """
     Flags providing values
@@ -348,6 +458,8 @@ STATUS_ZERO = StatusFlags.ZERO
 STATUS_HALTED = StatusFlags.HALTED
 STATUS_NEXT = StatusFlags.NEXT
 STATUS_FAULT = StatusFlags.FAULT
+if [*StatusFlags] != [1 << bit for bit in range(len(StatusFlags))]:
+    raise ValueError("The VM indexes a table by every combination of status flags, so they can't have gaps")
 
 # good utilities for status
 def status_stringify(stat : StatusFlags) -> str:
@@ -387,3 +499,5 @@ VQSXI_MAGIC = list(b"VQsXi")
 VQSXI_DIM_FORMAT = f"{ENDIANESS}QQ" # struct fmt argument for VQsXi dimensions
 VQSXI_CDEPTH_FORMAT = f"{ENDIANESS}?" # struct fmt argument for VQsXi color depth
 VQSXI_BYTECODELEN_FORMAT = f"{ENDIANESS}Q" # struct fmt argument for VQsXi bytecode length
+VQSXI_PADDING = 34 # Reserved NUL bytes at the end of the VQsXi header
+VQSXI_HEADER_SIZE = 64 # Size of the VQsXi header, padding included
@@ -3,12 +3,409 @@ Library for disassembling VQsX binaries back to their assembly.
 """
 
 from .constants import Instructions, is_noop
+from .constants import ENDIANESS, INSTRUCTION_LENGTHS, OperandMapping, MnemonicMapping
+from .constants import int_to_inst, is_halt
+from .vm import NullOpBehavior
+import struct, mmap
+import typing, bisect
+import hashlib, threading
+import collections, collections.abc as cabc
+import array
 
-__all__ = ["Disassembler"]
+__all__ = ["Disassembler", "Disassembled", "BasicBlock", "ControlFlowGraph", "ARRAY_FIELDS"]
+
+# Decoding table indexed by opcode: the length of the instruction and the unpacker of its operands.
+# Illegal opcodes take a single byte and have no unpacker, operandless instructions have no unpacker either.
+_DECODERS : tuple[tuple[int, typing.Callable | None], ...] = tuple(
+    (INSTRUCTION_LENGTHS[opcode], struct.Struct(f"{ENDIANESS}{OperandMapping[Instructions(opcode)]}").unpack_from if OperandMapping[Instructions(opcode)] else None)
+    if opcode < len(INSTRUCTION_LENGTHS) else (1, None)
+    for opcode in range(256)
+)
+
+# Jumps and calls, and how their operand is turned into an address
+_ABSOLUTE, _IPC, _MST = range(3)
+_JUMPS : dict[Instructions, int] = {Instructions.JUMP: _ABSOLUTE, Instructions.JUMPIPC: _IPC, Instructions.JUMPMST: _MST}
+_CALLS : dict[Instructions, int] = {Instructions.CALL: _ABSOLUTE, Instructions.CALLIPC: _IPC, Instructions.CALLMST: _MST}
+_BRANCHES : dict[int, int] = {int(inst): kind for inst, kind in (_JUMPS | _CALLS).items()}
+
+# Spellings of the absolute jump and call, as JUMP and CALL are syntactic sugar for the IPC or MST ones in the assembler
+_SPELLINGS : dict[Instructions, str] = {Instructions.JUMP: "JUMPABS", Instructions.CALL: "CALLABS"}
+
+# Fields of the records of decode_array(). Operands are spread over the fields by their struct fmt code, missing operands are 0.
+ARRAY_FIELDS : tuple[tuple[str, str], ...] = (("address", "<u8"), ("opcode", "u1"), ("op1", "<i8"), ("op2", "<i8"), ("fop", "<f8"))
+
+# Instruction lengths for every possible opcode, illegal opcodes take a single byte
+_LENGTHS : tuple[int, ...] = tuple(length for length, _ in _DECODERS)
+
+class Disassembled(typing.NamedTuple):
+    """
+    Class for representing a single disassembled instruction.
+
+    Illegal opcodes have no operands. Instructions cut short by the end of the binary have None as operands.
+    """
+    address : int
+    opcode : int
+    operands : tuple[int | float, ...] | None
+
+    @property
+    def inst(self) -> Instructions | None:
+        """
+        The instruction, or None if the opcode is illegal.
+        """
+        return int_to_inst(self.opcode)
+
+    @property
+    def target(self) -> int | None:
+        """
+        The address that a jump or call transfers control to, or None for other instructions.
+
+        The memory start is the start of the binary, as the VM only ever sees the binary from its GOEXEC location onwards.
+        """
+        kind = _BRANCHES.get(self.opcode)
+        if kind is None or not self.operands:
+            return None
+        if kind == _IPC: # Relative to the end of the instruction, where IPC points to once it is fetched
+            return self.address + INSTRUCTION_LENGTHS[self.opcode] + self.operands[0]
+        return self.operands[0]
+
+class BasicBlock(typing.NamedTuple):
+    """
+    Class for representing a basic block, a straight run of instructions that is only entered at its start and only left at its end.
+
+    Successors are the addresses that control flows to from the end of the block, calls excluded. The return address of a call is a successor of the block ending with the call.
+    Successors may lie outside of the binary, in which case there is no block for them.
+    """
+    start : int
+    end : int # Address right after the last instruction
+    instructions : tuple[Disassembled, ...]
+    successors : tuple[int, ...]
+    calls : tuple[int, ...] # Addresses of the subroutines called at the end of the block
+
+    @property
+    def terminator(self) -> Disassembled:
+        """
+        The last instruction of the block.
+        """
+        return self.instructions[-1]
+
+class ControlFlowGraph(object):
+    """
+    The control flow graph of a VQsX binary, as recovered by a recursive traversal from the entry point.
+
+    Blocks are keyed and ordered by their start address. Only code reachable from the entry point is part of the graph.
+    Labels are synthesized for every block that is the target of a jump or a call: START for the entry point, SUB_xxxx for subroutines and L_xxxx otherwise.
+    """
+
+    def __init__(self, blocks : dict[int, BasicBlock], entry : int, subroutines : cabc.Iterable[int], targets : cabc.Iterable[int]):
+        self.blocks : dict[int, BasicBlock] = dict(sorted(blocks.items()))
+        self.entry : int = entry
+        self.subroutines : frozenset[int] = frozenset(subroutines)
+        self.__starts : list[int] = list(self.blocks)
+
+        self.labels : dict[int, str] = {}
+        for address in sorted(set(targets) | self.subroutines | {entry}):
+            if address not in self.blocks:
+                continue
+            if address == entry:
+                self.labels[address] = "START"
+            elif address in self.subroutines:
+                self.labels[address] = f"SUB_{address:04X}"
+            else:
+                self.labels[address] = f"L_{address:04X}"
+
+        self.predecessors : dict[int, tuple[int, ...]] = {}
+        edges : dict[int, list[int]] = collections.defaultdict(list)
+        for block in self.blocks.values():
+            for successor in block.successors:
+                edges[successor].append(block.start)
+        self.predecessors = {address: tuple(edges.get(address, ())) for address in self.blocks}
+
+    def __iter__(self) -> cabc.Iterator[BasicBlock]:
+        return iter(self.blocks.values())
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def block_at(self, address : int) -> BasicBlock | None:
+        """
+        Obtain the block holding an address, or None if the address isn't part of any block.
+        """
+        index = bisect.bisect_right(self.__starts, address) - 1
+        if index < 0:
+            return None
+        block = self.blocks[self.__starts[index]]
+        return block if address < block.end else None
+
+    def leaders(self) -> list[int]:
+        """
+        Obtain the start addresses of the blocks, in ascending order.
+        """
+        return list(self.__starts)
+
+    def label(self, record : Disassembled) -> str | None:
+        """
+        Obtain the label for the target of a jump or call, if there is one.
+        """
+        target = record.target
+        return self.labels.get(target) if target is not None else None
+
+    def listing(self, bytecode : bytes | bytearray | memoryview | mmap.mmap | None = None) -> cabc.Generator[str, None, None]:
+        """
+        Render the graph as VQsX assembly, with labels for the blocks and label references for jumps and calls.
+
+        Blocks are laid out in address order. Given the binary, the gaps between blocks are disassembled with a linear sweep under a comment, so that the layout of the binary is kept.
+        """
+        render = Disassembler.render
+        address = 0
+        for block in self.blocks.values():
+            if block.start > address and bytecode is not None:
+                yield f"# Unreached 0x{address:04X}-0x{block.start:04X}"
+                yield from Disassembler(bytecode).listing(address, block.start)
+            if block.start in self.labels:
+                yield f":{self.labels[block.start]}:"
+            for record in block.instructions:
+                yield render(record, self.label)
+            address = max(address, block.end)
+
+        if bytecode is not None and address < len(bytecode):
+            yield f"# Unreached 0x{address:04X}-0x{len(bytecode):04X}"
+            yield from Disassembler(bytecode).listing(address)
+
+# Recovered graphs, by the digest of the binary and how it was analyzed. Shared by all disassemblers and guarded by a lock.
+_GRAPHS : collections.OrderedDict[bytes, ControlFlowGraph] = collections.OrderedDict()
+_GRAPHS_LOCK = threading.Lock()
+_GRAPHS_SIZE = 64
 
 class Disassembler(object):
     """
     This disassembler class converts a VQsX binary into its semantically corresponding VQsX assembly.
     This disassembler does not convert into a one-to-one match as elements such as labels are lost during assembly.
+
+    The binary can be anything that supports the buffer protocol, such as bytes, a memoryview or an mmap. It is never copied, so even huge binaries are disassembled in constant memory.
     """
-    pass
\ No newline at end of file
+
+    def __init__(self, bytecode : bytes | bytearray | memoryview | mmap.mmap):
+        self.bytecode = bytecode
+
+    def decode(self, address : int) -> Disassembled | None:
+        """
+        Disassemble the single instruction at an address.
+
+        None is returned if the address lies outside of the binary.
+        """
+        if not 0 <= address < len(self.bytecode):
+            return None
+        return next(self.sweep(address, address + _DECODERS[self.bytecode[address]][0]))
+
+    def sweep(self, start : int = 0, stop : int | None = None) -> cabc.Generator[Disassembled, None, None]:
+        """
+        Disassemble the binary with a linear sweep, from start to stop.
+
+        Every byte is assumed to be code. An illegal opcode is yielded on its own and the sweep carries on with the next byte.
+        An instruction cut short by the end of the binary is yielded with None as operands and ends the sweep.
+        """
+        bytecode = self.bytecode
+        end = len(bytecode) if stop is None else min(stop, len(bytecode))
+        decoders = _DECODERS
+        make = Disassembled._make # Skips the keyword handling of the constructor, which dominates the sweep
+        address = start
+
+        while address < end:
+            opcode = bytecode[address]
+            length, unpack = decoders[opcode]
+
+            if address + length > end:
+                yield make((address, opcode, None))
+                return
+
+            yield make((address, opcode, () if unpack is None else unpack(bytecode, address + 1)))
+            address += length
+
+    def __iter__(self) -> cabc.Iterator[Disassembled]:
+        return self.sweep()
+
+    def offsets(self, start : int = 0, stop : int | None = None) -> array.array:
+        """
+        Find the address of every instruction of a linear sweep, from start to stop.
+
+        This is the only part of decode_array() that has to look at the instructions one by one, so it does nothing but add up lengths.
+        An instruction cut short by the end of the binary is left out.
+        """
+        bytecode = self.bytecode
+        end = len(bytecode) if stop is None else min(stop, len(bytecode))
+        lengths = _LENGTHS
+        offsets = array.array("Q")
+        append = offsets.append
+        address = start
+
+        while address < end:
+            append(address)
+            address += lengths[bytecode[address]]
+
+        if address > end:
+            offsets.pop()
+        return offsets
+
+    def decode_array(self, start : int = 0, stop : int | None = None):
+        """
+        Disassemble the binary into a NumPy structured array with a linear sweep, from start to stop.
+
+        Each record has the fields of ARRAY_FIELDS: the address, the opcode, the integer operands and the floating point operand. Illegal opcodes are kept as records without operands.
+        Once the instructions are found, the operands are gathered for all the instructions at once, so the fields can be sliced and aggregated without any Python loop.
+
+        This requires NumPy.
+        """
+        import numpy as np
+
+        offsets = np.frombuffer(self.offsets(start, stop), dtype=np.uint64).astype(np.intp)
+        bytecode = np.frombuffer(self.bytecode, dtype=np.uint8)
+
+        decoded = np.zeros(len(offsets), dtype=list(ARRAY_FIELDS))
+        decoded["address"] = offsets
+        opcodes = bytecode[offsets]
+        decoded["opcode"] = opcodes
+
+        # Operand fmt code of every opcode, by position
+        kinds = np.zeros((256, 2), dtype="U1")
+        for inst, fmt in OperandMapping.items():
+            kinds[int(inst), :len(fmt)] = list(fmt)
+        kinds = kinds[opcodes]
+
+        def gather(selected, position : int, dtype : str, size : int):
+            # Gather the bytes of an operand of the selected instructions and reinterpret them
+            index = offsets[selected, None] + (1 + position) + np.arange(size)
+            return bytecode[index].copy().view(dtype).ravel()
+
+        byte = kinds[:, 0] == "b"
+        decoded["op1"][byte] = gather(byte, 0, "i1", 1)
+        quad = kinds[:, 0] == "q"
+        decoded["op1"][quad] = gather(quad, 0, "<i8", 8)
+        quad2 = kinds[:, 1] == "q"
+        decoded["op2"][quad2] = gather(quad2, 8, "<i8", 8)
+        double = kinds[:, 0] == "d"
+        decoded["fop"][double] = gather(double, 0, "<f8", 8)
+
+        return decoded
+
+    @staticmethod
+    def render(record : Disassembled, label : typing.Callable[[Disassembled], str | None] | None = None) -> str:
+        """
+        Render a disassembled instruction as a line of assembly.
+
+        Illegal and truncated instructions are rendered as comments, since they can't be assembled. Everything else assembles back to the same bytes.
+        The label callback, if given, may return a label to reference in place of the operand of jumps and calls.
+        """
+        inst = record.inst
+        if inst is None:
+            return f"    # Illegal opcode 0x{record.opcode:02X}"
+        name = _SPELLINGS.get(inst) or MnemonicMapping[inst].name.upper()
+        if record.operands is None:
+            return f"    # Truncated {name}"
+
+        target = label(record) if label is not None else None
+        operands = target if target is not None else ", ".join(map(repr, record.operands))
+        return f"    {name} {operands}" if operands else f"    {name}"
+
+    def analyze(self, entry : int = 0, nullmode : NullOpBehavior = NullOpBehavior.FAULT) -> ControlFlowGraph:
+        """
+        Recover the control flow graph of the binary with a recursive traversal from the entry point.
+
+        Jumps and calls are followed to their targets, calls also fall through to their return address. Control stops at returns, halts, illegal and truncated instructions and the end of the binary.
+        NULL stops control too, unless it is a no-op as per the null opcode behavior.
+
+        The graph is cached by the digest of the binary, so analyzing the same binary again is free.
+        """
+        key = hashlib.blake2b(self.bytecode, digest_size=16, person=f"{entry}:{int(nullmode)}".encode()[:16]).digest()
+        with _GRAPHS_LOCK:
+            graph = _GRAPHS.get(key)
+            if graph is not None:
+                _GRAPHS.move_to_end(key)
+                return graph
+
+        graph = self.__traverse(entry, nullmode)
+
+        with _GRAPHS_LOCK:
+            _GRAPHS[key] = graph
+            if len(_GRAPHS) > _GRAPHS_SIZE:
+                _GRAPHS.popitem(last=False)
+
+        return graph
+
+    def __traverse(self, entry : int, nullmode : NullOpBehavior) -> ControlFlowGraph:
+        """
+        Find every reachable instruction, then split them up into blocks.
+        """
+        null_ishalt = nullmode != NullOpBehavior.NOOP # A faulty NULL stops control just like a halting one
+        length = len(self.bytecode)
+
+        records : dict[int, Disassembled] = {}
+        leaders : set[int] = {entry}
+        targets : set[int] = set()
+        subroutines : set[int] = set()
+        pending : list[int] = [entry]
+
+        while pending:
+            address = pending.pop()
+            while 0 <= address < length and address not in records:
+                record = self.decode(address)
+                records[address] = record
+                inst = record.inst
+                if inst is None or record.operands is None or inst == Instructions.RETURN or is_halt(inst, null_ishalt):
+                    break
+
+                address += INSTRUCTION_LENGTHS[inst]
+                target = record.target
+                if target is None:
+                    continue
+
+                targets.add(target)
+                leaders.add(target)
+                pending.append(target)
+                if inst in _JUMPS:
+                    break
+                subroutines.add(target)
+                leaders.add(address) # Calls end their block, the return address starts the next one
+
+        # Split the instructions into blocks
+        blocks : dict[int, BasicBlock] = {}
+        current : list[Disassembled] = []
+
+        def close(record : Disassembled):
+            inst = record.inst
+            successors, calls = (), ()
+            end = record.address + _DECODERS[record.opcode][0]
+            if record.operands is None: # Truncated, it runs up to the end of the binary
+                end = length
+            elif inst in _JUMPS:
+                successors = (record.target,)
+            elif inst in _CALLS:
+                successors, calls = (end,), (record.target,)
+            elif inst is not None and not (inst == Instructions.RETURN or is_halt(inst, null_ishalt)) and end < length:
+                successors = (end,)
+            blocks[current[0].address] = BasicBlock(current[0].address, end, tuple(current), successors, calls)
+
+        for address in sorted(records):
+            record = records[address]
+            if current and (address in leaders or address != current[-1].address + _DECODERS[current[-1].opcode][0]):
+                close(current[-1])
+                current = []
+            current.append(record)
+
+            inst = record.inst
+            if inst is None or record.operands is None or inst in _JUMPS or inst in _CALLS or inst == Instructions.RETURN or is_halt(inst, null_ishalt):
+                close(record)
+                current = []
+        if current:
+            close(current[-1])
+
+        return ControlFlowGraph(blocks, entry, subroutines, targets)
+
+    def listing(self, start : int = 0, stop : int | None = None, addresses : bool = False) -> cabc.Generator[str, None, None]:
+        """
+        Disassemble the binary into lines of VQsX assembly, with a linear sweep.
+
+        With addresses, each line ends with a comment holding the address of the instruction.
+        """
+        for record in self.sweep(start, stop):
+            line = self.render(record)
+            yield f"{line:<40}# 0x{record.address:08X}" if addresses else line
@@ -0,0 +1,610 @@
+"""
+Library for evaluating the geometry of VQsX binaries.
+
+Instead of notifying observers of every instruction like the VM does, the geometry evaluator runs a binary straight into the line segments it draws.
+The segments are in world coordinates, with the center of the drawing area as (0, 0) and y pointing up, just like the turtle.
+
+Subroutines that only move, draw and rotate relative to the pen draw the same shape wherever they're called from, only moved and rotated along with the pen.
+Such subroutines are evaluated once per scale and then replayed through a single affine transform on every other call.
+"""
+
+from .constants import Instructions, INSTRUCTION_COUNT, SetOriginValues, is_noop, is_halt
+from .vm import NullOpBehavior
+from .disasm import _DECODERS, _BRANCHES, _IPC, _JUMPS, _CALLS
+from . import types as vqsxtypes
+import typing, math, os, array, itertools
+import collections.abc as cabc
+import concurrent.futures as futures
+
+__all__ = ["Segment", "SEGMENT_FIELDS", "PenState", "CutPoint", "INITIAL_STATE",
+           "Geometry", "GeometryEvaluator",
+           "cut_points", "evaluate_parallel"]
+
+class Segment(typing.NamedTuple):
+    """
+    Class for representing a single drawn line segment, along with the color index and brightness it was drawn with.
+    """
+    x1 : float
+    y1 : float
+    x2 : float
+    y2 : float
+    color : int
+    brightness : int
+
+SEGMENT_FIELDS : tuple[str, ...] = Segment._fields # Columns of Geometry.array()
+
+class PenState(typing.NamedTuple):
+    """
+    Class for representing the complete state of the pen, which is everything the drawing past some point depends on other than the call stack.
+    """
+    x : float
+    y : float
+    heading : float # Degrees counterclockwise from east
+    color : int
+    scale : int
+    brightness : int
+    rotorigin : int
+    posorigin : SetOriginValues
+    states : tuple[tuple, ...] # The state stack, bottom first
+    positions : tuple[tuple[float, float], ...] # The position stack, bottom first
+
+class CutPoint(typing.NamedTuple):
+    """
+    Class for representing an address where the evaluation can start over, along with the pen state it starts with.
+    """
+    address : int
+    state : PenState
+
+# Initial pen state, see the Initial State section of the instruction set
+_INITIAL_COLOR = 13
+_INITIAL_SCALE = 1
+_INITIAL_BRIGHTNESS = 10
+_INITIAL_ROTORIGIN = 1
+_INITIAL_POSORIGIN = SetOriginValues.CENTER
+
+_ROTORIGIN_HEADINGS : tuple[float, ...] = (0.0, 90.0) # Heading of each rotational origin, in degrees counterclockwise from east
+_INITIAL_HEADING = _ROTORIGIN_HEADINGS[_INITIAL_ROTORIGIN] # The pen starts out facing its rotational origin
+
+INITIAL_STATE = PenState(0.0, 0.0, _INITIAL_HEADING, _INITIAL_COLOR, _INITIAL_SCALE, _INITIAL_BRIGHTNESS, _INITIAL_ROTORIGIN, _INITIAL_POSORIGIN, (), ())
+
+# Instructions a subroutine may consist of to be replayed, along with RETURN and NOOP
+_MOVES : dict[Instructions, tuple[int, bool]] = { # Direction and whether the move draws
+    Instructions.FORWARD: (1, False),
+    Instructions.BACKWARDS: (-1, False),
+    Instructions.DRAWFORWARD: (1, True),
+    Instructions.DRAWBACKWARDS: (-1, True),
+}
+_TURNS : dict[Instructions, typing.Callable[[float], float]] = { # Change of heading, in degrees
+    Instructions.ROTATEDEG: lambda angle: angle,
+    Instructions.ROTATERDEG: lambda angle: -angle,
+    Instructions.ROTATERAD: math.degrees,
+    Instructions.ROTATERRAD: lambda angle: -math.degrees(angle),
+}
+
+_MOVE_OPCODES : frozenset[int] = frozenset(map(int, _MOVES))
+_TURN_OPCODES : dict[int, typing.Callable[[float], float]] = {int(inst): turn for inst, turn in _TURNS.items()}
+
+_VECTORIZE_MIN = 16 # Replays of fewer segments than this are faster without NumPy
+
+_numpy_module = None
+def _numpy():
+    """
+    Import NumPy once, None if it isn't installed.
+    """
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+class _Recording(typing.NamedTuple):
+    """
+    Geometry of a replayable subroutine, evaluated with the pen at (0, 0) facing east.
+    """
+    segments : typing.Any # NumPy array of x1, y1, x2, y2 rows, or a list of such tuples
+    end : tuple[float, float] # Where the pen ends up
+    turn : float # How much the pen turned, in degrees
+
+class Geometry(object):
+    """
+    The segments drawn by a binary, in drawing order.
+
+    Segments are kept in chunks, so replays are never split into single segments unless iterated over.
+    A chunk is either a list of Segments, a NumPy array of replayed subroutines or a flat array.array of doubles with a row of SEGMENT_FIELDS per segment.
+    """
+
+    def __init__(self):
+        self.__chunks : list = []
+        self.__length : int = 0
+
+    def extend(self, segments):
+        """
+        Append a chunk of segments.
+        """
+        count = len(segments) // len(SEGMENT_FIELDS) if isinstance(segments, array.array) else len(segments)
+        if count:
+            self.__chunks.append(segments)
+            self.__length += count
+
+    @property
+    def chunks(self) -> tuple:
+        return tuple(self.__chunks)
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def __iter__(self) -> cabc.Iterator[Segment]:
+        for chunk in self.__chunks:
+            if isinstance(chunk, list):
+                yield from chunk
+            elif isinstance(chunk, array.array):
+                for i in range(0, len(chunk), len(SEGMENT_FIELDS)):
+                    yield Segment(chunk[i], chunk[i + 1], chunk[i + 2], chunk[i + 3], int(chunk[i + 4]), int(chunk[i + 5]))
+            else:
+                for row in chunk.tolist():
+                    yield Segment(row[0], row[1], row[2], row[3], int(row[4]), int(row[5]))
+
+    def array(self):
+        """
+        All the segments as a single NumPy array of float64, with a column for each of SEGMENT_FIELDS.
+
+        This requires NumPy.
+        """
+        import numpy as np
+
+        if not self.__chunks:
+            return np.empty((0, len(SEGMENT_FIELDS)))
+        return np.concatenate([(np.frombuffer(chunk, dtype=np.float64) if isinstance(chunk, array.array) else np.asarray(chunk, dtype=np.float64)).reshape(-1, len(SEGMENT_FIELDS))
+                               for chunk in self.__chunks])
+
+    def pack(self) -> "array.array":
+        """
+        All the segments as a single flat array.array of doubles, which is much cheaper to send to another process than Segments.
+        """
+        packed = array.array("d")
+        for chunk in self.__chunks:
+            if isinstance(chunk, list):
+                packed.extend(itertools.chain.from_iterable(chunk))
+            elif isinstance(chunk, array.array):
+                packed.extend(chunk)
+            else:
+                packed.frombytes(chunk.astype("<f8", copy=False).tobytes())
+        return packed
+
+class GeometryEvaluator(object):
+    """
+    Evaluator of the geometry drawn by a binary.
+
+    The width and height of the drawing area are only needed to place the top left and bottom left positional origins.
+    Anything the VM would fault on raises VQsXGeometryException. Evaluation stops after limit instructions, if given, so programs that never halt can be evaluated too.
+    WAITNEXT is skipped, as the geometry is the same no matter when the NEXT signal comes.
+
+    Recordings of replayable subroutines are kept across evaluations, the hits and misses attributes count how often they were replayed and recorded.
+    The steps attribute counts the instructions evaluated so far, not counting the ones of replayed subroutines.
+    """
+
+    def __init__(self, bytecode : bytes | bytearray | memoryview, width : int = 0, height : int = 0,
+                 nullmode : NullOpBehavior = NullOpBehavior.FAULT, memoize : bool = True, limit : int | None = None):
+        self.bytecode : bytes = bytes(bytecode)
+        self.width : int = width
+        self.height : int = height
+        self.nullmode : NullOpBehavior = nullmode
+        self.memoize : bool = memoize
+        self.limit : int | None = limit
+
+        self.__null_isnoop : bool = nullmode == NullOpBehavior.NOOP
+        self.__null_ishalt : bool = nullmode == NullOpBehavior.HALT
+
+        self.__decoded : dict[int, tuple[int, tuple, int, int | None]] = {} # Decoded instructions by address
+        self.__replayable : dict[int, bool] = {} # Whether the subroutine at an address is replayable
+        self.__recordings : dict[tuple[int, int], _Recording] = {} # Recordings by subroutine address and scale
+
+        self.hits : int = 0
+        self.misses : int = 0
+        self.steps : int = 0
+
+    def __decode(self, address : int) -> tuple[int, tuple, int, int | None]:
+        """
+        Decode the instruction at an address into its opcode, operands, the address of the next instruction and the target of a jump or call.
+        """
+        decoded = self.__decoded.get(address)
+        if decoded is not None:
+            return decoded
+
+        opcode = self.bytecode[address]
+        if opcode >= INSTRUCTION_COUNT:
+            raise vqsxtypes.VQsXGeometryException(f"Illegal opcode 0x{opcode:02X} at 0x{address:X}!", address)
+        length, unpack = _DECODERS[opcode]
+        following = address + length
+        if following > len(self.bytecode):
+            raise vqsxtypes.VQsXGeometryException(f"{Instructions(opcode).name} at 0x{address:X} is cut short by the end of the binary!", address)
+        operands = unpack(self.bytecode, address + 1) if unpack is not None else ()
+
+        target = None
+        kind = _BRANCHES.get(opcode)
+        if kind is not None:
+            target = following + operands[0] if kind == _IPC else operands[0]
+
+        decoded = (opcode, operands, following, target)
+        self.__decoded[address] = decoded
+        return decoded
+
+    def replayable(self, address : int) -> bool:
+        """
+        Whether the subroutine at an address is replayed instead of evaluated on every call.
+
+        The subroutine must only move, draw and rotate relative to the pen, jump around and return. It must not call other subroutines.
+        """
+        known = self.__replayable.get(address)
+        if known is not None:
+            return known
+
+        replayable = False
+        visited : set[int] = set()
+        position = address
+        try:
+            while 0 <= position < len(self.bytecode) and position not in visited: # Jumps are unconditional, so coming back means looping forever
+                visited.add(position)
+                opcode, operands, following, target = self.__decode(position)
+                inst = Instructions(opcode)
+                if inst == Instructions.RETURN:
+                    replayable = True
+                    break
+                if inst in _JUMPS:
+                    position = target
+                    continue
+                if not (inst in _MOVES or inst in _TURNS or is_noop(inst, self.__null_isnoop) or inst == Instructions.WAITNEXT):
+                    break
+                position = following
+        except vqsxtypes.VQsXGeometryException: # The call faults when it is evaluated
+            pass
+
+        self.__replayable[address] = replayable
+        return replayable
+
+    def __record(self, address : int, scale : int) -> _Recording:
+        """
+        Evaluate a replayable subroutine with the pen at (0, 0) facing east.
+        """
+        x = y = heading = 0.0
+        segments : list[tuple[float, float, float, float]] = []
+
+        position = address
+        while True:
+            opcode, operands, following, target = self.__decode(position)
+            inst = Instructions(opcode)
+            if inst == Instructions.RETURN:
+                break
+            if inst in _JUMPS:
+                position = target
+                continue
+
+            move = _MOVES.get(inst)
+            if move is not None:
+                distance = operands[0] * scale * move[0]
+                theta = math.radians(heading)
+                nx, ny = x + distance * math.cos(theta), y + distance * math.sin(theta)
+                if move[1]:
+                    segments.append((x, y, nx, ny))
+                x, y = nx, ny
+            elif inst in _TURNS:
+                heading += _TURNS[inst](operands[0])
+            position = following
+
+        np = _numpy()
+        if np is not None and len(segments) >= _VECTORIZE_MIN:
+            segments = np.array(segments, dtype=np.float64)
+        return _Recording(segments, (x, y), heading)
+
+    @staticmethod
+    def __replay(recording : _Recording, geometry : Geometry, x : float, y : float, heading : float, color : int, brightness : int) -> tuple[float, float, float]:
+        """
+        Replay a recording with the pen at (x, y) facing heading, returning where the pen ends up and its heading.
+        """
+        theta = math.radians(heading)
+        c, s = math.cos(theta), math.sin(theta)
+
+        local = recording.segments
+        if isinstance(local, list):
+            geometry.extend([Segment(x + c * x1 - s * y1, y + s * x1 + c * y1, x + c * x2 - s * y2, y + s * x2 + c * y2, color, brightness)
+                             for x1, y1, x2, y2 in local])
+        else:
+            np = _numpy()
+            # Rotate every endpoint by the heading and move it to the pen, all at once
+            transform = np.array([[c, s], [-s, c]])
+            placed = np.empty((len(local), len(SEGMENT_FIELDS)))
+            placed[:, 0:2] = local[:, 0:2] @ transform + (x, y)
+            placed[:, 2:4] = local[:, 2:4] @ transform + (x, y)
+            placed[:, 4] = color
+            placed[:, 5] = brightness
+            geometry.extend(placed)
+
+        dx, dy = recording.end
+        return x + c * dx - s * dy, y + s * dx + c * dy, heading + recording.turn
+
+    def origin(self, posorigin : SetOriginValues) -> tuple[float, float, int]:
+        """
+        Where a positional origin lies in world coordinates, along with the direction of its y axis.
+        """
+        if posorigin == SetOriginValues.TOPLEFT:
+            return -self.width / 2, self.height / 2, -1
+        if posorigin == SetOriginValues.BOTTOMLEFT:
+            return -self.width / 2, -self.height / 2, 1
+        return 0.0, 0.0, 1
+
+    def evaluate(self, entry : int = 0, stop : int | None = None, state : PenState = INITIAL_STATE) -> Geometry:
+        """
+        Evaluate the segments drawn by the binary when run from entry with the given pen state, and an empty call stack.
+
+        With stop, evaluation also ends once control reaches the stop address.
+        """
+        length = len(self.bytecode)
+        geometry = Geometry()
+        pending : list[Segment] = [] # Segments drawn since the last replay
+
+        # Pen state
+        x, y, heading, color, scale, brightness, rotorigin, posorigin = state[:8]
+        ox, oy, oys = self.origin(posorigin)
+
+        states : list[tuple] = list(state.states)
+        positions : list[tuple[float, float]] = list(state.positions)
+        calls : list[int] = []
+
+        def fault(message : str):
+            raise vqsxtypes.VQsXGeometryException(message, position)
+
+        position = entry
+        steps = 0
+        while position < length and position != stop:
+            if position < 0:
+                fault(f"Control was transferred to 0x{position:X}, outside of the binary!")
+            steps += 1
+            if self.limit is not None and steps > self.limit:
+                fault(f"Evaluation did not halt within {self.limit} instructions!")
+
+            opcode, operands, following, target = self.__decode(position)
+            inst = Instructions(opcode)
+
+            move = _MOVES.get(inst)
+            if move is not None:
+                distance = operands[0] * scale * move[0]
+                theta = math.radians(heading)
+                nx, ny = x + distance * math.cos(theta), y + distance * math.sin(theta)
+                if move[1]:
+                    pending.append(Segment(x, y, nx, ny, color, brightness))
+                x, y = nx, ny
+            elif inst in _TURNS:
+                heading += _TURNS[inst](operands[0])
+            elif inst in _JUMPS:
+                position = target
+                continue
+            elif inst in _CALLS:
+                if self.memoize and 0 <= target < length and self.replayable(target):
+                    recording = self.__recordings.get((target, scale))
+                    if recording is None:
+                        recording = self.__recordings[(target, scale)] = self.__record(target, scale)
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    geometry.extend(pending)
+                    pending = []
+                    x, y, heading = self.__replay(recording, geometry, x, y, heading, color, brightness)
+                    position = following
+                    continue
+                calls.append(following)
+                position = target
+                continue
+            elif inst == Instructions.RETURN:
+                if not calls:
+                    fault(f"RETURN at 0x{position:X} with an empty call stack!")
+                position = calls.pop()
+                continue
+            elif is_noop(inst, self.__null_isnoop) or inst == Instructions.WAITNEXT:
+                pass
+            elif is_halt(inst, self.__null_ishalt):
+                break
+            elif inst == Instructions.NULL:
+                fault(f"NULL at 0x{position:X} faults!")
+            elif inst == Instructions.POSITION:
+                x, y = ox + operands[0], oy + oys * operands[1]
+            elif inst == Instructions.DRAW:
+                nx, ny = ox + operands[0], oy + oys * operands[1]
+                pending.append(Segment(x, y, nx, ny, color, brightness))
+                x, y = nx, ny
+            elif inst == Instructions.CENTER:
+                x = y = 0.0
+            elif inst == Instructions.ORIGIN:
+                x, y = ox, oy
+            elif inst == Instructions.SETORIGIN:
+                if operands[0] not in SetOriginValues._value2member_map_:
+                    fault(f"SETORIGIN at 0x{position:X} has an invalid origin {operands[0]}!")
+                posorigin = SetOriginValues(operands[0])
+                ox, oy, oys = self.origin(posorigin)
+            elif inst == Instructions.BRIGHTNESS:
+                if not 0 <= operands[0] <= 10:
+                    fault(f"BRIGHTNESS at 0x{position:X} has an invalid brightness {operands[0]}!")
+                brightness = operands[0]
+            elif inst == Instructions.SCALE:
+                scale = operands[0]
+            elif inst == Instructions.COLOR:
+                color = operands[0] & 0xFF # Color indexes are unsigned
+            elif inst == Instructions.ROTATEORIGIN:
+                heading = _ROTORIGIN_HEADINGS[rotorigin]
+            elif inst == Instructions.ROTATESETORIGIN:
+                if not 0 <= operands[0] < len(_ROTORIGIN_HEADINGS):
+                    fault(f"ROTATESETORIGIN at 0x{position:X} has an invalid origin {operands[0]}!")
+                rotorigin = operands[0]
+            elif inst == Instructions.STPUSH:
+                states.append((color, scale, brightness, heading, rotorigin))
+            elif inst == Instructions.STPOP:
+                if not states:
+                    fault(f"STPOP at 0x{position:X} with an empty state stack!")
+                color, scale, brightness, heading, rotorigin = states.pop()
+            elif inst == Instructions.PSPUSH:
+                positions.append((x, y))
+            elif inst == Instructions.PSPOP:
+                if not positions:
+                    fault(f"PSPOP at 0x{position:X} with an empty position stack!")
+                x, y = positions.pop()
+            elif inst == Instructions.INITIALIZE:
+                color, scale, brightness, heading = _INITIAL_COLOR, _INITIAL_SCALE, _INITIAL_BRIGHTNESS, _INITIAL_HEADING
+                rotorigin, posorigin = _INITIAL_ROTORIGIN, _INITIAL_POSORIGIN
+                ox, oy, oys = self.origin(posorigin)
+
+            position = following
+
+        self.steps += steps
+        geometry.extend(pending)
+        return geometry
+
+def cut_points(bytecode : bytes | bytearray | memoryview, width : int = 0, height : int = 0,
+               nullmode : NullOpBehavior = NullOpBehavior.FAULT, entry : int = 0) -> list[CutPoint]:
+    """
+    Find the addresses in the straight-line start of a binary where the drawing no longer depends on anything drawn before.
+
+    The straight-line start runs from the entry up to the first jump, call, return or halt, so control passes every address in it exactly once, with an empty call stack.
+    Everything about the pen other than its position is found out along the way without evaluating anything, as it only changes by constant amounts.
+    The position is known again after an absolute POSITION, CENTER, ORIGIN or DRAW, or popping a known position. A cut point is the first address after which the position and the position stack are known again.
+    """
+    null_isnoop = nullmode == NullOpBehavior.NOOP
+    length = len(bytecode)
+    evaluator = GeometryEvaluator(b"", width, height) # Only places origins
+    cuts : list[CutPoint] = []
+
+    x, y, heading, color, scale, brightness, rotorigin, posorigin, states, positions = INITIAL_STATE
+    states, positions = list(states), list(positions)
+    ox, oy, oys = evaluator.origin(posorigin)
+    placed = True # Whether the position is known
+    unplaced = 0 # Positions on the stack that aren't known
+    independent = True # Whether the drawing past the previous address was independent already
+
+    position = entry
+    while position < length:
+        opcode = bytecode[position]
+        size, unpack = _DECODERS[opcode]
+        if position + size > length: # Faults, which the evaluation of the last chunk reports
+            break
+
+        # Moves and turns make up the bulk of a drawing, skip the rest of the checks for them
+        if opcode in _MOVE_OPCODES:
+            position += size
+            placed = independent = False
+            continue
+        turn = _TURN_OPCODES.get(opcode)
+        if turn is not None:
+            heading += turn(unpack(bytecode, position + 1)[0])
+            position += size
+            continue
+
+        if opcode >= INSTRUCTION_COUNT:
+            break
+        inst = Instructions(opcode)
+        if inst in _JUMPS or inst in _CALLS or inst == Instructions.RETURN or inst == Instructions.HALT or (inst == Instructions.NULL and not null_isnoop):
+            break
+        operands = unpack(bytecode, position + 1) if unpack is not None else ()
+
+        if inst == Instructions.POSITION or inst == Instructions.DRAW:
+            x, y = ox + operands[0], oy + oys * operands[1]
+            placed = True
+        elif inst == Instructions.CENTER:
+            x = y = 0.0
+            placed = True
+        elif inst == Instructions.ORIGIN:
+            x, y = ox, oy
+            placed = True
+        elif inst == Instructions.SETORIGIN:
+            if operands[0] not in SetOriginValues._value2member_map_:
+                break
+            posorigin = SetOriginValues(operands[0])
+            ox, oy, oys = evaluator.origin(posorigin)
+        elif inst == Instructions.BRIGHTNESS:
+            brightness = operands[0]
+        elif inst == Instructions.SCALE:
+            scale = operands[0]
+        elif inst == Instructions.COLOR:
+            color = operands[0] & 0xFF
+        elif inst == Instructions.ROTATEORIGIN:
+            heading = _ROTORIGIN_HEADINGS[rotorigin]
+        elif inst == Instructions.ROTATESETORIGIN:
+            if not 0 <= operands[0] < len(_ROTORIGIN_HEADINGS):
+                break
+            rotorigin = operands[0]
+        elif inst == Instructions.STPUSH:
+            states.append((color, scale, brightness, heading, rotorigin))
+        elif inst == Instructions.STPOP:
+            if not states:
+                break
+            color, scale, brightness, heading, rotorigin = states.pop()
+        elif inst == Instructions.PSPUSH:
+            positions.append((x, y) if placed else None)
+            unplaced += not placed
+        elif inst == Instructions.PSPOP:
+            if not positions:
+                break
+            popped = positions.pop()
+            placed = popped is not None
+            if placed:
+                x, y = popped
+            else:
+                unplaced -= 1
+        elif inst == Instructions.INITIALIZE:
+            color, scale, brightness, heading = _INITIAL_COLOR, _INITIAL_SCALE, _INITIAL_BRIGHTNESS, _INITIAL_HEADING
+            rotorigin, posorigin = _INITIAL_ROTORIGIN, _INITIAL_POSORIGIN
+            ox, oy, oys = evaluator.origin(posorigin)
+
+        position += size
+        if placed and not unplaced:
+            if not independent and position < length:
+                cuts.append(CutPoint(position, PenState(x, y, heading, color, scale, brightness, rotorigin, posorigin, tuple(states), tuple(positions))))
+            independent = True
+        else:
+            independent = False
+
+    return cuts
+
+# Parallel workers. Each process keeps one evaluator, along with its recordings, across all the chunks it evaluates.
+_evaluator : GeometryEvaluator | None = None
+
+def _init_worker(bytecode : bytes, width : int, height : int, nullmode : NullOpBehavior, memoize : bool, limit : int | None):
+    global _evaluator
+    _evaluator = GeometryEvaluator(bytecode, width, height, nullmode, memoize, limit)
+
+def _evaluate_chunk(entry : int, stop : int | None, state : PenState) -> array.array:
+    return _evaluator.evaluate(entry, stop, state).pack()
+
+def evaluate_parallel(bytecode : bytes | bytearray | memoryview, width : int = 0, height : int = 0,
+                      nullmode : NullOpBehavior = NullOpBehavior.FAULT, memoize : bool = True, limit : int | None = None,
+                      workers : int | None = None, chunks : int | None = None, entry : int = 0) -> Geometry:
+    """
+    Evaluate the segments drawn by a binary on a pool of processes.
+
+    The binary is split at its cut points into up to chunks pieces of about the same size, four per worker by default. Each piece is evaluated by a worker, and the segments are merged back in drawing order.
+    A binary without cut points is evaluated in this process. The limit applies to each piece on its own.
+    """
+    bytecode = bytes(bytecode)
+    workers = workers or os.cpu_count() or 1
+    spacing = len(bytecode) / (chunks or workers * 4)
+
+    # Keep the cut points that are far enough apart
+    selected : list[CutPoint] = []
+    last = entry
+    for cut in cut_points(bytecode, width, height, nullmode, entry) if workers > 1 else ():
+        if cut.address - last >= spacing:
+            selected.append(cut)
+            last = cut.address
+    if not selected:
+        return GeometryEvaluator(bytecode, width, height, nullmode, memoize, limit).evaluate(entry)
+
+    entries = [entry, *(cut.address for cut in selected)]
+    stops = [*(cut.address for cut in selected), None]
+    states = [INITIAL_STATE, *(cut.state for cut in selected)]
+
+    geometry = Geometry()
+    with futures.ProcessPoolExecutor(min(workers, len(entries)), initializer=_init_worker,
+                                     initargs=(bytecode, width, height, nullmode, memoize, limit)) as executor:
+        for packed in executor.map(_evaluate_chunk, entries, stops, states): # In order, so the first piece to fault is the one reported
+            geometry.extend(packed)
+    return geometry
@@ -0,0 +1,129 @@
+"""
+Library for linking several VQsX binaries into one.
+
+The optimizer this builds on is only imported once something gets linked, as vqsx imports this module up front.
+"""
+
+from .constants import Instructions, is_halt
+from .constants import VQSXI_MAGIC, VQSXI_DIM_FORMAT, VQSXI_CDEPTH_FORMAT, VQSXI_BYTECODELEN_FORMAT, VQSXI_PADDING
+from .vm import NullOpBehavior, ImageEngine, ByteCodeStream
+import struct
+import collections.abc as cabc
+
+__all__ = ["link", "wrap_vqsxi", "unwrap_vqsxi"]
+
+def _fold_subroutines(nodes : "list[Node]", nullmode : NullOpBehavior) -> int:
+    """
+    Fold byte-identical leaf subroutines into a single copy.
+
+    A leaf subroutine is a straight run of instructions from a call target up to a RETURN, which no other control flow enters.
+    The copies are only dropped if control can't fall into them either. Returns how many copies were dropped.
+    """
+    from .disasm import _BRANCHES, _JUMPS, _CALLS
+
+    null_ishalt = nullmode == NullOpBehavior.HALT
+    alive = [node for node in nodes if not node.dead]
+    index = {id(node): i for i, node in enumerate(alive)}
+    called = {id(node.target): node.target for node in alive if node.inst in _CALLS and node.target is not None and not node.target.dead}
+
+    # Find the body of every leaf subroutine
+    bodies : dict[tuple, list[list[Node]]] = {}
+    for start in called.values():
+        body = []
+        for node in alive[index[id(start)]:]:
+            if node is not start and node.leader:
+                break
+            body.append(node)
+            if node.inst in _BRANCHES or node.inst == Instructions.RETURN or is_halt(node.inst, null_ishalt):
+                break
+        if body[-1].inst != Instructions.RETURN:
+            continue
+
+        # Control can't fall into a copy that comes right after an instruction that never falls through
+        position = index[id(start)]
+        previous = alive[position - 1] if position else None
+        falls = previous is None or not (previous.inst in _JUMPS or previous.inst == Instructions.RETURN or is_halt(previous.inst, null_ishalt))
+
+        key = tuple((node.inst, node.operands) for node in body)
+        bodies.setdefault(key, []).append((falls, body))
+
+    # Keep one copy of each, preferring one that control falls into since that one can't be dropped
+    replacements : dict[int, Node] = {}
+    dropped = 0
+    for copies in bodies.values():
+        if len(copies) < 2:
+            continue
+        copies.sort(key=lambda copy: not copy[0])
+        kept = copies[0][1][0]
+        for falls, body in copies[1:]:
+            if falls:
+                continue
+            replacements[id(body[0])] = kept
+            for node in body:
+                node.dead = True
+            dropped += 1
+
+    for node in nodes:
+        if node.target is not None and id(node.target) in replacements:
+            node.target = replacements[id(node.target)]
+    return dropped
+
+def link(objects : cabc.Iterable[bytes], nullmode : NullOpBehavior = NullOpBehavior.FAULT, initialize : bool = False, fold : bool = True) -> bytes:
+    """
+    Link binaries into a single binary that runs them one after another.
+
+    Each binary is relocated to where it ends up, so its absolute and MST based jumps and calls are adjusted along with the IPC based ones.
+    Halting in any binary but the last one continues with the next binary instead, just like running off its end does.
+    With initialize, every binary after the first starts with INITIALIZE and CENTER, so it starts from the same pen state as it would on its own.
+    With fold, byte-identical leaf subroutines are folded into a single copy.
+
+    Every binary must pass verification under the null opcode behavior, which only checks its structure.
+    """
+    from .optimize import Node, lift, lower, _remove_jumps_to_next
+
+    null_ishalt = nullmode == NullOpBehavior.HALT
+    objects = list(objects)
+    nodes : list[Node] = []
+
+    for i, bytecode in enumerate(objects):
+        lifted = lift(bytecode, nullmode)
+        end = lifted[-1] # Stands in for the end of the object, control that gets there goes on with the next object
+        if i < len(objects) - 1:
+            for node in lifted:
+                if not node.dead and is_halt(node.inst, null_ishalt):
+                    node.inst, node.operands, node.target = Instructions.JUMPIPC, (), end
+
+        if initialize and i > 0:
+            nodes.append(Node(Instructions.INITIALIZE, leader=True))
+            nodes.append(Node(Instructions.CENTER))
+        nodes.extend(lifted)
+
+    if fold:
+        _fold_subroutines(nodes, nullmode)
+    while _remove_jumps_to_next(nodes): # Like the halts that became jumps right to the next binary
+        pass
+
+    return lower(nodes)
+
+def wrap_vqsxi(bytecode : bytes, width : int, height : int, indexed : bool = True) -> bytes:
+    """
+    Wrap a binary into a VQsXi image with the given dimensions.
+
+    Without indexed, the image is in WB graphics instead of indexed-color graphics.
+    """
+    header = bytes(VQSXI_MAGIC)
+    header += struct.pack(VQSXI_DIM_FORMAT, width, height)
+    header += struct.pack(VQSXI_CDEPTH_FORMAT, indexed)
+    header += struct.pack(VQSXI_BYTECODELEN_FORMAT, len(bytecode))
+    header += bytes(VQSXI_PADDING)
+    return header + bytes(bytecode)
+
+def unwrap_vqsxi(image : ByteCodeStream) -> tuple[bytes, int, int, int]:
+    """
+    Unwrap a VQsXi image into its binary, width, height and color depth.
+
+    Invalid images raise the same exceptions as ImageEngine.load().
+    """
+    engine = ImageEngine()
+    engine.load(image)
+    return bytes(engine.bytecode), engine.width, engine.height, engine.colordepth
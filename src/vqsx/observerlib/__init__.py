@@ -4,8 +4,18 @@ This package is for the default VQsX observer implementations.
 All these classes implement the VQsXObserver API in different ways.
 """
 
-from .turtlehandler import TurtleObserver, Packed
 from .obsrv import obsrv
+import importlib
+
+def __getattr__(name : str):
+    """
+    Import the turtle observer, and with it turtle and Tk, on first use.
+    """
+    if name in ("TurtleObserver", "Packed"):
+        value = getattr(importlib.import_module(".turtlehandler", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = [
     "TurtleObserver",
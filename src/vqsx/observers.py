@@ -223,6 +223,7 @@ class VQsXStubObserver(VQsXObserver):
 
     This class is a concrete-stub implementation of the VQsX Abstract Observer.
     Implement the method stubs as needed. This class is intended to be used as an easy-to-inherit class.
+    The VM never calls the methods left as stubs, so events an observer doesn't implement cost nothing.
     """
 
     def onstep(self, post : bool):
@@ -294,5 +295,3 @@ class VQsXStubObserver(VQsXObserver):
 
     def rotatesetorigin(self, origin):
         "stub"
-
-_test = VQsXStubObserver()
@@ -0,0 +1,388 @@
+"""
+Library for optimizing VQsX binaries.
+
+Binaries are lifted into a list of instruction nodes in which jumps and calls refer to the node they target instead of an address.
+The nodes are rewritten, then lowered back into a binary with every jump and call encoded again for the new layout.
+"""
+
+from .constants import Instructions, INSTRUCTION_LENGTHS, is_halt
+from .vm import NullOpBehavior
+from .disasm import _BRANCHES, _IPC, _JUMPS
+from .verify import verify
+from .asm import Builder
+from . import types as vqsxtypes
+import collections.abc as cabc
+
+__all__ = ["Node", "lift", "lower", "peephole", "outline"]
+
+class Node(object):
+    """
+    A single instruction of a lifted binary.
+
+    Jumps and calls have the node they transfer control to as target. Leaders start a basic block, they are the only nodes control can enter other than by falling through.
+    Dead nodes are left out when lowering, control that targets them goes on to the next node that isn't dead.
+    """
+    __slots__ = ("inst", "operands", "target", "leader", "dead")
+
+    def __init__(self, inst : Instructions, operands : tuple = (), target : "Node | None" = None, leader : bool = False):
+        self.inst : Instructions = inst
+        self.operands : tuple = operands
+        self.target : Node | None = target
+        self.leader : bool = leader
+        self.dead : bool = False
+
+    def __repr__(self) -> str:
+        return f"Node({self.inst.name}, {self.operands}{', dead' if self.dead else ''})"
+
+def lift(bytecode : bytes | bytearray | memoryview, nullmode : NullOpBehavior = NullOpBehavior.FAULT) -> list[Node]:
+    """
+    Lift the code reachable from the start of a binary into nodes, in address order.
+
+    The binary must pass verification, as code that faults can't be rewritten without changing how it faults. Only the structure is checked, so control flow and stack instructions are fine. Unreachable code is left out.
+    """
+    verification = verify(bytecode, nullmode)
+    if not verification.ok:
+        raise vqsxtypes.VQsXOptimizerException(f"The binary does not pass verification! {verification.issues[0].message}", verification.issues)
+
+    nodes : dict[int, Node] = {}
+    for block in verification.graph:
+        for record in block.instructions:
+            nodes[record.address] = Node(record.inst, record.operands, leader=record.address == block.start)
+        for record in block.instructions:
+            if record.target is not None:
+                nodes[record.address].target = record.target # Resolved into the node below, once every node exists
+
+    end = Node(Instructions.NOOP) # Stands in for the end of the binary, which jumps may target
+    end.dead = True
+
+    for node in nodes.values():
+        if node.target is not None:
+            node.target = nodes.get(node.target, end)
+    return [*nodes.values(), end]
+
+def _resolve(nodes : list[Node]) -> dict[int, Node | None]:
+    """
+    Map every dead node to the node that control goes on to, None for the end of the binary.
+    """
+    forward : dict[int, Node | None] = {}
+    following = None
+    for node in reversed(nodes):
+        if node.dead:
+            forward[id(node)] = following
+        else:
+            following = node
+    return forward
+
+def lower(nodes : list[Node]) -> bytes:
+    """
+    Lower nodes back into a binary, leaving out the dead ones.
+
+    Jumps and calls are encoded for the new addresses of their targets, keeping their kind (absolute, IPC or MST).
+    """
+    forward = _resolve(nodes)
+
+    addresses : dict[int, int] = {}
+    address = 0
+    for node in nodes:
+        if not node.dead:
+            addresses[id(node)] = address
+            address += INSTRUCTION_LENGTHS[node.inst]
+    end = address
+
+    with Builder() as builder:
+        for node in nodes:
+            if node.dead:
+                continue
+
+            operands = node.operands
+            if node.target is not None:
+                target = node.target
+                if target.dead:
+                    target = forward[id(target)]
+                address = addresses[id(target)] if target is not None else end
+                if _BRANCHES[node.inst] == _IPC:
+                    address -= addresses[id(node)] + INSTRUCTION_LENGTHS[node.inst]
+                operands = (address,)
+
+            builder.instruction(node.inst, *operands)
+
+        return builder.dump()
+
+# Instructions that fold into a single one, along with the instruction for a positive and a negative total and the sign of their operand
+_FOLDS : dict[Instructions, tuple[Instructions, Instructions, int]] = {
+    Instructions.ROTATEDEG: (Instructions.ROTATEDEG, Instructions.ROTATERDEG, 1),
+    Instructions.ROTATERDEG: (Instructions.ROTATEDEG, Instructions.ROTATERDEG, -1),
+    Instructions.ROTATERAD: (Instructions.ROTATERAD, Instructions.ROTATERRAD, 1),
+    Instructions.ROTATERRAD: (Instructions.ROTATERAD, Instructions.ROTATERRAD, -1),
+    Instructions.FORWARD: (Instructions.FORWARD, Instructions.BACKWARDS, 1),
+    Instructions.BACKWARDS: (Instructions.FORWARD, Instructions.BACKWARDS, -1),
+}
+_DISTANCE_LIMIT = 1 << 63 # Distances are signed 64-bit operands
+
+# Instructions that neither read nor replace the pen color
+_COLORLESS : frozenset[Instructions] = frozenset((
+    Instructions.POSITION, Instructions.CENTER, Instructions.ORIGIN, Instructions.SETORIGIN,
+    Instructions.BRIGHTNESS, Instructions.SCALE, Instructions.FORWARD, Instructions.BACKWARDS,
+    Instructions.ROTATEDEG, Instructions.ROTATERAD, Instructions.ROTATERDEG, Instructions.ROTATERRAD,
+    Instructions.ROTATEORIGIN, Instructions.ROTATESETORIGIN, Instructions.PSPUSH, Instructions.PSPOP,
+    Instructions.NOOP,
+))
+# Instructions that read the pen color without replacing it
+_COLOR_READERS : frozenset[Instructions] = frozenset((Instructions.DRAW, Instructions.DRAWFORWARD, Instructions.DRAWBACKWARDS, Instructions.STPUSH))
+
+def _remove_noops(nodes : list[Node], nullmode : NullOpBehavior):
+    for node in nodes:
+        if node.inst == Instructions.NOOP or (node.inst == Instructions.NULL and nullmode == NullOpBehavior.NOOP):
+            node.dead = True
+
+def _fold(nodes : list[Node]):
+    """
+    Fold runs of rotations and runs of pen-up moves into a single instruction each.
+    """
+    head : Node | None = None
+    total : int | float = 0
+
+    def flush():
+        if head is None:
+            return
+        positive, negative, _ = _FOLDS[head.inst]
+        if total == 0:
+            head.dead = True
+        elif total > 0:
+            head.inst, head.operands = positive, (total,)
+        else:
+            head.inst, head.operands = negative, (-total,)
+
+    for node in nodes:
+        if node.dead:
+            continue
+        fold = _FOLDS.get(node.inst)
+        if head is not None and fold is not None and not node.leader and fold[:2] == _FOLDS[head.inst][:2]:
+            merged = total + fold[2] * node.operands[0]
+            if not (isinstance(merged, int) and abs(merged) >= _DISTANCE_LIMIT):
+                total = merged
+                node.dead = True
+                continue
+
+        flush()
+        head, total = (node, fold[2] * node.operands[0]) if fold is not None else (None, 0)
+    flush()
+
+def _remove_dead_colors(nodes : list[Node]):
+    """
+    Remove COLORs that are replaced before the color is used, and COLORs that set the color it already is.
+
+    This is only done within basic blocks, the color is unknown where control merges.
+    """
+    pending : Node | None = None # Last COLOR whose color hasn't been used yet
+    current : int | None = None # Known pen color
+
+    for node in nodes:
+        if node.dead:
+            continue
+        if node.leader:
+            pending, current = None, None
+
+        inst = node.inst
+        if inst == Instructions.COLOR:
+            if node.operands[0] == current:
+                node.dead = True
+                continue
+            if pending is not None:
+                pending.dead = True
+            pending, current = node, node.operands[0]
+        elif inst in _COLORLESS:
+            pass
+        elif inst in _COLOR_READERS:
+            pending = None
+        else: # Control flow, STPOP and INITIALIZE may use or replace the color
+            pending, current = None, None
+
+def _remove_jumps_to_next(nodes : list[Node]) -> bool:
+    """
+    Remove jumps to the instruction right after them.
+
+    Returns whether any jump was removed.
+    """
+    forward = _resolve(nodes)
+    removed = False
+    following : Node | None = None
+    for node in reversed(nodes):
+        if node.dead:
+            continue
+        if node.inst in _JUMPS:
+            target = node.target
+            while target is not None and target.dead: # Jumps removed along the way are dead too
+                target = forward[id(target)]
+            if target is following:
+                node.dead = True
+                forward[id(node)] = following
+                removed = True
+                continue
+        following = node
+    return removed
+
+def peephole(bytecode : bytes | bytearray | memoryview, nullmode : NullOpBehavior = NullOpBehavior.FAULT) -> bytes:
+    """
+    Optimize a binary with peephole rewrites, returning a smaller binary that draws the same.
+
+    Unreachable code, NOOPs (and NULLs when they are no-ops), unused COLORs and jumps to the next instruction are removed.
+    Runs of rotations and runs of pen-up moves are folded into a single instruction. Folded floating point rotations may round differently than the separate ones.
+
+    The binary must pass verification under the null opcode behavior.
+    """
+    nodes = lift(bytecode, nullmode)
+
+    _remove_noops(nodes, nullmode)
+    _fold(nodes)
+    _remove_dead_colors(nodes)
+    while _remove_jumps_to_next(nodes):
+        pass
+
+    return lower(nodes)
+
+# Instructions that end a straight run of instructions, so they are never outlined
+_BARRIERS : frozenset[Instructions] = frozenset((*_BRANCHES, Instructions.RETURN, Instructions.HALT))
+_CALL_LENGTH = INSTRUCTION_LENGTHS[Instructions.CALLIPC]
+_RETURN_LENGTH = INSTRUCTION_LENGTHS[Instructions.RETURN]
+
+def _suffix_array(tokens : list[int]) -> list[int]:
+    """
+    Sort the suffixes of the tokens by prefix doubling.
+    """
+    count = len(tokens)
+    rank = list(tokens)
+    suffixes = list(range(count))
+    step = 1
+    while count:
+        key = lambda i: (rank[i], rank[i + step] if i + step < count else -1)
+        suffixes.sort(key=key)
+
+        ranked = [0] * count
+        for j in range(1, count):
+            ranked[suffixes[j]] = ranked[suffixes[j - 1]] + (key(suffixes[j]) != key(suffixes[j - 1]))
+        rank = ranked
+        if rank[suffixes[-1]] == count - 1: # Every suffix is told apart
+            break
+        step *= 2
+    return suffixes
+
+def _lcp(tokens : list[int], suffixes : list[int]) -> list[int]:
+    """
+    Length of the common prefix of every suffix and the one before it in the suffix array, with Kasai's algorithm.
+    """
+    count = len(tokens)
+    rank = [0] * count
+    for i, suffix in enumerate(suffixes):
+        rank[suffix] = i
+
+    lcp = [0] * count
+    common = 0
+    for suffix in range(count):
+        if rank[suffix] == 0:
+            common = 0
+            continue
+        previous = suffixes[rank[suffix] - 1]
+        while suffix + common < count and previous + common < count and tokens[suffix + common] == tokens[previous + common]:
+            common += 1
+        lcp[rank[suffix]] = common
+        if common:
+            common -= 1
+    return lcp
+
+def _repeats(tokens : list[int]) -> cabc.Iterator[tuple[int, list[int]]]:
+    """
+    Find the repeated runs of tokens, as their length and where they start.
+    """
+    suffixes = _suffix_array(tokens)
+    lcp = _lcp(tokens, suffixes)
+
+    # Walk the intervals of the suffix array that share a common prefix
+    stack : list[tuple[int, int]] = [(0, 0)]
+    for i in range(1, len(tokens) + 1):
+        common = lcp[i] if i < len(tokens) else 0
+        left = i - 1
+        while common < stack[-1][0]:
+            length, left = stack.pop()
+            yield length, suffixes[left:i]
+        if common > stack[-1][0]:
+            stack.append((common, left))
+
+def outline(bytecode : bytes | bytearray | memoryview, nullmode : NullOpBehavior = NullOpBehavior.FAULT) -> bytes:
+    """
+    Compress a binary by outlining repeated runs of instructions into subroutines.
+
+    Runs of instructions that repeat byte for byte are found with a suffix array. Whenever it makes the binary smaller, every occurrence is replaced by a CALLIPC to a single copy of the run, which ends with a RETURN.
+    Runs never hold control flow and never span into a basic block, and the pen instructions in them are position-relative, so the drawing stays the same.
+    The subroutines are appended at the end, behind a HALT if control could otherwise run into them.
+
+    The binary must pass verification under the null opcode behavior. Outlining works best on binaries that went through the peephole optimizer.
+    """
+    nodes = lift(bytecode, nullmode)
+
+    # Tokenize the instructions, anything that can't be outlined is a token of its own that never repeats
+    alive = [node for node in nodes if not node.dead]
+    ids : dict[tuple, int] = {}
+    tokens : list[int] = []
+    positions : list[Node | None] = []
+    null_ishalt = nullmode == NullOpBehavior.HALT
+    barrier = lambda node: node.inst in _BARRIERS or node.inst == Instructions.NULL
+    for node in alive:
+        if node.leader:
+            tokens.append(-1)
+            positions.append(None)
+        tokens.append(-1 if barrier(node) else ids.setdefault((node.inst, node.operands), len(ids)))
+        positions.append(node)
+    for i, token in enumerate(tokens): # Number the separators after the instructions, so none of them are alike
+        if token == -1:
+            tokens[i] = len(ids) + i
+
+    # Rank the repeats by how much they would save if every occurrence was outlined
+    sizes = [INSTRUCTION_LENGTHS[node.inst] if node is not None else 0 for node in positions]
+    candidates = []
+    for length, starts in _repeats(tokens):
+        size = sum(sizes[starts[0]:starts[0] + length])
+        saving = len(starts) * (size - _CALL_LENGTH) - size - _RETURN_LENGTH
+        if saving > 0:
+            candidates.append((saving, length, sorted(starts)))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    used = [False] * len(tokens)
+    subroutines : list[list[Node]] = []
+    for _, length, starts in candidates:
+        # Occurrences can't overlap each other or a run that was already outlined
+        chosen = []
+        end = -1
+        for start in starts:
+            if start >= end and not any(used[start:start + length]):
+                chosen.append(start)
+                end = start + length
+        size = sum(sizes[starts[0]:starts[0] + length])
+        if len(chosen) * (size - _CALL_LENGTH) - size - _RETURN_LENGTH <= 0:
+            continue
+
+        body = [Node(node.inst, node.operands) for node in positions[chosen[0]:chosen[0] + length]]
+        body[0].leader = True
+        body.append(Node(Instructions.RETURN))
+        subroutines.append(body)
+
+        for start in chosen:
+            for i in range(start, start + length):
+                used[i] = True
+                positions[i].dead = True
+            head = positions[start] # The first instruction becomes the call, so it stays a leader for whatever targets it
+            head.inst, head.operands, head.target, head.dead = Instructions.CALLIPC, (), body[0], False
+
+    if not subroutines:
+        return lower(nodes)
+
+    # Keep control from running into the subroutines
+    end = nodes[-1] # Jumps to the end of the binary must still end up halting
+    last = next((node for node in reversed(nodes) if not node.dead), None)
+    falls = last is None or not (last.inst in _JUMPS or last.inst == Instructions.RETURN or is_halt(last.inst, null_ishalt))
+    if falls or any(node.target is end for node in nodes):
+        nodes.append(Node(Instructions.HALT, leader=True))
+
+    for body in subroutines:
+        nodes.extend(body)
+    return lower(nodes)
@@ -0,0 +1,299 @@
+"""
+Library for rasterizing the geometry of VQsX binaries, without any GUI.
+
+Segments from the geometry evaluator are drawn onto an RGB framebuffer with Bresenham's line algorithm, which can be saved as PNG.
+VQsXi images in WB graphics are drawn onto a 1-bit framebuffer instead, which can be saved as PBM or 1-bit PNG.
+The geometry can also be written out as SVG.
+"""
+
+from .constants import RGBColor, BRIGHTNESS_LEVELS, PALETTE_LUT
+from .geometry import Segment
+import zlib, struct
+import collections.abc as cabc
+
+__all__ = ["FORMATS", "Raster", "MonoRaster", "svg", "png", "segments", "encode"]
+
+FORMATS : tuple[str, ...] = ("png", "pbm", "svg", "seg") # Formats encode() renders to
+
+_INVERT : bytes = bytes(255 - value for value in range(256)) # For bytes.translate()
+
+def _shade(color : int, brightness : int) -> RGBColor:
+    """
+    RGB of a color index at a brightness, where 10 is the full color and 0 is black.
+    """
+    offset = ((int(color) & 0xFF) * BRIGHTNESS_LEVELS + min(max(int(brightness), 0), BRIGHTNESS_LEVELS - 1)) * 3
+    return RGBColor(*PALETTE_LUT[offset:offset + 3])
+
+def png(width : int, height : int, rows : cabc.Iterable[bytes], colortype : int = 2, bitdepth : int = 8, level : int = 6) -> bytes:
+    """
+    Encode rows of packed pixels as PNG. The color type defaults to RGB, see the PNG specification for the others.
+    """
+    def chunk(kind : bytes, data : bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    compressor = zlib.compressobj(level)
+    compressed = bytearray()
+    for row in rows:
+        compressed += compressor.compress(b"\x00") # No filter
+        compressed += compressor.compress(row)
+    compressed += compressor.flush()
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bitdepth, colortype, 0, 0, 0))
+            + chunk(b"IDAT", bytes(compressed))
+            + chunk(b"IEND", b""))
+
+def _mono(brightness : int) -> str:
+    """
+    Hex RGB of a segment in WB graphics.
+    """
+    return "ffffff" if brightness > 0 else "000000"
+
+def _clip(x0 : float, y0 : float, x1 : float, y1 : float, left : float, top : float, right : float, bottom : float) -> tuple[float, float, float, float] | None:
+    """
+    Clip a line to a rectangle with the Liang-Barsky algorithm, None if it lies outside.
+    """
+    dx, dy = x1 - x0, y1 - y0
+    start, end = 0.0, 1.0
+    for p, q in ((-dx, x0 - left), (dx, right - x0), (-dy, y0 - top), (dy, bottom - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > end:
+                return None
+            start = max(start, t)
+        else:
+            if t < start:
+                return None
+            end = min(end, t)
+    return x0 + start * dx, y0 + start * dy, x0 + end * dx, y0 + end * dy
+
+def _visible(segments : cabc.Iterable[Segment], width : int, height : int, region : tuple[int, int, int, int] | None) -> cabc.Generator[tuple[int, int, int, int, int, int], None, None]:
+    """
+    The end pixels, color and brightness of every segment that is at least partly visible on a framebuffer of the given size, and within the region if there is one.
+    """
+    halfwidth, halfheight = width / 2, height / 2
+    right, bottom = width - 0.5, height - 0.5
+    xlimit, ylimit = width - 1, height - 1
+    rleft, rtop, rright, rbottom = region or (0, 0, width, height)
+
+    for x1, y1, x2, y2, color, brightness in segments:
+        clipped = _clip(x1 + halfwidth, halfheight - y1, x2 + halfwidth, halfheight - y2, -0.5, -0.5, right, bottom)
+        if clipped is None:
+            continue
+        px0, py0, px1, py1 = min(max(round(clipped[0]), 0), xlimit), min(max(round(clipped[1]), 0), ylimit), min(max(round(clipped[2]), 0), xlimit), min(max(round(clipped[3]), 0), ylimit)
+        if region is not None and (max(px0, px1) < rleft or min(px0, px1) >= rright or max(py0, py1) < rtop or min(py0, py1) >= rbottom):
+            continue
+        yield px0, py0, px1, py1, color, brightness
+
+class Raster(object):
+    """
+    An RGB framebuffer, 3 bytes per pixel with rows from top to bottom.
+
+    Segments are in world coordinates, with (0, 0) at the center of the framebuffer and y pointing up.
+    The pixels can be kept in any writable buffer of the right size, otherwise the raster allocates its own.
+    """
+
+    def __init__(self, width : int, height : int, buffer = None, background : RGBColor = RGBColor(0, 0, 0)):
+        self.width : int = width
+        self.height : int = height
+        if buffer is None:
+            buffer = bytearray(width * height * 3)
+        self.pixels : memoryview = memoryview(buffer).cast("B")
+        if len(self.pixels) < width * height * 3:
+            raise ValueError(f"A {width}x{height} raster needs {width * height * 3} bytes, the buffer has {len(self.pixels)}!")
+        self.clear(background)
+
+    def clear(self, background : RGBColor = RGBColor(0, 0, 0)):
+        """
+        Fill the whole framebuffer with the background color.
+        """
+        self.pixels[:self.width * self.height * 3] = bytes(background) * (self.width * self.height)
+
+    def line(self, x0 : int, y0 : int, x1 : int, y1 : int, color : RGBColor, region : tuple[int, int, int, int] | None = None):
+        """
+        Draw a line between two pixels with Bresenham's line algorithm. Both pixels must lie inside the framebuffer.
+
+        With a region of left, top, right and bottom pixels (exclusive), only the pixels of the line within the region are drawn.
+        The line is the same as without a region, so regions drawn apart join up seamlessly.
+        """
+        pixels, stride, rgb = self.pixels, self.width * 3, bytes(color)
+        left, top, right, bottom = region or (0, 0, self.width, self.height)
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            if left <= x0 < right and top <= y0 < bottom:
+                offset = y0 * stride + x0 * 3
+                pixels[offset:offset + 3] = rgb
+            if x0 == x1 and y0 == y1:
+                break
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x0 += sx
+            if doubled <= dx:
+                error += dx
+                y0 += sy
+
+    def draw(self, segments : cabc.Iterable[Segment], region : tuple[int, int, int, int] | None = None) -> int:
+        """
+        Draw segments onto the framebuffer, returning how many of them were at least partly visible.
+
+        With a region, only the pixels within it are touched, see line(). Several processes can draw disjoint regions of a shared framebuffer at once.
+        """
+        shades : dict[tuple[int, int], RGBColor] = {}
+
+        drawn = 0
+        for px0, py0, px1, py1, color, brightness in _visible(segments, self.width, self.height, region):
+            key = (color, brightness)
+            shade = shades.get(key)
+            if shade is None:
+                shade = shades[key] = _shade(color, brightness)
+            self.line(px0, py0, px1, py1, shade, region)
+            drawn += 1
+        return drawn
+
+    def rows(self) -> cabc.Generator[memoryview, None, None]:
+        """
+        The rows of the framebuffer, from top to bottom.
+        """
+        stride = self.width * 3
+        for row in range(self.height):
+            yield self.pixels[row * stride:(row + 1) * stride]
+
+    def png(self, level : int = 6) -> bytes:
+        """
+        Encode the framebuffer as PNG.
+        """
+        return png(self.width, self.height, self.rows(), level=level)
+
+class MonoRaster(object):
+    """
+    A 1-bit framebuffer for WB graphics, 8 pixels per byte with the leftmost pixel in the most significant bit. Rows go from top to bottom, each padded to a whole byte.
+
+    It takes a 24th of the memory of a Raster of the same size. Set bits are white, and the background is black like the one of Raster.
+    Segments are drawn white whatever their color, unless their brightness is 0 which draws them black.
+    """
+
+    def __init__(self, width : int, height : int, buffer = None, background : bool = False):
+        self.width : int = width
+        self.height : int = height
+        self.stride : int = (width + 7) // 8 # Bytes per row
+        if buffer is None:
+            buffer = bytearray(self.stride * height)
+        self.pixels : memoryview = memoryview(buffer).cast("B")
+        if len(self.pixels) < self.stride * height:
+            raise ValueError(f"A {width}x{height} WB raster needs {self.stride * height} bytes, the buffer has {len(self.pixels)}!")
+        self.clear(background)
+
+    def clear(self, background : bool = False):
+        """
+        Fill the whole framebuffer with white if background is set, black otherwise.
+        """
+        self.pixels[:self.stride * self.height] = (b"\xff" if background else b"\x00") * (self.stride * self.height)
+
+    def line(self, x0 : int, y0 : int, x1 : int, y1 : int, white : bool, region : tuple[int, int, int, int] | None = None):
+        """
+        Draw a white or black line between two pixels, the same one as Raster.line() draws.
+        """
+        pixels, stride = self.pixels, self.stride
+        left, top, right, bottom = region or (0, 0, self.width, self.height)
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            if left <= x0 < right and top <= y0 < bottom:
+                offset = y0 * stride + (x0 >> 3)
+                if white:
+                    pixels[offset] |= 0x80 >> (x0 & 7)
+                else:
+                    pixels[offset] &= ~(0x80 >> (x0 & 7)) & 0xFF
+            if x0 == x1 and y0 == y1:
+                break
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x0 += sx
+            if doubled <= dx:
+                error += dx
+                y0 += sy
+
+    def draw(self, segments : cabc.Iterable[Segment], region : tuple[int, int, int, int] | None = None) -> int:
+        """
+        Draw segments onto the framebuffer, returning how many of them were at least partly visible. Regions work like in Raster.draw().
+
+        Regions that split the framebuffer into bands of rows never share a byte, so processes can draw them at once too.
+        """
+        drawn = 0
+        for px0, py0, px1, py1, _, brightness in _visible(segments, self.width, self.height, region):
+            self.line(px0, py0, px1, py1, brightness > 0, region)
+            drawn += 1
+        return drawn
+
+    def rows(self) -> cabc.Generator[memoryview, None, None]:
+        """
+        The packed rows of the framebuffer, from top to bottom.
+        """
+        stride = self.stride
+        for row in range(self.height):
+            yield self.pixels[row * stride:(row + 1) * stride]
+
+    def png(self, level : int = 6) -> bytes:
+        """
+        Encode the framebuffer as a 1-bit grayscale PNG.
+        """
+        return png(self.width, self.height, self.rows(), colortype=0, bitdepth=1, level=level)
+
+    def pbm(self) -> bytes:
+        """
+        Encode the framebuffer as a binary PBM (P4), where set bits are black instead.
+        """
+        return f"P4\n{self.width} {self.height}\n".encode() + self.pixels[:self.stride * self.height].tobytes().translate(_INVERT)
+
+def svg(segments : cabc.Iterable[Segment], width : int, height : int, background : RGBColor = RGBColor(0, 0, 0), mono : bool = False) -> str:
+    """
+    Render segments as an SVG document of the given size, with the same coordinates as Raster.
+
+    With mono, segments are white or black like on a MonoRaster.
+    """
+    halfwidth, halfheight = width / 2, height / 2
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+             f'<rect width="100%" height="100%" fill="#{bytes(background).hex()}"/>',
+             '<g stroke-linecap="round" stroke-width="1">']
+    for x1, y1, x2, y2, color, brightness in segments:
+        lines.append(f'<line x1="{x1 + halfwidth:.6g}" y1="{halfheight - y1:.6g}" x2="{x2 + halfwidth:.6g}" y2="{halfheight - y2:.6g}" stroke="#{_mono(brightness) if mono else bytes(_shade(color, brightness)).hex()}"/>')
+    lines.append("</g>")
+    lines.append("</svg>")
+    return "\n".join(lines) + "\n"
+
+def segments(segments : cabc.Iterable[Segment]) -> str:
+    """
+    List segments as text, a line of SEGMENT_FIELDS separated by spaces per segment.
+    """
+    return "".join(f"{x1:.6g} {y1:.6g} {x2:.6g} {y2:.6g} {int(color)} {int(brightness)}\n" for x1, y1, x2, y2, color, brightness in segments)
+
+def encode(geometry : cabc.Iterable[Segment], width : int, height : int, format : str = "png", raster : Raster | MonoRaster | None = None, mono : bool = False) -> bytes:
+    """
+    Render segments to one of FORMATS.
+
+    With mono, the segments are rendered in WB graphics, PNGs on a MonoRaster. PBMs are always in WB graphics.
+    A raster of the right size and kind can be given to draw on, it is cleared first. This saves allocating a framebuffer for every render.
+    """
+    mono = mono or format == "pbm"
+    if format in ("png", "pbm"):
+        kind = MonoRaster if mono else Raster
+        if type(raster) is not kind or (raster.width, raster.height) != (width, height):
+            raster = kind(width, height)
+        else:
+            raster.clear()
+        raster.draw(geometry)
+        return raster.pbm() if format == "pbm" else raster.png()
+    elif format == "svg":
+        return svg(geometry, width, height, mono=mono).encode()
+    elif format == "seg":
+        return segments(geometry).encode()
+    raise ValueError(f"Unknown format {format}, expected one of {', '.join(FORMATS)}!")
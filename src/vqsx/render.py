@@ -0,0 +1,49 @@
+"""
+Library for rendering many VQsX programs at once on a pool of threads.
+
+Every program gets its own evaluator or VM and nothing mutable is shared between them, so on free-threaded builds of CPython the programs run on as many cores as there are threads.
+Unlike with a pool of processes, no bytecode or segments are pickled. On builds with the GIL the threads take turns instead, see free_threaded().
+"""
+
+from .constants import StatusFlags
+from .vm import NullOpBehavior, VQsXExecutor, ByteCodeStream
+from .geometry import Geometry, GeometryEvaluator
+import sys
+import concurrent.futures as futures
+import collections.abc as cabc
+
+__all__ = ["free_threaded", "render", "run"]
+
+def free_threaded() -> bool:
+    """
+    Whether the interpreter runs without the GIL, so threads run Python code in parallel.
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+def render(programs : cabc.Iterable[ByteCodeStream], width : int = 0, height : int = 0,
+           nullmode : NullOpBehavior = NullOpBehavior.FAULT, memoize : bool = True, limit : int | None = None,
+           workers : int | None = None) -> list[Geometry]:
+    """
+    Evaluate the geometry of many programs on a pool of threads, one program per thread at a time.
+
+    The geometries are returned in the order of the programs. If programs fault, the fault of the first one is raised.
+    """
+    def evaluate(bytecode : ByteCodeStream) -> Geometry:
+        return GeometryEvaluator(bytecode, width, height, nullmode, memoize, limit).evaluate()
+
+    with futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(evaluate, programs))
+
+def run(executors : cabc.Iterable[VQsXExecutor], workers : int | None = None) -> list[StatusFlags]:
+    """
+    Run many loaded VMs on a pool of threads, one VM per thread at a time, and return the status each of them halted with.
+
+    Each VM, along with its observers, is only ever touched by the thread that runs it.
+    """
+    def execute(vm : VQsXExecutor) -> StatusFlags:
+        vm.run()
+        return vm.status
+
+    with futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(execute, executors))
@@ -0,0 +1,252 @@
+"""
+Library for running many VQsX programs at once on a single thread.
+
+The scheduler holds many VMs and interleaves them, running each for a slice of a fixed number of instructions at a time, so long drawings never starve short ones.
+VMs waiting for NEXT are parked, they take no slices until woken with Scheduler.trignext().
+"""
+
+from .constants import STATUS_HALTED, STATUS_NEXT, STATUS_FAULT, StatusFlags
+from .vm import NullOpBehavior, VQsXExecutor, ByteCodeStream
+from .observers import VQsXObserver
+import typing, enum, heapq
+import collections
+import collections.abc as cabc
+
+__all__ = ["SchedulingPolicy", "Progress", "Scheduler"]
+
+@enum.unique
+class SchedulingPolicy(enum.Enum):
+    """
+    Enum for how the scheduler picks the VM to run next.
+    """
+    ROUNDROBIN = "roundrobin" # Every VM gets a slice in turn
+    WEIGHTED = "weighted" # VMs get slices in proportion to their weight, see Scheduler.add()
+
+class Progress(typing.NamedTuple):
+    """
+    Class for representing how far along a VM scheduled by a Scheduler is.
+    """
+    handle : int
+    status : StatusFlags
+    ipc : int
+    length : int # Length of the bytecode
+    steps : int # Instructions run so far
+    slices : int # Slices run so far
+
+    @property
+    def halted(self) -> bool:
+        return bool(self.status & STATUS_HALTED)
+
+    @property
+    def faulted(self) -> bool:
+        return bool(self.status & STATUS_FAULT)
+
+    @property
+    def waiting(self) -> bool:
+        """
+        Whether the VM waits for NEXT.
+        """
+        return bool(self.status & STATUS_NEXT)
+
+class _Task(object):
+    """
+    A VM held by the scheduler, along with its bookkeeping.
+    """
+    __slots__ = ("handle", "vm", "weight", "steps", "slices", "vtime")
+
+    def __init__(self, handle : int, vm : VQsXExecutor, weight : int):
+        self.handle : int = handle
+        self.vm : VQsXExecutor = vm
+        self.weight : int = weight
+        self.steps : int = 0
+        self.slices : int = 0
+        self.vtime : float = 0.0 # Virtual time for weighted scheduling, grows slower for heavier VMs
+
+class Scheduler(object):
+    """
+    Cooperative scheduler for running many VMs on a single thread.
+
+    Each VM runs for at most budget instructions per slice. With the weighted policy, VMs are picked by stride scheduling: a VM with twice the weight gets twice as many slices.
+    Bytecode loaded several times is shared between the VMs instead of copied, the scheduler keeps a single copy of each program around for as long as a VM uses it.
+    """
+
+    def __init__(self, budget : int = 1000, policy : SchedulingPolicy = SchedulingPolicy.ROUNDROBIN, nullmode : NullOpBehavior = NullOpBehavior.FAULT):
+        if budget < 1:
+            raise ValueError("The budget must be at least a single instruction!")
+        self.budget : int = budget
+        self.policy : SchedulingPolicy = SchedulingPolicy(policy)
+        self.nullmode : NullOpBehavior = nullmode
+
+        self.__tasks : dict[int, _Task] = {}
+        self.__next : int = 0 # Next handle
+        self.__ready : collections.deque[_Task] = collections.deque() # Round robin queue
+        self.__heap : list[tuple[float, int, _Task]] = [] # Weighted queue, by virtual time and handle
+        self.__vtime : float = 0.0 # Virtual time of the last VM that ran, new VMs start from it
+        self.__parked : dict[int, _Task] = {} # VMs waiting for NEXT, by handle
+
+        self.__programs : dict[bytes, list] = {} # Interned bytecode and how many VMs use it
+
+    def intern(self, bytecode : ByteCodeStream) -> bytes:
+        """
+        Get the single shared copy of a program.
+        """
+        bytecode = bytes(bytecode)
+        entry = self.__programs.get(bytecode)
+        if entry is None:
+            entry = self.__programs[bytecode] = [bytecode, 0]
+        return entry[0]
+
+    def __release(self, bytecode : bytes):
+        entry = self.__programs.get(bytecode)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.__programs[bytecode]
+
+    def __enqueue(self, task : _Task):
+        if self.policy == SchedulingPolicy.WEIGHTED:
+            heapq.heappush(self.__heap, (task.vtime, task.handle, task))
+        else:
+            self.__ready.append(task)
+
+    def add(self, bytecode : ByteCodeStream | VQsXExecutor, weight : int = 1, observers : cabc.Iterable[VQsXObserver] = ()) -> int:
+        """
+        Add a program to run, returning the handle of its VM.
+
+        A VM can be given instead of bytecode, it is then scheduled from wherever it currently is. Otherwise, a new VM is made for the bytecode and reset.
+        The weight only matters with the weighted policy.
+        """
+        if weight < 1:
+            raise ValueError("The weight must be at least 1!")
+
+        if isinstance(bytecode, VQsXExecutor):
+            vm = bytecode
+            vm.bytecode = self.intern(vm.bytecode)
+        else:
+            vm = VQsXExecutor(self.nullmode)
+            vm.load(0, self.intern(bytecode))
+            vm.reset()
+            vm.spin()
+        self.__programs[vm.bytecode][1] += 1
+        for observer in observers:
+            vm.register(observer)
+
+        task = _Task(self.__next, vm, weight)
+        task.vtime = self.__vtime
+        self.__next += 1
+        self.__tasks[task.handle] = task
+        if vm.status & STATUS_NEXT:
+            self.__parked[task.handle] = task
+        elif not (vm.status & STATUS_HALTED):
+            self.__enqueue(task)
+        return task.handle
+
+    def remove(self, handle : int) -> VQsXExecutor:
+        """
+        Stop scheduling a VM and forget about it, returning the VM.
+        """
+        task = self.__tasks.pop(handle)
+        self.__parked.pop(handle, None)
+        self.__release(task.vm.bytecode)
+        return task.vm # Left in the queue, it is skipped once it comes up
+
+    def executor(self, handle : int) -> VQsXExecutor:
+        """
+        Get the VM of a handle.
+        """
+        return self.__tasks[handle].vm
+
+    def progress(self, handle : int) -> Progress:
+        """
+        Get how far along a VM is.
+        """
+        task = self.__tasks[handle]
+        return Progress(handle, task.vm.status, task.vm.ipc, len(task.vm.bytecode), task.steps, task.slices)
+
+    def __iter__(self) -> cabc.Iterator[Progress]:
+        """
+        Iterate over the progress of every VM, in the order they were added.
+        """
+        for handle in list(self.__tasks):
+            yield self.progress(handle)
+
+    def __len__(self) -> int:
+        return len(self.__tasks)
+
+    @property
+    def pending(self) -> int:
+        """
+        How many VMs are waiting for a slice.
+        """
+        return len(self.__heap) if self.policy == SchedulingPolicy.WEIGHTED else len(self.__ready)
+
+    @property
+    def parked(self) -> int:
+        """
+        How many VMs wait for NEXT.
+        """
+        return len(self.__parked)
+
+    def trignext(self, handle : int | None = None):
+        """
+        Trigger the NEXT signal of a VM, or of every parked VM without a handle, scheduling them again.
+
+        VMs that don't wait for NEXT are left alone, like the TRIGNEXT pin does.
+        """
+        tasks = list(self.__parked.values()) if handle is None else [self.__tasks[handle]]
+        for task in tasks:
+            task.vm.trignext()
+            if self.__parked.pop(task.handle, None) is not None and not (task.vm.status & STATUS_HALTED):
+                task.vtime = max(task.vtime, self.__vtime) # Sleeping doesn't earn a VM extra slices
+                self.__enqueue(task)
+
+    def __pick(self) -> _Task | None:
+        """
+        Take the next VM to run off the queue, dropping removed and halted VMs along the way.
+        """
+        while True:
+            if self.policy == SchedulingPolicy.WEIGHTED:
+                if not self.__heap:
+                    return None
+                task = heapq.heappop(self.__heap)[2]
+            else:
+                if not self.__ready:
+                    return None
+                task = self.__ready.popleft()
+            if self.__tasks.get(task.handle) is not task or task.vm.status & STATUS_HALTED:
+                continue
+            if task.vm.status & STATUS_NEXT: # Started waiting for NEXT outside of the scheduler
+                self.__parked[task.handle] = task
+                continue
+            return task
+
+    def step(self) -> int | None:
+        """
+        Run a single slice of the next VM, returning its handle, or None if every VM halted or waits for NEXT.
+        """
+        task = self.__pick()
+        if task is None:
+            return None
+
+        steps = task.vm.run_slice(self.budget)
+        task.steps += steps
+        task.slices += 1
+        task.vtime += steps / task.weight
+        self.__vtime = task.vtime
+
+        if task.vm.status & STATUS_NEXT:
+            self.__parked[task.handle] = task
+        elif not (task.vm.status & STATUS_HALTED):
+            self.__enqueue(task)
+        return task.handle
+
+    def run(self, slices : int | None = None) -> int:
+        """
+        Run slices until every VM halted or waits for NEXT, or until the given number of slices ran. Returns how many slices ran.
+        """
+        ran = 0
+        while slices is None or ran < slices:
+            if self.step() is None:
+                break
+            ran += 1
+        return ran
@@ -0,0 +1,205 @@
+"""
+Library for handing rendered framebuffers and segment arrays between processes through shared memory.
+
+Pickling a framebuffer back from a worker costs about as much as drawing it, a 16384x16384 RGB canvas alone is 768 MB.
+Instead, the parent process allocates shared memory blocks, the workers attach to them and write into them, and only the names and shapes of the blocks travel through the pipes.
+The parent owns every block and frees it once done, so nothing is leaked when workers exit.
+"""
+
+from .vm import NullOpBehavior, ByteCodeStream
+from .geometry import Geometry, GeometryEvaluator, SEGMENT_FIELDS
+from .raster import Raster, MonoRaster
+from .constants import RGBColor
+import typing, math, os, array
+import concurrent.futures as futures
+import multiprocessing.shared_memory as shared_memory
+import multiprocessing.resource_tracker as resource_tracker
+import collections.abc as cabc
+
+__all__ = ["SharedBlock", "SharedCanvas", "SharedSegments", "render_tiles"]
+
+class SharedBlock(typing.NamedTuple):
+    """
+    Class for representing a shared memory block by name, which is all a process needs to attach to it.
+    """
+    name : str
+    shape : tuple[int, ...]
+    format : str # Item format, as in the struct and array modules
+
+    @property
+    def nbytes(self) -> int:
+        return math.prod(self.shape) * array.array(self.format).itemsize
+
+def _allocate(shape : tuple[int, ...], fmt : str) -> tuple[shared_memory.SharedMemory, SharedBlock]:
+    """
+    Create a shared memory block for items of the given shape and format.
+    """
+    resource_tracker.ensure_running() # Workers started from now on share the tracker, so their attachments don't count as leaks
+    size = math.prod(shape) * array.array(fmt).itemsize
+    memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    return memory, SharedBlock(memory.name, tuple(shape), fmt)
+
+class SharedCanvas(object):
+    """
+    An RGB framebuffer in a shared memory block, rows from top to bottom like Raster.
+    With mono, it is a 1-bit framebuffer for WB graphics like MonoRaster instead, and starts white if the background isn't black.
+
+    The process that makes the canvas owns it, and frees it with close(), or when leaving a with statement. Other processes attach to the block with attach().
+    The raster attribute draws onto the canvas and saves it, without copying it out of shared memory.
+    """
+
+    def __init__(self, width : int, height : int, background : RGBColor = RGBColor(0, 0, 0), mono : bool = False):
+        if mono:
+            self.memory, self.block = _allocate((height, (width + 7) // 8), "B")
+            self.raster : Raster | MonoRaster = MonoRaster(width, height, self.memory.buf, any(background))
+        else:
+            self.memory, self.block = _allocate((height, width, 3), "B")
+            self.raster : Raster | MonoRaster = Raster(width, height, self.memory.buf, background)
+        self.__owner : bool = True
+
+    @classmethod
+    def attach(cls, block : SharedBlock, width : int | None = None) -> "SharedCanvas":
+        """
+        Attach to a canvas made by another process, without clearing it.
+
+        The block of a mono canvas only has its width in whole bytes, so its exact width should be given too.
+        """
+        canvas = cls.__new__(cls)
+        canvas.memory = shared_memory.SharedMemory(block.name)
+        canvas.block = block
+        if len(block.shape) == 2:
+            height, stride = block.shape
+            canvas.raster = MonoRaster.__new__(MonoRaster)
+            canvas.raster.width, canvas.raster.height, canvas.raster.stride = width or stride * 8, height, stride
+        else:
+            height, width, _ = block.shape
+            canvas.raster = Raster.__new__(Raster)
+            canvas.raster.width, canvas.raster.height = width, height
+        canvas.raster.pixels = canvas.memory.buf.cast("B")
+        canvas.__owner = False
+        return canvas
+
+    @property
+    def width(self) -> int:
+        return self.raster.width
+
+    @property
+    def height(self) -> int:
+        return self.raster.height
+
+    def close(self):
+        """
+        Detach from the canvas, freeing it if this process made it.
+        """
+        if self.memory is None:
+            return
+        self.raster.pixels.release()
+        self.memory.close()
+        if self.__owner:
+            self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self) -> "SharedCanvas":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SharedSegments(object):
+    """
+    Segments in a shared memory block, as a flat array of doubles with a row of SEGMENT_FIELDS per segment like Geometry.pack().
+
+    Like SharedCanvas, the process that shares the segments owns the block, and frees it with close().
+    """
+
+    def __init__(self, geometry : Geometry | None = None, block : SharedBlock | None = None):
+        if block is None:
+            packed = geometry.pack() if geometry is not None else array.array("d")
+            self.memory, self.block = _allocate((len(packed) // len(SEGMENT_FIELDS), len(SEGMENT_FIELDS)), "d")
+            self.memory.buf[:len(packed) * packed.itemsize] = memoryview(packed).cast("B")
+        else:
+            self.memory, self.block = shared_memory.SharedMemory(block.name), block
+        self.values : memoryview = self.memory.buf[:self.block.nbytes].cast("d")
+        self.__owner : bool = block is None
+
+    @classmethod
+    def attach(cls, block : SharedBlock) -> "SharedSegments":
+        """
+        Attach to segments shared by another process.
+        """
+        return cls(block=block)
+
+    def __len__(self) -> int:
+        return self.block.shape[0]
+
+    def __iter__(self) -> cabc.Iterator[tuple]:
+        """
+        Iterate over the segments as rows of SEGMENT_FIELDS, straight out of shared memory.
+        """
+        values = iter(self.values)
+        return zip(*(values,) * len(SEGMENT_FIELDS))
+
+    def close(self):
+        """
+        Detach from the segments, freeing them if this process shared them.
+        """
+        if self.memory is None:
+            return
+        self.values.release()
+        self.memory.close()
+        if self.__owner:
+            self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self) -> "SharedSegments":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Blocks each worker is attached to, by name. Only the latest canvas and segments are kept, the parent frees older ones.
+_attached : dict[str, SharedCanvas | SharedSegments] = {}
+
+def _attachment(block : SharedBlock, kind : type, *args) -> SharedCanvas | SharedSegments:
+    attached = _attached.get(block.name)
+    if attached is None:
+        for name, stale in list(_attached.items()):
+            if isinstance(stale, kind):
+                stale.close()
+                del _attached[name]
+        attached = _attached[block.name] = kind.attach(block, *args)
+    return attached
+
+def _draw_tile(canvas : SharedBlock, width : int, segments : SharedBlock, region : tuple[int, int, int, int]) -> int:
+    return _attachment(canvas, SharedCanvas, width).raster.draw(_attachment(segments, SharedSegments), region)
+
+def render_tiles(program : ByteCodeStream | Geometry, width : int, height : int, tiles : int | None = None,
+                 nullmode : NullOpBehavior = NullOpBehavior.FAULT, memoize : bool = True, limit : int | None = None,
+                 workers : int | None = None, executor : futures.ProcessPoolExecutor | None = None,
+                 background : RGBColor = RGBColor(0, 0, 0), mono : bool = False) -> SharedCanvas:
+    """
+    Rasterize a program, or geometry evaluated before, onto a new shared canvas on a pool of processes.
+
+    The canvas is split into tiles bands of rows, one per worker by default, which the workers draw at once straight into shared memory. The segments reach the workers through shared memory too.
+    With mono, the canvas is a 1-bit one for WB graphics, a 24th of the size of an RGB one.
+    The caller owns the returned canvas and must close it. A running executor can be given to keep its workers warm across renders, otherwise a pool of workers is started for the render.
+    """
+    geometry = program if isinstance(program, Geometry) else GeometryEvaluator(program, width, height, nullmode, memoize, limit).evaluate()
+    workers = workers or os.cpu_count() or 1
+    tiles = max(1, min(tiles or workers, height))
+
+    canvas = SharedCanvas(width, height, background, mono)
+    try:
+        with SharedSegments(geometry) as segments:
+            bands = [round(height * tile / tiles) for tile in range(tiles + 1)]
+            regions = [(0, top, width, bottom) for top, bottom in zip(bands, bands[1:])]
+            count = len(regions)
+            if executor is not None:
+                list(executor.map(_draw_tile, [canvas.block] * count, [width] * count, [segments.block] * count, regions))
+            else:
+                with futures.ProcessPoolExecutor(min(workers, count)) as pool:
+                    list(pool.map(_draw_tile, [canvas.block] * count, [width] * count, [segments.block] * count, regions))
+    except BaseException:
+        canvas.close()
+        raise
+    return canvas
@@ -12,7 +12,13 @@ __all__ = ["VQsXException",
            "IllegalInstructionException",
            
            "VQsXAssemblerException",
-           "VQsXInvalidLabelException"]
+           "VQsXInvalidLabelException",
+           "VQsXAssemblerSyntaxException", "VQsXUndefinedLabelException",
+           "VQsXTemplateException",
+           "VQsXBuilderException",
+
+           "VQsXOptimizerException",
+           "VQsXGeometryException"]
 
 # Base Exception
 class VQsXException(Exception):
@@ -97,3 +103,70 @@ class VQsXInvalidLabelException(VQsXAssemblerException):
 
         self.offender = offender
         self.line = line
+
+
+class VQsXTemplateException(VQsXAssemblerException):
+    """
+    Exception for when a bytecode template is instantiated with a parameter it does not have.
+    """
+    def __init__(self, message, parameter : str):
+        super().__init__(message)
+
+        self.parameter = parameter
+
+
+class VQsXBuilderException(VQsXAssemblerException):
+    """
+    Exception for when the builder is misused, such as rolling back to a checkpoint that isn't open.
+    """
+    pass
+
+
+class VQsXAssemblerSyntaxException(VQsXAssemblerException):
+    """
+    Exception for when the assembler encounters a line it cannot make sense of.
+    """
+    def __init__(self, message, source : str, line : int):
+        super().__init__(message)
+
+        self.source = source
+        self.line = line
+
+
+class VQsXUndefinedLabelException(VQsXAssemblerException):
+    """
+    Exception for when a jump or call refers to a label that is never defined.
+    """
+    def __init__(self, message, offender : str, line : int):
+        super().__init__(message)
+
+        self.offender = offender
+        self.line = line
+
+
+class VQsXOptimizerException(VQsXException):
+    """
+    Exception for when a binary can't be optimized, because it does not pass verification.
+
+    Obtain the problems found by the verifier via the issues attribute.
+    """
+    def __init__(self, message, issues : tuple):
+        super().__init__(message)
+
+        self.issues = issues
+
+
+class VQsXGeometryException(VQsXException):
+    """
+    Exception for when a binary faults while its geometry is evaluated.
+
+    Obtain the address of the offending instruction via the address attribute.
+    """
+    def __init__(self, message, address : int):
+        super().__init__(message)
+
+        self.address = address
+
+    def __reduce__(self):
+        # Keep the address when pickled, so faults found by worker processes reach the caller intact
+        return (type(self), (str(self), self.address))
@@ -0,0 +1,231 @@
+"""
+Library for statically verifying VQsX binaries before they are executed.
+
+Verification is structural. A binary that passes it can't fault on an illegal or truncated instruction, an invalid operand or a stray jump, and its stacks are balanced.
+Whether the VM can run every instruction of a verified binary is a separate question, answered by fast_path_eligible(). Only such binaries run without the checks the VM would otherwise do on every step.
+"""
+
+from .constants import Instructions, SetOriginValues, INSTRUCTION_LENGTHS
+from .vm import NullOpBehavior, _ACTIONS
+from .disasm import Disassembler, ControlFlowGraph, BasicBlock
+import typing
+
+__all__ = ["VerificationIssue", "StackDepths", "Verification", "verify", "fast_path_eligible"]
+
+# Valid operands of the instructions whose operand is an index into a table, as ranges
+_OPERAND_RANGES : dict[Instructions, range] = {
+    Instructions.SETORIGIN: range(min(SetOriginValues), max(SetOriginValues) + 1),
+    Instructions.BRIGHTNESS: range(0, 11),
+    Instructions.ROTATESETORIGIN: range(0, 2),
+}
+
+# How each instruction changes the state and position stacks
+_STACK_EFFECTS : dict[Instructions, tuple[int, int]] = {
+    Instructions.STPUSH: (1, 0),
+    Instructions.STPOP: (-1, 0),
+    Instructions.PSPUSH: (0, 1),
+    Instructions.PSPOP: (0, -1),
+}
+
+class VerificationIssue(typing.NamedTuple):
+    """
+    Class for representing a problem found by the verifier, at the address of the offending instruction.
+    """
+    address : int
+    message : str
+
+class StackDepths(typing.NamedTuple):
+    """
+    Class for representing the maximum depths the stacks can reach. None means the depth is unbounded or could not be determined.
+
+    The VM doesn't run the state and position stack instructions yet, so those depths describe binaries it faults on, see fast_path_eligible().
+    """
+    state : int | None
+    position : int | None
+    call : int | None
+
+class Verification(typing.NamedTuple):
+    """
+    Class for representing the result of verifying a binary.
+    """
+    issues : tuple[VerificationIssue, ...]
+    depths : StackDepths
+    graph : ControlFlowGraph
+
+    @property
+    def ok(self) -> bool:
+        """
+        Whether the binary passed verification.
+        """
+        return not self.issues
+
+class _Summary(typing.NamedTuple):
+    """
+    How a subroutine affects the stacks, relative to the depths it was called with.
+    """
+    returning : bool # Whether control can come back from the routine
+    returns : tuple[int, ...] # Addresses of the RETURNs that the routine can reach
+    net : tuple[int, int] # Change of the state and position stacks once returned
+    low : tuple[int, int] # Lowest depths reached
+    high : tuple[int, int] # Highest depths reached
+    calls : int | None # Deepest nesting of calls made, None when unbounded
+
+class _Verifier(object):
+    """
+    Implementation of verify().
+    """
+
+    def __init__(self, bytecode : bytes | bytearray | memoryview, nullmode : NullOpBehavior, entry : int):
+        self.length = len(bytecode)
+        self.nullmode = nullmode
+        self.graph : ControlFlowGraph = Disassembler(bytecode).analyze(entry, nullmode)
+        self.issues : list[VerificationIssue] = []
+
+        self.summaries : dict[int, _Summary] = {} # Summaries of the routines, by start address
+        self.active : set[int] = set() # Subroutines being summarized, to catch recursion
+        self.unbounded : bool = False # Whether some stack can grow without bounds
+
+    def issue(self, address : int, message : str):
+        self.issues.append(VerificationIssue(address, message))
+
+    def check_instructions(self):
+        """
+        Verify that every reachable instruction is legal and complete, with valid operands and targets.
+        """
+        end = 0 # End of the previous instruction, in address order
+        for block in self.graph:
+            for record in block.instructions:
+                if record.address < end: # Only a jump into the middle of an instruction decodes overlapping instructions
+                    self.issue(record.address, f"Instruction at 0x{record.address:X} overlaps another instruction!")
+                end = max(end, record.address + INSTRUCTION_LENGTHS[record.opcode] if record.inst is not None else record.address + 1)
+
+                inst = record.inst
+                if inst is None:
+                    self.issue(record.address, f"Illegal opcode 0x{record.opcode:02X}!")
+                    continue
+                if record.operands is None:
+                    self.issue(record.address, f"{inst.name} is cut short by the end of the binary!")
+                    continue
+                if inst == Instructions.NULL and self.nullmode == NullOpBehavior.FAULT:
+                    self.issue(record.address, "NULL faults!")
+
+                valid = _OPERAND_RANGES.get(inst)
+                if valid is not None and record.operands[0] not in valid:
+                    self.issue(record.address, f"{inst.name} operand {record.operands[0]} is out of range!")
+
+                target = record.target
+                if target is None:
+                    continue
+                if not 0 <= target <= self.length: # Jumping right to the end halts, just like running off the end
+                    self.issue(record.address, f"{inst.name} target 0x{target:X} is outside of the binary!")
+
+    def summarize(self, start : int) -> _Summary:
+        """
+        Walk a routine from its start, tracking the depths of the stacks relative to its start.
+
+        Depths must agree wherever control merges, like they do in any structured program. A loop that pushes more than it pops is reported as unbounded.
+        """
+        summary = self.summaries.get(start)
+        if summary is not None:
+            return summary
+        if start in self.active:
+            self.issue(start, f"Subroutine 0x{start:X} is recursive, the call stack is unbounded!")
+            self.unbounded = True
+            return _Summary(True, (), (0, 0), (0, 0), (0, 0), None)
+        self.active.add(start)
+
+        depths : dict[int, tuple[int, int]] = {start: (0, 0)}
+        pending : list[int] = [start]
+        low, high = [0, 0], [0, 0]
+        calls : int | None = 0
+        returns : dict[int, tuple[int, int]] = {} # Depths at each reachable RETURN
+
+        while pending:
+            block : BasicBlock | None = self.graph.blocks.get(pending.pop())
+            if block is None:
+                continue
+            depth = list(depths[block.start])
+
+            for record in block.instructions:
+                effect = _STACK_EFFECTS.get(record.inst)
+                if effect is None:
+                    continue
+                for stack in range(2):
+                    depth[stack] += effect[stack]
+                    low[stack] = min(low[stack], depth[stack])
+                    high[stack] = max(high[stack], depth[stack])
+
+            terminator = block.terminator
+            successors = block.successors
+            for callee in block.calls:
+                if not 0 <= callee < self.length:
+                    successors = ()
+                    continue
+                summary = self.summarize(callee)
+                for stack in range(2):
+                    low[stack] = min(low[stack], depth[stack] + summary.low[stack])
+                    high[stack] = max(high[stack], depth[stack] + summary.high[stack])
+                    depth[stack] += summary.net[stack]
+                calls = None if calls is None or summary.calls is None else max(calls, summary.calls + 1)
+                if not summary.returning: # Control never comes back from the call
+                    successors = ()
+
+            if terminator.inst == Instructions.RETURN:
+                returns[terminator.address] = tuple(depth)
+
+            for successor in successors:
+                if not 0 <= successor < self.length:
+                    continue
+                known = depths.get(successor)
+                if known is None:
+                    depths[successor] = tuple(depth)
+                    pending.append(successor)
+                elif known != tuple(depth):
+                    self.issue(terminator.address, f"Stack depths at 0x{successor:X} differ between paths!")
+                    self.unbounded = True
+
+        if len(set(returns.values())) > 1:
+            self.issue(start, f"Routine 0x{start:X} returns with differing stack depths!")
+        net = min(returns.values()) if returns else (0, 0)
+
+        summary = _Summary(bool(returns), tuple(returns), net, tuple(low), tuple(high), calls)
+        self.active.discard(start)
+        self.summaries[start] = summary
+        return summary
+
+    def run(self) -> Verification:
+        self.check_instructions()
+
+        # The entry point is the main routine, which runs with empty stacks
+        main = self.summarize(self.graph.entry)
+        for address in main.returns:
+            self.issue(address, "RETURN with an empty call stack!")
+        for stack, name in enumerate(("state", "position")):
+            if main.low[stack] < 0:
+                self.issue(self.graph.entry, f"The {name} stack underflows!")
+
+        if self.unbounded:
+            depths = StackDepths(None, None, main.calls)
+        else:
+            depths = StackDepths(main.high[0], main.high[1], main.calls)
+
+        return Verification(tuple(sorted(set(self.issues))), depths, self.graph)
+
+def verify(bytecode : bytes | bytearray | memoryview, nullmode : NullOpBehavior = NullOpBehavior.FAULT, entry : int = 0) -> Verification:
+    """
+    Verify a binary.
+
+    Every instruction reachable from the entry point must be legal and complete, its operands must be in range and jumps and calls must land on instructions inside the binary, or right at its end.
+    The maximum depths of the state, position and call stacks are computed along the way, and stack underflows are reported.
+    """
+    return _Verifier(bytecode, nullmode, entry).run()
+
+def fast_path_eligible(verification : Verification) -> bool:
+    """
+    Whether the VM can run a verified binary without any of its per-step checks.
+
+    The binary must pass verification, and every reachable instruction must be one the VM implements. The VM faults on the rest, which are the state and position stack instructions and INITIALIZE.
+    """
+    if not verification.ok:
+        return False
+    return all(record.inst in _ACTIONS or record.inst == Instructions.NULL for block in verification.graph for record in block.instructions)
@@ -2,12 +2,13 @@
 Virtual machine for executing VQsX binaries.
 """
 
-from .constants import Instructions, int_to_inst, is_noop, is_halt
+from .constants import Instructions, int_to_inst
+from .constants import ENDIANESS
 from .constants import StatusFlags, STATUS_ZERO, STATUS_HALTED, STATUS_NEXT, STATUS_FAULT
 from .constants import Colors, index_to_name
-from .constants import RGBColor, map_color
-from .constants import SetOriginValues, sov_to_int, int_to_sov
-from .constants import VQSXI_MAGIC, VQSXI_DIM_FORMAT, VQSXI_CDEPTH_FORMAT, VQSXI_BYTECODELEN_FORMAT
+from .constants import RGBColor, PALETTE
+from .constants import SetOriginValues, sov_to_int
+from .constants import VQSXI_MAGIC, VQSXI_DIM_FORMAT, VQSXI_CDEPTH_FORMAT, VQSXI_BYTECODELEN_FORMAT, VQSXI_PADDING
 from .constants import INSTRUCTION_RAWBINARYOP1_PACK, INSTRUCTION_RAWBINARYOP8_PACK, INSTRUCTION_RAWUNARY1_PACK, INSTRUCTION_RAWUNARY8_PACK, INSTRUCTION_RAWUNARYF_PACK
 from .constants import INSTRUCTION_PACK, INSTRUCTION_BINARYOP1_PACK, INSTRUCTION_BINARYOP8_PACK, INSTRUCTION_UNARY1_PACK, INSTRUCTION_UNARY8_PACK, INSTRUCTION_UNARYF_PACK
 
@@ -17,19 +18,9 @@ from .observers import VQsXObserver, VQsXaObserver, VQsXStubObserver, ObserverEv
 
 import typing, types, enum
 import io, struct
-import functools
+import functools, threading
 import collections.abc as cabc
 
-# Hidden
-_tb_halt = False # traceback on halt
-_info_fetcherror = False # fetcherror
-
-class _nsFetchError(typing.NamedTuple):
-    ipc : int
-    bytecode : bytes
-    len : int
-
-
 from abc import ABC, abstractmethod
 
 __all__ = [
@@ -43,7 +34,6 @@ __all__ = [
 ByteCodeStream = bytes | bytearray
 
 @enum.unique
-@enum.verify(enum.CONTINUOUS)
 class NullOpBehavior(enum.IntEnum):
     """
     Enum to set the behavior of the null opcode.
@@ -51,6 +41,111 @@ class NullOpBehavior(enum.IntEnum):
     NOOP = 0
     HALT = 1
     FAULT = 2
+if [*NullOpBehavior] != list(range(len(NullOpBehavior))):
+    raise ValueError("NullOpBehavior must be contiguous from 0")
+
+# The VM works on plain ints, enums are only looked up for the observers that get them
+_HALTED : int = int(STATUS_HALTED)
+_NEXT : int = int(STATUS_NEXT)
+_FAULT : int = int(STATUS_FAULT)
+_STATUSES : tuple[StatusFlags, ...] = tuple(StatusFlags(status) for status in range((_HALTED | _NEXT | _FAULT) + 1)) # Every combination of the flags
+
+_INSTRUCTIONS : tuple[Instructions | None, ...] = tuple(int_to_inst(opcode) for opcode in range(256))
+_ORIGINS : tuple[SetOriginValues | None, ...] = tuple(SetOriginValues._value2member_map_.get(value) for value in range(-128, 128)) # By signed operand + 128
+_COLOR_NAMES : tuple[Colors | None, ...] = tuple(index_to_name(index) for index in range(-128, 128)) # By signed operand + 128
+_COLOR_RGBS : tuple[RGBColor, ...] = tuple(PALETTE[index & 0xFF] for index in range(-128, 128)) # By signed operand + 128, as the unsigned color index
+
+# Kinds of actions the VM takes for an opcode
+_ACT_FAULT = 0 # Legal, but the VM can't run it
+_ACT_NOOP = 1
+_ACT_HALT = 2
+_ACT_WAITNEXT = 3
+_ACT_JUMP = 4 # Fetch the offset and transfer control relative to the base
+_ACT_CALL = 5 # Like _ACT_JUMP, pushing the address of the next instruction on the call stack
+_ACT_RETURN = 6
+_ACT_NOTIFY = 7 # Fetch the operands and notify the observers
+_ACT_SETORIGIN = 8 # Like _ACT_NOTIFY, with the origin as a SetOriginValues
+_ACT_COLOR = 9 # Like _ACT_NOTIFY, with the color as a Colors and an RGBColor
+
+# What the offset of a jump or call is relative to. The bytecode is loaded at the start of memory, so absolute addresses are relative to its start.
+_BASE_ABSOLUTE = 0
+_BASE_IPC = 1 # The address of the next instruction
+_BASE_MST = 2
+
+_CALL_DEPTH = 1 << 16 # Size of the call stack, calling any deeper faults
+
+_BINARYOP8 = struct.Struct(f"{ENDIANESS}{INSTRUCTION_RAWBINARYOP8_PACK}")
+_UNARY1 = struct.Struct(f"{ENDIANESS}{INSTRUCTION_RAWUNARY1_PACK}")
+_UNARY8 = struct.Struct(f"{ENDIANESS}{INSTRUCTION_RAWUNARY8_PACK}")
+_UNARYF = struct.Struct(f"{ENDIANESS}{INSTRUCTION_RAWUNARYF_PACK}")
+
+_ACTIONS : dict[Instructions, tuple[int, ObserverEvents | int | None, struct.Struct | None]] = { # Kind, event (or base of a jump or call) and operands of each instruction the VM runs
+    Instructions.NOOP: (_ACT_NOOP, None, None),
+    Instructions.HALT: (_ACT_HALT, None, None),
+    Instructions.WAITNEXT: (_ACT_WAITNEXT, None, None),
+    Instructions.POSITION: (_ACT_NOTIFY, ObserverEvents.POSITION, _BINARYOP8),
+    Instructions.CENTER: (_ACT_NOTIFY, ObserverEvents.CENTER, None),
+    Instructions.ORIGIN: (_ACT_NOTIFY, ObserverEvents.ORIGIN, None),
+    Instructions.SETORIGIN: (_ACT_SETORIGIN, ObserverEvents.SETORIGIN, _UNARY1),
+    Instructions.BRIGHTNESS: (_ACT_NOTIFY, ObserverEvents.BRIGHTNESS, _UNARY1),
+    Instructions.SCALE: (_ACT_NOTIFY, ObserverEvents.SCALE, _UNARY1),
+    Instructions.COLOR: (_ACT_COLOR, ObserverEvents.COLOR, _UNARY1),
+    Instructions.DRAW: (_ACT_NOTIFY, ObserverEvents.DRAW, _BINARYOP8),
+    Instructions.FORWARD: (_ACT_NOTIFY, ObserverEvents.FORWARD, _UNARY8),
+    Instructions.BACKWARDS: (_ACT_NOTIFY, ObserverEvents.BACKWARD, _UNARY8),
+    Instructions.DRAWFORWARD: (_ACT_NOTIFY, ObserverEvents.DRAWFORWARD, _UNARY8),
+    Instructions.DRAWBACKWARDS: (_ACT_NOTIFY, ObserverEvents.DRAWBACKWARD, _UNARY8),
+    Instructions.ROTATEDEG: (_ACT_NOTIFY, ObserverEvents.ROTATEDEG, _UNARYF),
+    Instructions.ROTATERAD: (_ACT_NOTIFY, ObserverEvents.ROTATERAD, _UNARYF),
+    Instructions.ROTATERDEG: (_ACT_NOTIFY, ObserverEvents.ROTATERDEG, _UNARYF),
+    Instructions.ROTATERRAD: (_ACT_NOTIFY, ObserverEvents.ROTATERRAD, _UNARYF),
+    Instructions.ROTATEORIGIN: (_ACT_NOTIFY, ObserverEvents.ROTATEORIGIN, None),
+    Instructions.ROTATESETORIGIN: (_ACT_NOTIFY, ObserverEvents.ROTATESETORIGIN, _UNARY1),
+    Instructions.JUMP: (_ACT_JUMP, _BASE_ABSOLUTE, _UNARY8),
+    Instructions.CALL: (_ACT_CALL, _BASE_ABSOLUTE, _UNARY8),
+    Instructions.JUMPIPC: (_ACT_JUMP, _BASE_IPC, _UNARY8),
+    Instructions.CALLIPC: (_ACT_CALL, _BASE_IPC, _UNARY8),
+    Instructions.JUMPMST: (_ACT_JUMP, _BASE_MST, _UNARY8),
+    Instructions.CALLMST: (_ACT_CALL, _BASE_MST, _UNARY8),
+    Instructions.RETURN: (_ACT_RETURN, None, None),
+}
+
+def _dispatch_table(nullmode : NullOpBehavior) -> tuple[tuple | None, ...]:
+    """
+    Build the table of what the VM does for every opcode under a null opcode behavior, None for illegal opcodes.
+
+    Entries are the kind of action, the event to notify, the operand struct and the operand size.
+    """
+    null = {NullOpBehavior.NOOP: _ACT_NOOP, NullOpBehavior.HALT: _ACT_HALT}.get(nullmode, _ACT_FAULT)
+    table = []
+    for inst in _INSTRUCTIONS:
+        if inst is None:
+            table.append(None)
+            continue
+        kind, event, operands = _ACTIONS.get(inst, (_ACT_FAULT, None, None))
+        if inst == Instructions.NULL:
+            kind = null
+        table.append((kind, event, operands, operands.size if operands is not None else 0))
+    return tuple(table)
+
+_DISPATCH : dict[NullOpBehavior, tuple[tuple | None, ...]] = {nullmode: _dispatch_table(nullmode) for nullmode in NullOpBehavior}
+
+# Names of the observer method of every event
+_EVENT_METHODS : dict[ObserverEvents, str] = {event: event.name.lower() for event in ObserverEvents}
+
+def _handlers(observers : tuple[VQsXObserver, ...]) -> dict[ObserverEvents, tuple[cabc.Callable, ...]]:
+    """
+    Collect the observer methods to call for every event.
+
+    Methods observers inherit from VQsXStubObserver do nothing, so they are left out. An event nobody handles costs the VM nothing, not even building its arguments.
+    """
+    handlers = {}
+    for event, name in _EVENT_METHODS.items():
+        stub = getattr(VQsXStubObserver, name)
+        handlers[event] = tuple(getattr(observer, name) for observer in observers if getattr(type(observer), name, None) is not stub)
+    return handlers
+
+_NO_HANDLERS : dict[ObserverEvents, tuple[cabc.Callable, ...]] = _handlers(())
 
 class VQsXExecutor(object):
     """
@@ -58,7 +153,20 @@ class VQsXExecutor(object):
 
     This virtual machine is a high level virtual machine. It does not emulate the machine precisely, just the operations.
     Even yet, some behaviors aren't perfectly emulated because of the way the VM is designed.
+
+    The VM uses slots to stay small, so many of them can be resident at once.
+    Internally, everything is a plain int. Opcodes are dispatched through a table shared by all VMs, and enums are only looked up for the observers that are notified with them.
     """
+    __slots__ = ("__observers", "__handlers", "nullmode", "__dispatch",
+                 "__bytecode", "__verification", "__fast", "mst", "__calls", "ipc", "__status",
+                 "__wakeup",
+                 "_tb_halt", "_info_fetcherror",
+                 "__weakref__")
+
+    # Guards changes to the observers of any VM, so VMs can be shared between threads
+    __registration : threading.Lock = threading.Lock()
+    # Guards every write to the status register, so trignext() from another thread never loses the flags the VM sets. The VM only writes it to halt, wait or restart, which is rare enough to share one lock.
+    __signals : threading.Lock = threading.Lock()
 
     def __init__(self, nullmode : NullOpBehavior = NullOpBehavior.FAULT):
         """
@@ -67,22 +175,35 @@ class VQsXExecutor(object):
         super().__init__()
 
         # Observers for observing events like calls from the VM.
-        self.__observers : set[VQsXObserver] = set()
+        # Kept as a tuple that is replaced on every change, as VMs rarely have more than one or two. VMs without observers share the empty tuple.
+        self.__observers : tuple[VQsXObserver, ...] = ()
+        self.__handlers : dict[ObserverEvents, tuple[cabc.Callable, ...]] = _NO_HANDLERS # Observer methods to call by event, see _handlers()
 
         # Set the behavior of the null opcode
         # Currently faulty, this should be user settable
         self.nullmode : NullOpBehavior = nullmode
-        self.__null_isnoop : bool = (self.nullmode == NullOpBehavior.NOOP)
-        self.__null_ishalt : bool = (self.nullmode == NullOpBehavior.HALT)
+        self.__dispatch : tuple[tuple | None, ...] = _DISPATCH[NullOpBehavior(nullmode)]
+
+        # Result of verifying the bytecode, see verify(), and whether it runs without the per-step checks
+        self.__verification = None
+        self.__fast : bool = False
 
         # Initialize the bytecode to an empty bytecode
-        self.bytecode : bytes = bytes()
+        self.__bytecode : bytes = bytes()
 
         # Initialize the VM state.
         self.mst : int = 0 # MST - Memory Start
         self.ipc : int = self.mst # IPC - Instruction Pointer/Program Counter
+        self.__calls : list[int] = [] # Call stack, of the addresses to return to
+
+        self.__status : int = _HALTED # Status - Status register, see the status property
 
-        self.status : StatusFlags = STATUS_ZERO | STATUS_HALTED # Status - Status register
+        # The event loop and event that run_async() sleeps on while waiting for NEXT, None when not running asynchronously
+        self.__wakeup : tuple | None = None
+
+        # Hidden debugging switches, kept per VM so VMs on different threads don't share any mutable state
+        self._tb_halt : bool = False # traceback on halt
+        self._info_fetcherror : bool = False # fetcherror
 
 
     @functools.singledispatchmethod
@@ -114,152 +235,96 @@ class VQsXExecutor(object):
         self.load(0, bytecode)
 
 
-    def reset(self):
+    @property
+    def bytecode(self) -> bytes:
         """
-        Reset the VM into its initial state.
-        """
-
-        # Reset some instruction pointer/program counter
-        self.mst = 0
-        self.ipc = self.mst
+        The loaded bytecode.
 
-        self.status = STATUS_ZERO | STATUS_HALTED
-
-    def setup(self):
-        """
-        Setup the VM with initial values.
+        Assigning other bytecode drops the verification of the old one, so it is never run unchecked.
         """
+        return self.__bytecode
 
-    
+    @bytecode.setter
+    def bytecode(self, bytecode : bytes):
+        if bytecode is not self.__bytecode and bytecode != self.__bytecode:
+            self.verification = None # The new bytecode is yet to be verified
+        self.__bytecode = bytecode
 
-    
-    def __halt(self, faulty : bool):
+    @property
+    def verification(self):
         """
-        Halt the vm.
+        The result of verifying the loaded bytecode, None if it wasn't verified.
 
-        The faulty argument specifies whether to halt with fault or not. It basically specifies if the halt is faulty or not in nature.
+        Bytecode that is eligible for the fast path, see vqsx.verify.fast_path_eligible(), runs without the per-step checks.
         """
-        self.status = self.status | STATUS_HALTED
-        if faulty: self.status = self.status | STATUS_FAULT
-
-        if _tb_halt:
-            import traceback
-            traceback.print_stack()
+        return self.__verification
 
-        self.__notify_observers(ObserverEvents.HALT, faulty)
+    @verification.setter
+    def verification(self, verification):
+        if verification is None:
+            self.__fast = False
+        else:
+            from .verify import fast_path_eligible # Imported here since the verifier builds on the VM module
+            self.__fast = fast_path_eligible(verification)
+        self.__verification = verification
 
-    def __ishalted(self) -> bool:
-        """
-        Utility function to check the halting state.
+    def reset(self):
         """
-        return (self.status & STATUS_HALTED)
-
-
-    def __advance(self, count : int) -> tuple[int, int]:
+        Reset the VM into its initial state.
         """
-        DRY attempt for advance.
 
-        Return
-            Index 0 - Old ipc
-            Index 1 - Next ipc
-        """
-        oldipc = self.ipc
-        nextipc = oldipc+count
-        self.ipc = nextipc
-        return (oldipc, nextipc)
+        # Reset some instruction pointer/program counter
+        self.mst = 0
+        self.ipc = self.mst
+        self.__calls.clear()
 
+        with self.__signals:
+            self.__status = _HALTED
 
-    def __fetch(self) -> int | _nsFetchError:
-        """
-        Fetch bytes and move on.
-        
-        Meant for instructions
-        """
-        # print(self.bytecode, self.ipc, len(self.bytecode))
-        try:
-            mc = self.bytecode[self.ipc]
-            self.ipc = self.__advance(1)[1]
-            return mc
-        except IndexError:
-            ns : _nsFetchError = _nsFetchError(self.ipc, self.bytecode, len(self.bytecode))
-            return ns
-    
-    def __fetch_binaryop8(self) -> tuple[int, int]:
+    @property
+    def status(self) -> StatusFlags:
         """
-        Fetch Binary 64-bit operands.
+        The status register.
         """
+        return _STATUSES[self.__status]
 
-        ops = bytes()
-        oldipc, nextipc = self.__advance(8)
-        ops = ops + self.bytecode[oldipc:nextipc]
-        oldipc, nextipc = self.__advance(8)
-        ops = ops + self.bytecode[oldipc:nextipc]
-        # print(hex(self.bytecode[self.ipc]))
-
-        op1, op2 = struct.unpack(INSTRUCTION_RAWBINARYOP8_PACK, ops)
-        return (op1, op2)
+    @status.setter
+    def status(self, status : StatusFlags):
+        with self.__signals:
+            self.__status = int(status)
 
-    def __fetch_binaryop1(self) -> tuple[int, int]:
+    def setup(self):
         """
-        Fetch Binary 8-bit operands.
+        Setup the VM with initial values.
         """
-        ops = bytes()
-        oldipc, nextipc = self.__advance(1)
-        ops = ops + self.bytecode[oldipc:nextipc]
-        oldipc, nextipc = self.__advance(1)
-        ops = ops + self.bytecode[oldipc:nextipc]
-        # print(hex(self.bytecode[self.ipc]))
 
-        op1, op2 = struct.unpack(INSTRUCTION_RAWBINARYOP1_PACK, ops)
-        return (op1, op2)
     
-    def __fetch_unary1(self) -> int:
-        """
-        Fetch a Unary 8-bit operand
-        """
-
-        sop = bytes()
-        oldipc, nextipc = self.__advance(1)
-        sop = bytes(self.bytecode[oldipc:nextipc])
-
-        op, *_ = struct.unpack(INSTRUCTION_RAWUNARY1_PACK, sop)
 
-        return op
     
-    def __fetch_unary8(self) -> int:
-        """
-        Fetch a Unary 64-bit operand
+    def __halt(self, faulty : bool):
         """
+        Halt the vm.
 
-        sop = bytes()
-        oldipc, nextipc = self.__advance(8)
-        sop = bytes(self.bytecode[oldipc:nextipc])
-
-        op, *_ = struct.unpack(INSTRUCTION_RAWUNARY8_PACK, sop)
-
-        return op
-    
-    def __fetch_unaryf(self) -> float:
-        """
-        Fetch an 64-bit IEEE 754 operand
+        The faulty argument specifies whether to halt with fault or not. It basically specifies if the halt is faulty or not in nature.
         """
+        with self.__signals:
+            self.__status |= _HALTED | _FAULT if faulty else _HALTED
 
-        sop = bytes()
-        oldipc, nextipc = self.__advance(8)
-        sop = bytes(self.bytecode[oldipc:nextipc])
+        if self._tb_halt:
+            import traceback
+            traceback.print_stack()
 
-        op, *_ = struct.unpack(INSTRUCTION_RAWUNARYF_PACK, sop)
+        for handler in self.__handlers[ObserverEvents.HALT]:
+            handler(faulty)
 
-        return op
-    
-    
     def spin(self):
         """
         Puts the VM into execution ready state.
 
         This does not start the execution, just sets some flags for readiness.
         """
-        self.status = STATUS_ZERO
+        with self.__signals:
+            self.__status = 0
 
 
 
@@ -267,7 +332,10 @@ class VQsXExecutor(object):
         """
         Registers an observer with the VQsX VM.
         """
-        self.__observers.add(observer)
+        with self.__registration:
+            if observer not in self.__observers:
+                self.__observers = (*self.__observers, observer)
+                self.__handlers = _handlers(self.__observers)
 
     def deregister(self, observer : VQsXObserver) -> bool:
         """
@@ -277,11 +345,12 @@ class VQsXExecutor(object):
         A False return value means the observer wasn't removed succesfully.
         """
 
-        try:
-            self.__observers.remove(observer)
+        with self.__registration:
+            if observer not in self.__observers:
+                return False
+            self.__observers = tuple(registered for registered in self.__observers if registered is not observer)
+            self.__handlers = _handlers(self.__observers) if self.__observers else _NO_HANDLERS
             return True
-        except KeyError:
-            return False
         
     def __notify_observers(self, event : ObserverEvents, *args, **kwargs):
         """
@@ -292,106 +361,122 @@ class VQsXExecutor(object):
         This function is an implementation detail. Don't rely on this.
         """
 
-        for observer in self.__observers: # Notify all observers
-            # We separate all the observer methods so its simpler on the observer's side.
-            # Even if its kinda WET, we do this so we can call the appropriate observer methods.
-
-            # Event MatchDB
-            # Used for writing DRY and maintainable code
-            MATCHDB : dict[ObserverEvents, types.FunctionType] = {
-                # Special events
-                ObserverEvents.ONSTEP: observer.onstep,
-                ObserverEvents.FETCHINST: observer.fetchinst,
-                ObserverEvents.FETCHDECODEDINST: observer.fetchdecodedinst,
-                ObserverEvents.HALT: observer.halt,
-
-                # Instructions!
-                ObserverEvents.POSITION: observer.position, # hey, position! Get your x & y!
-                ObserverEvents.CENTER: observer.center, # hey, center!
-                ObserverEvents.ORIGIN: observer.origin, # hey origin!
-                ObserverEvents.SETORIGIN: observer.setorigin, # hey, setorigin! Get your setorigin values!
-                ObserverEvents.BRIGHTNESS: observer.brightness, # hey, brightness! Get your brightness values!
-                ObserverEvents.SCALE: observer.scale, # hey, scale! Get your scale factor values!
-                ObserverEvents.COLOR: observer.color, # hey, color! Get your color values here!
-                ObserverEvents.DRAW: observer.draw, # hey, draw! Get your x & y!
-                ObserverEvents.FORWARD: observer.forward, # hey, forward! Move forward!
-                ObserverEvents.BACKWARD: observer.backward, # hey, backwards! Move backwards!
-                ObserverEvents.DRAWFORWARD: observer.drawforward, # hey, drawforward! Move and draw forward!
-                ObserverEvents.DRAWBACKWARD: observer.drawbackward, # hey, drawbackward! Move and draw backward!
-                ObserverEvents.ROTATEDEG: observer.rotatedeg, # TODO: Do more of the hey!
-                ObserverEvents.ROTATERAD: observer.rotaterad,
-                ObserverEvents.ROTATERDEG: observer.rotaterdeg,
-                ObserverEvents.ROTATERRAD: observer.rotaterrad,
-                ObserverEvents.ROTATEORIGIN: observer.rotateorigin,
-                ObserverEvents.ROTATESETORIGIN: observer.rotatesetorigin,
-            }
-
-            # Maintainability
-            handler = MATCHDB[event]
+        for handler in self.__handlers[event]:
             handler(*args, **kwargs)
 
+    def __execute(self, opcode : int, action : tuple):
+        """
+        Execute a legal instruction whose opcode was fetched, with the ipc past the opcode, by its entry in the dispatch table.
+
+        Operands cut short by the end of the bytecode raise struct.error.
+        """
+        handlers = self.__handlers
+        decoded = handlers[ObserverEvents.FETCHDECODEDINST]
+        if decoded:
+            inst = _INSTRUCTIONS[opcode]
+            for handler in decoded:
+                handler(inst)
+
+        kind, event, operands, size = action
+        if kind >= _ACT_NOTIFY:
+            if operands is None:
+                args = ()
+            else:
+                args = operands.unpack_from(self.bytecode, self.ipc)
+                self.ipc += size
+            if kind == _ACT_SETORIGIN:
+                origin = _ORIGINS[args[0] + 128]
+                if origin is None: # Not an origin
+                    self.__halt(True)
+                    return
+                args = (origin,)
+            notified = handlers[event]
+            if notified:
+                if kind == _ACT_COLOR:
+                    args = (_COLOR_NAMES[args[0] + 128], _COLOR_RGBS[args[0] + 128])
+                for handler in notified:
+                    handler(*args)
+        elif kind >= _ACT_JUMP:
+            self.__branch(kind, event, operands, size)
+        elif kind == _ACT_WAITNEXT:
+            with self.__signals:
+                self.__status |= _NEXT
+        elif kind != _ACT_NOOP:
+            self.__halt(kind == _ACT_FAULT)
+
+    def __branch(self, kind : int, base : int | None, operands : struct.Struct | None, size : int):
+        """
+        Execute a jump, call or return, with the ipc past the opcode.
+
+        Returning with an empty call stack, calling past the size of the call stack and transferring control before the start of the bytecode fault.
+        Transferring control to or past the end halts, just like running off the end.
+        """
+        calls = self.__calls
+        if kind == _ACT_RETURN:
+            if not calls:
+                self.__halt(True)
+                return
+            self.ipc = calls.pop()
+            return
+
+        offset, = operands.unpack_from(self.__bytecode, self.ipc)
+        following = self.ipc + size
+        target = offset + (following if base == _BASE_IPC else self.mst if base == _BASE_MST else 0)
+        self.ipc = following
+        if target < 0 or (kind == _ACT_CALL and len(calls) >= _CALL_DEPTH):
+            self.__halt(True)
+            return
+        if kind == _ACT_CALL:
+            calls.append(following)
+        self.ipc = target
+
+    def verify(self):
+        """
+        Verify the loaded bytecode, see vqsx.verify.
+
+        If the bytecode passes verification and the VM implements every instruction in it, the VM runs it without checking for illegal instructions and truncated operands on every step.
+        The result of the verification is returned, and kept in the verification attribute until other bytecode is loaded or assigned.
+        """
+        from .verify import verify # Imported here since the verifier builds on the VM module
 
+        self.verification = verify(self.bytecode, self.nullmode)
+        return self.verification
 
-    def __step_instructions(self, inst : Instructions):
-
-        if inst == Instructions.POSITION:
-            pos : tuple[int, int] = self.__fetch_binaryop8()
-            self.__notify_observers(ObserverEvents.POSITION, pos[0], pos[1])
-        elif inst == Instructions.CENTER:
-            self.__notify_observers(ObserverEvents.CENTER)
-        elif inst == Instructions.ORIGIN:
-            self.__notify_observers(ObserverEvents.ORIGIN)
-        elif inst == Instructions.SETORIGIN:
-            ori : int = self.__fetch_unary1()
-            ori : SetOriginValues = int_to_sov(ori)
-            self.__notify_observers(ObserverEvents.SETORIGIN, ori)
-        elif inst == Instructions.BRIGHTNESS:
-            bri : int = self.__fetch_unary1()
-            self.__notify_observers(ObserverEvents.BRIGHTNESS, bri)
-        elif inst == Instructions.SCALE:
-            scalef : int = self.__fetch_unary1()
-            self.__notify_observers(ObserverEvents.SCALE, scalef)
-        elif inst == Instructions.COLOR:
-            coloridx : int = self.__fetch_unary1()
-            color : Colors = index_to_name(coloridx)
-            actualcolor : RGBColor = map_color(coloridx)
-            self.__notify_observers(ObserverEvents.COLOR, color, actualcolor)
-        elif inst == Instructions.DRAW:
-            pos : tuple[int, int] = self.__fetch_binaryop8()
-            self.__notify_observers(ObserverEvents.DRAW, pos[0], pos[1])
-        elif inst == Instructions.FORWARD:
-            dist : int = self.__fetch_unary8()
-            self.__notify_observers(ObserverEvents.FORWARD, dist)
-        elif inst == Instructions.BACKWARDS:
-            dist : int = self.__fetch_unary8()
-            self.__notify_observers(ObserverEvents.BACKWARD, dist)
-        elif inst == Instructions.DRAWFORWARD:
-            dist : int = self.__fetch_unary8()
-            self.__notify_observers(ObserverEvents.DRAWFORWARD, dist)
-        elif inst == Instructions.BACKWARDS:
-            dist : int = self.__fetch_unary8()
-            self.__notify_observers(ObserverEvents.DRAWBACKWARD, dist)
-        elif inst == Instructions.ROTATEDEG:
-            angle : float = self.__fetch_unaryf()
-            self.__notify_observers(ObserverEvents.ROTATEDEG, angle)
-        elif inst == Instructions.ROTATERAD:
-            angle : float = self.__fetch_unaryf()
-            self.__notify_observers(ObserverEvents.ROTATERAD, angle)
-        elif inst == Instructions.ROTATERDEG:
-            angle : float = self.__fetch_unaryf()
-            self.__notify_observers(ObserverEvents.ROTATERDEG, angle)
-        elif inst == Instructions.ROTATERRAD:
-            angle : float = self.__fetch_unaryf()
-            self.__notify_observers(ObserverEvents.ROTATERAD, angle)
-        elif inst == Instructions.ROTATEORIGIN:
-            self.__notify_observers(ObserverEvents.ROTATEORIGIN)
-        elif inst == Instructions.ROTATESETORIGIN:
-            ori : int = self.__fetch_unary1()
-            self.__notify_observers(ObserverEvents.ROTATESETORIGIN)
-        else:
-            return True # Unknown?
-        
-        return False # Nah
+    def __step_verified(self):
+        """
+        Single-step verified bytecode.
+
+        The verifier proved that every reachable instruction is legal, complete and implemented, so none of that is checked here.
+        Otherwise this steps exactly like step(), halting right after the last instruction.
+        """
+        ipc = self.ipc
+        bytecode = self.__bytecode
+        length = len(bytecode)
+
+        # Woken up from a WAITNEXT at the end of the bytecode, which then halts like running off the end
+        if ipc == length and ipc > 0:
+            self.__halt(False)
+            return
+
+        onstep = self.__handlers[ObserverEvents.ONSTEP]
+        for handler in onstep:
+            handler(False)
+
+        if ipc >= length: # Nothing to fetch, like empty bytecode
+            self.__halt(True)
+            return
+        opcode = bytecode[ipc]
+        self.ipc = ipc + 1
+        for handler in self.__handlers[ObserverEvents.FETCHINST]:
+            handler(opcode)
+        self.__execute(opcode, self.__dispatch[opcode])
+
+        # Halt if there is no more, unless waiting for NEXT first
+        if self.ipc >= length and not (self.__status & (_HALTED | _NEXT)):
+            self.__halt(False)
+
+        for handler in onstep:
+            handler(True)
 
     def step(self):
         """
@@ -399,44 +484,120 @@ class VQsXExecutor(object):
         This only executes 1 instruction.
         """
 
-        # Handle halt state
-        if self.__ishalted(): return
+        # Handle halt state, and sleep until the NEXT signal
+        if self.__status & (_HALTED | _NEXT): return
+
+        # Verified bytecode takes the fast path
+        if self.__fast:
+            self.__step_verified()
+            return
+
+        ipc = self.ipc
+        bytecode = self.bytecode
+        length = len(bytecode)
+
+        # Woken up from a WAITNEXT at the end of the bytecode, which then halts like running off the end
+        if ipc == length and ipc > 0:
+            self.__halt(False)
+            return
 
         # Notify observers
-        self.__notify_observers(ObserverEvents.ONSTEP, False)
+        onstep = self.__handlers[ObserverEvents.ONSTEP]
+        for handler in onstep:
+            handler(False)
 
-        inst = self.__fetch() # Fetch instructions
-        if isinstance(inst, _nsFetchError):
-            if _info_fetcherror:
-                print(f"ipc={inst.ipc} size={inst.len}", inst.bytecode)
+        if ipc >= length: # Fetch instructions
+            if self._info_fetcherror:
+                print(f"ipc={ipc} size={length}", bytecode)
 
             self.__halt(True)
             return
-
-        # Handle invalid instructions while at the same time converting it to an Instruction enum
-        self.__notify_observers(ObserverEvents.FETCHINST, inst)
-        inst = int_to_inst(inst)
-        if inst is None: # Invalid/Illegal? Halt
+        opcode = bytecode[ipc]
+        self.ipc = ipc + 1
+
+        # Handle invalid instructions
+        for handler in self.__handlers[ObserverEvents.FETCHINST]:
+            handler(opcode)
+        action = self.__dispatch[opcode]
+        if action is None: # Invalid/Illegal? Halt
             self.__halt(True)
             return
-        self.__notify_observers(ObserverEvents.FETCHDECODEDINST, inst)
-        
-        # Handle the instructions in the order of implementation
-        if is_noop(inst, self.__null_isnoop): # Is noop?
-            pass
-        elif is_halt(inst, self.__null_ishalt): # Is halt?
-            self.__halt(False)
-        else: # For other/invalid/illegal instructions
-            shouldhaltfaulty = self.__step_instructions(inst)
-            if shouldhaltfaulty:
-                self.__halt(True) # Halt faulty     
 
-        # Halt if there is no more
-        if self.ipc >= len(self.bytecode):
+        try:
+            self.__execute(opcode, action)
+        except struct.error: # Operands cut short by the end of the bytecode
+            self.__halt(True)
+
+        # Halt if there is no more, unless waiting for NEXT first
+        if self.ipc >= length and not (self.__status & (_HALTED | _NEXT)):
             self.__halt(False)
 
-        self.__notify_observers(ObserverEvents.ONSTEP, True)   
+        for handler in onstep:
+            handler(True)
+
 
+    def run_slice(self, budget : int) -> int:
+        """
+        Run the VM for up to budget instructions, without resetting it first.
+
+        This lets a VM share a thread with others, see vqsx.scheduler. Returns how many instructions were run, which is less than budget if the VM halted.
+        Running also stops early when the VM starts waiting for NEXT, so it doesn't spin on a sleeping VM.
+        """
+        steps = 0
+        while steps < budget and not (self.__status & (_HALTED | _NEXT)):
+            self.step()
+            steps += 1
+        return steps
+
+    def waitnext(self):
+        """
+        Make the VM wait for the NEXT signal, like the WAITNEXT pin or instruction does.
+
+        A waiting VM doesn't step until trignext() is called.
+        """
+        with self.__signals:
+            self.__status |= _NEXT
+
+    def trignext(self):
+        """
+        Trigger the NEXT signal, like the TRIGNEXT pin does, waking the VM if it waits for NEXT.
+
+        If the VM isn't waiting for NEXT, nothing happens. This can be called from any thread, also while run_async() runs, as every write to the status register holds the same lock.
+        """
+        with self.__signals:
+            if not (self.__status & _NEXT):
+                return
+            self.__status &= ~_NEXT
+
+        wakeup = self.__wakeup
+        if wakeup is not None:
+            loop, event = wakeup
+            loop.call_soon_threadsafe(event.set)
+
+    async def run_async(self, every : int = 1000):
+        """
+        Resets and runs the VM until it is finished executing, as a coroutine.
+
+        The VM yields to the event loop every so many instructions, so many VMs can run on a single event loop.
+        While waiting for NEXT, the VM sleeps until trignext() is called instead of polling.
+        """
+        import asyncio # Only needed here, so importing the VM stays cheap
+
+        self.reset()
+        self.spin()
+
+        event = asyncio.Event()
+        self.__wakeup = (asyncio.get_running_loop(), event)
+        try:
+            while not (self.__status & _HALTED):
+                if self.__status & _NEXT:
+                    await event.wait()
+                    event.clear()
+                    continue
+                self.run_slice(every)
+                await asyncio.sleep(0)
+        finally:
+            self.__wakeup = None
 
     def run(self):
         """
@@ -451,7 +612,7 @@ class VQsXExecutor(object):
         self.spin()
 
         # Run the VM
-        while (not (self.status & STATUS_HALTED)):
+        while (not (self.__status & _HALTED)):
             self.step()
 
 
@@ -461,6 +622,7 @@ class ImageEngine(VQsXExecutor, object):
     This virtual machine takes into account the color depth and image size.
     The format that is read is the VQsXi format.
     """
+    __slots__ = ("width", "height", "colordepth")
 
     def __init__(self):
         """
@@ -504,8 +666,12 @@ class ImageEngine(VQsXExecutor, object):
         if len(bpcodelength) < 8: raise VQsXiBadFieldException("Bytecode length field is invalid! Not a VQsXi stream!")
         pcodelength, = struct.unpack(VQSXI_BYTECODELEN_FORMAT, bpcodelength)
 
+        # Skip the reserved padding that ends the header
+        padding = stream.read(VQSXI_PADDING)
+        if len(padding) < VQSXI_PADDING: raise VQsXiBadFieldException("Header padding is missing! Not a VQsXi stream!")
+
         # Slice the image buffer via stream to obtain the bytecode according to the bytecode length
         pcode = stream.read(pcodelength)
         if len(pcode) < pcodelength: raise VQsXiBytecodeUnderflowException("Bytecode size was lower than expectation!", pcodelength, len(pcode))
         
-        super().load(pcode)
\ No newline at end of file
+        super().load(0, pcode) # Load from the start explicitly, loading a stream would dispatch back into this method
\ No newline at end of file
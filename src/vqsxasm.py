@@ -3,26 +3,264 @@
 The VQsX Assembler CLI.
 
 This assembler uses the VQsX assembler API.
+
+Given several inputs or a directory, the assembler runs in batch mode. The sources are assembled in parallel by a pool of processes, each of which keeps a single warm assembler.
+Sources whose content (and the content of their included files) didn't change since the last batch are skipped.
 """
 
 import vqsx
-import argparse, sys
+import argparse, sys, os, time, json, hashlib
+import concurrent.futures as futures
+
+MANIFEST = ".vqsxasm-manifest.json" # Kept in the output directory of a batch
+PHASES = ("lex", "emit", "fixup", "write")
 
-asm = vqsx.Assembler()
 parser = argparse.ArgumentParser("vqsxasm",
                                  description="The VQsX Assembler.")
 
-parser.add_argument("-o", "--output", 
+parser.add_argument("-o", "--output",
                     dest="output",
-                    help="Where to output the generated assembled binary.",
+                    help="Where to output the generated assembled binary. Pass '-' to output to stdout. In batch mode, this is the output directory.",
                     type=str,
-                    default="a.vBin")
+                    default=None)
+
+parser.add_argument("-V", "--verbosity",
+                    dest="verbosity",
+                    help="The verbosity of the assembler. 0 is silent, 1 shows errors, 2 shows progress and 3 shows the time spent in each assembly step.",
+                    type=int,
+                    choices=range(4),
+                    default=1)
+
+parser.add_argument("-J", "--jump",
+                    dest="jump",
+                    help="How are jumps and calls translated to in the final compiled binary.",
+                    choices=[jump.value for jump in vqsx.JumpTranslation],
+                    default=vqsx.JumpTranslation.AUTO.value)
+
+parser.add_argument("-I", "--include",
+                    dest="include",
+                    help="Directory to look up included files in. Can be given multiple times.",
+                    action="append",
+                    default=[])
+
+parser.add_argument("--cache-dir",
+                    dest="cache",
+                    help="Directory to cache the assembled included files in, so unchanged includes aren't assembled again.",
+                    type=str,
+                    default=None)
+
+parser.add_argument("-j", "--jobs",
+                    dest="jobs",
+                    help="How many processes assemble in batch mode. Defaults to the number of CPUs.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-f", "--force",
+                    dest="force",
+                    help="Assemble every source in batch mode, even the unchanged ones.",
+                    action="store_true")
 
 parser.add_argument("input",
-                    help="Input VQsX Assembler assembly source.",
-                    type=str)
+                    help="Input VQsX Assembler assembly sources or directories of them. Pass '-' to read from stdin.",
+                    type=str,
+                    nargs="+")
+
+def digest(path : str) -> str:
+    """
+    Hash the content of a file.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def report(verbosity : int, level : int, message : str):
+    """
+    Print a message if the verbosity allows for it.
+    """
+    if verbosity >= level:
+        print(message, file=sys.stderr)
+
+def timings(timings : dict[str, float]) -> str:
+    """
+    Format the time spent in each assembly step.
+    """
+    return " ".join(f"{phase}={timings[phase] * 1000:.3f}ms" for phase in PHASES)
+
+# Batch workers. Each process keeps one assembler, along with the in-memory fragments of its cache, across all the sources it assembles.
+_assembler : vqsx.Assembler | None = None
+
+def _init_worker(jump : str, include : list[str], cache : str | None, profile : bool):
+    global _assembler
+    _assembler = vqsx.Assembler(jump, None, include, vqsx.FragmentCache(cache) if cache is not None else None, profile=profile)
+
+def _assemble(source : str, output : str) -> tuple[dict[str, str], dict[str, float] | None, str | None]:
+    """
+    Assemble a single source of a batch.
+
+    Returns the included files and their digests, the timings and the error if the assembly failed.
+    Errors are returned as messages because assembler exceptions carry extra arguments and don't round-trip through pickling.
+    """
+    _assembler.reset()
+    written = False
+    try:
+        os.makedirs(os.path.dirname(output) or os.curdir, exist_ok=True)
+        with open(source, "r") as f, open(output, "wb") as sink:
+            written = True
+            _assembler.sink = sink
+            try:
+                _assembler.assemble(f)
+            finally:
+                _assembler.sink = None
+    except vqsx.VQsXAssemblerException as e:
+        error = f"{source}:{getattr(e, 'line', '?')}: {e}"
+    except ValueError as e: # Sources that aren't valid UTF-8
+        error = f"{source}: {e}"
+    except OSError as e:
+        error = str(e)
+    else:
+        return _assembler.deps, dict(_assembler.timings) if _assembler.timings is not None else None, None
+
+    if written:
+        os.remove(output) # Don't leave behind a partial binary
+    return {}, None, error
+
+def collect(inputs : list[str]) -> list[tuple[str, str]]:
+    """
+    Expand the inputs into the sources to assemble and the paths of their binaries relative to the output directory.
+    """
+    sources = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".vS"):
+                        source = os.path.join(directory, name)
+                        sources.append((source, os.path.relpath(source, path)))
+        else:
+            sources.append((path, os.path.basename(path)))
+
+    return [(source, os.path.splitext(relative)[0] + ".vBin") for source, relative in sources]
+
+def batch(args) -> int:
+    """
+    Assemble many sources in parallel into the output directory.
+    """
+    outdir = args.output if args.output is not None else os.curdir
+    manifestpath = os.path.join(outdir, MANIFEST)
+    os.makedirs(outdir, exist_ok=True)
+
+    try:
+        with open(manifestpath, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("jump") != args.jump: # Everything has to be assembled again with a different jump translation
+            manifest = {}
+    except (OSError, ValueError):
+        manifest = {}
+    entries : dict[str, dict] = manifest.get("entries", {})
+
+    # Find which sources changed since the last batch
+    digests : dict[str, str | None] = {} # Digest of every source and included file, by path. Files included by many sources are only hashed once.
+    def cached(path : str) -> str | None:
+        if path not in digests:
+            try:
+                digests[path] = digest(path)
+            except OSError:
+                digests[path] = None
+        return digests[path]
+
+    pending = []
+    skipped = 0
+    for source, relative in collect(args.input):
+        output = os.path.join(outdir, relative)
+        entry = entries.get(relative)
+        if (not args.force and entry is not None and entry["source"] == cached(source) and os.path.exists(output)
+            and all(cached(path) == known for path, known in entry["deps"].items())):
+            report(args.verbosity, 2, f"Skipped {source} (unchanged)")
+            skipped += 1
+            continue
+        pending.append((source, relative, output))
+
+    failed = 0
+    total = dict.fromkeys(PHASES, 0.0)
+    start = time.perf_counter()
+    if pending:
+        with futures.ProcessPoolExecutor(args.jobs, initializer=_init_worker,
+                                         initargs=(args.jump, args.include, args.cache, args.verbosity >= 3)) as executor:
+            jobs = {executor.submit(_assemble, source, output): (source, relative, output) for source, relative, output in pending}
+            for done, job in enumerate(futures.as_completed(jobs), 1):
+                source, relative, output = jobs[job]
+                deps, steps, error = job.result()
+                if error is not None:
+                    report(args.verbosity, 1, error)
+                    entries.pop(relative, None)
+                    failed += 1
+                    continue
+
+                entries[relative] = {"source": cached(source), "deps": deps}
+                report(args.verbosity, 2, f"[{done}/{len(pending)}] Assembled {source} -> {output}")
+                if steps is not None:
+                    report(args.verbosity, 3, f"    {timings(steps)}")
+                    for phase in PHASES:
+                        total[phase] += steps[phase]
+
+    # Write the manifest atomically, so an interrupted batch never leaves it corrupt
+    with open(manifestpath + ".tmp", "w") as f:
+        json.dump({"jump": args.jump, "entries": entries}, f)
+    os.replace(manifestpath + ".tmp", manifestpath)
+
+    report(args.verbosity, 2, f"Assembled {len(pending) - failed}, skipped {skipped}, failed {failed} in {time.perf_counter() - start:.3f}s")
+    report(args.verbosity, 3, f"Total: {timings(total)}")
+
+    return 1 if failed else 0
+
+def single(args) -> int:
+    """
+    Assemble a single source into a single binary.
+    """
+    source, output = args.input[0], args.output if args.output is not None else "a.vBin"
+
+    # The source is streamed line by line into the output, so sources of any size are assembled in constant memory.
+    try:
+        infile = sys.stdin if source == "-" else open(source, "r")
+        sink = sys.stdout.buffer if output == "-" else open(output, "wb")
+    except OSError as e:
+        report(args.verbosity, 1, str(e))
+        return 2
+
+    with infile, sink:
+        cache = vqsx.FragmentCache(args.cache) if args.cache is not None else None
+        asm = vqsx.Assembler(args.jump, sink, args.include, cache, profile=args.verbosity >= 3)
+        try:
+            asm.assemble(infile)
+            error = None
+        except vqsx.VQsXAssemblerException as e:
+            error = f"{source}:{getattr(e, 'line', '?')}: {e}"
+        except ValueError as e: # Sources that aren't valid UTF-8
+            error = f"{source}: {e}"
+
+    if error is not None:
+        report(args.verbosity, 1, error)
+        if output != "-":
+            os.remove(output) # Don't leave behind a partial binary, like in batch mode
+        return 1
+
+    report(args.verbosity, 2, f"Assembled {source} -> {output}")
+    if asm.timings is not None:
+        report(args.verbosity, 3, f"    {timings(asm.timings)}")
+    return 0
+
+def main(args) -> int:
+    if len(args.input) == 1 and not os.path.isdir(args.input[0]):
+        return single(args)
+    if "-" in args.input:
+        report(args.verbosity, 1, "Standard input can't be assembled in batch mode!")
+        return 2
 
-args = parser.parse_args(sys.argv[1:])
+    try:
+        return batch(args)
+    except OSError as e:
+        report(args.verbosity, 1, str(e))
+        return 2
 
-with open(args.input, "r") as f:
-    asm.assemble(f)
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
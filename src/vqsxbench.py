@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+The VQsX rendering benchmark.
+
+This benchmark renders many copies of binaries with the thread pool of vqsx.render, for every number of threads up to the number of CPUs, and reports how the throughput scales.
+Optionally, a pool of processes renders the same binaries for comparison, which pays for pickling the bytecode and the segments.
+Threads only scale on free-threaded builds of CPython.
+"""
+
+import vqsx
+import vqsx.render
+import argparse, sys, os, time
+import concurrent.futures as futures
+
+parser = argparse.ArgumentParser("vqsxbench",
+                                 description="Benchmark rendering many VQsX binaries at once.")
+
+parser.add_argument("-n", "--copies",
+                    dest="copies",
+                    help="How many times each binary is rendered per run.",
+                    type=int,
+                    default=64)
+
+parser.add_argument("-j", "--jobs",
+                    dest="jobs",
+                    help="The most threads to benchmark with. Defaults to the number of CPUs.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("--processes",
+                    dest="processes",
+                    help="Also benchmark a pool of processes with the most threads.",
+                    action="store_true")
+
+parser.add_argument("input",
+                    help="Input VQsX binaries. Without any, a generated drawing is used.",
+                    type=str,
+                    nargs="*")
+
+def generated() -> bytes:
+    """
+    Generate a drawing of a few thousand instructions.
+    """
+    with vqsx.Builder() as b:
+        for i in range(500):
+            b.position(i % 50 * 10 - 250, i // 50 * 10 - 50)
+            b.color(vqsx.Colors(i % len(vqsx.Colors)))
+            for side in range(4):
+                b.drawforward(8)
+                b.rotatedeg(90.0)
+        return b.dump()
+
+def _evaluate(bytecode : bytes) -> int:
+    return len(vqsx.GeometryEvaluator(bytecode).evaluate().pack())
+
+def main(args) -> int:
+    try:
+        binaries = []
+        for path in args.input:
+            with open(path, "rb") as f:
+                binaries.append(f.read())
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 2
+    programs = (binaries or [generated()]) * args.copies
+
+    jobs = args.jobs or os.cpu_count() or 1
+    print(f"{len(programs)} programs, {sum(map(len, programs))} bytes, free-threaded: {vqsx.render.free_threaded()}")
+    print(f"{'threads':>8} {'seconds':>10} {'programs/s':>12} {'speedup':>8}")
+
+    baseline = None
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        vqsx.render.render(programs, workers=workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>10.3f} {len(programs) / elapsed:>12.1f} {baseline / elapsed:>7.2f}x")
+        if workers >= jobs:
+            break
+        workers = min(workers * 2, jobs)
+
+    if args.processes:
+        start = time.perf_counter()
+        with futures.ProcessPoolExecutor(jobs) as executor:
+            list(executor.map(_evaluate, programs))
+        elapsed = time.perf_counter() - start
+        print(f"{'procs ' + str(jobs):>8} {elapsed:>10.3f} {len(programs) / elapsed:>12.1f} {baseline / elapsed:>7.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
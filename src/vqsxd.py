@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+The VQsX render daemon.
+
+This daemon keeps a pool of warm worker processes around and renders VQsX binaries (.vBin) and VQsXi images (.vxi) sent to it over HTTP, on localhost or a Unix socket, so clients don't pay for starting Python and importing vqsx on every render.
+
+POST a binary or image to /render to get it back rendered. The query string may set the format (png, pbm, svg or seg), the size of the drawing area of binaries as WIDTHxHEIGHT, and the nullmode.
+Images in WB graphics are rendered in 1-bit, like PBMs always are.
+Identical requests that arrive while the first of them is still rendering are answered by that single render. Once too many renders are pending, new ones are turned away with 503 until the queue drains.
+Drawing areas larger than --max-pixels are refused. If a worker dies anyway, the pool is replaced so later requests are served again.
+GET /status for counters, as JSON.
+"""
+
+import vqsx
+import argparse, sys, os, hashlib, json, threading, socketserver, signal, urllib.parse
+import http.server
+import concurrent.futures as futures
+
+parser = argparse.ArgumentParser("vqsxd",
+                                 description="Serve VQsX renders from a pool of warm worker processes.")
+
+parser.add_argument("-H", "--host",
+                    dest="host",
+                    help="The address to listen on. Defaults to localhost only.",
+                    type=str,
+                    default="127.0.0.1")
+
+parser.add_argument("-p", "--port",
+                    dest="port",
+                    help="The port to listen on.",
+                    type=int,
+                    default=8095)
+
+parser.add_argument("-u", "--unix",
+                    dest="unix",
+                    help="Listen on a Unix socket at this path instead of on a port.",
+                    type=str,
+                    default=None)
+
+parser.add_argument("-j", "--jobs",
+                    dest="jobs",
+                    help="How many worker processes to render with. Defaults to the number of CPUs.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-q", "--queue",
+                    dest="queue",
+                    help="The most distinct renders pending at once, beyond which requests are turned away. Defaults to four per worker.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-s", "--size",
+                    dest="size",
+                    help="The default size of the drawing area of binaries, as WIDTHxHEIGHT.",
+                    type=str,
+                    default="640x480")
+
+parser.add_argument("-l", "--limit",
+                    dest="limit",
+                    help="The most instructions a render may run, so programs that never halt can't tie up a worker.",
+                    type=int,
+                    default=10_000_000)
+
+parser.add_argument("-a", "--max-pixels",
+                    dest="maxpixels",
+                    help="The largest drawing area a render may have, in pixels, so no request can make a worker run out of memory.",
+                    type=int,
+                    default=4096 * 4096)
+
+parser.add_argument("-m", "--max-bytes",
+                    dest="maxbytes",
+                    help="The largest payload accepted, in bytes.",
+                    type=int,
+                    default=16 * 1024 * 1024)
+
+CONTENT_TYPES : dict[str, str] = {
+    "png": "image/png",
+    "pbm": "image/x-portable-bitmap",
+    "svg": "image/svg+xml",
+    "seg": "text/plain; charset=utf-8",
+}
+
+class Busy(Exception):
+    """
+    Raised when the render queue is full.
+    """
+
+# Warm state of each worker process, framebuffers by size are reused between renders
+_rasters : dict[tuple[int, int, bool], vqsx.Raster | vqsx.MonoRaster] = {}
+
+def _warm(worker : int) -> int:
+    return os.getpid()
+
+def _render(payload : bytes, fmt : str, width : int, height : int, nullmode : vqsx.NullOpBehavior, limit : int | None, maxpixels : int) -> tuple[bytes | None, int, int, str | None]:
+    """
+    Render a payload in a worker into the output, the instructions and segments it took, and the error if it failed.
+
+    Errors are returned rather than raised, as not every VQsX exception survives being pickled.
+    """
+    try:
+        colordepth = None
+        if payload[:len(vqsx.VQSXI_MAGIC)] == bytes(vqsx.VQSXI_MAGIC):
+            bytecode, width, height, colordepth = vqsx.unwrap_vqsxi(payload)
+            if width * height > maxpixels: # Images bring their own size, which the handler can't check
+                raise ValueError(f"A {width}x{height} image is larger than the {maxpixels} pixels allowed!")
+        else:
+            bytecode = payload
+        evaluator = vqsx.GeometryEvaluator(bytecode, width, height, nullmode, limit=limit)
+        geometry = evaluator.evaluate()
+
+        mono = colordepth == 0 or fmt == "pbm"
+        raster = _rasters.get((width, height, mono))
+        if raster is None and fmt in ("png", "pbm"):
+            raster = _rasters[(width, height, mono)] = (vqsx.MonoRaster if mono else vqsx.Raster)(width, height)
+        return vqsx.raster.encode(geometry, width, height, fmt, raster, mono), evaluator.steps, len(geometry), None
+    except (vqsx.VQsXException, ValueError) as e:
+        return None, 0, 0, f"{type(e).__name__}: {e}"
+
+class Renderer(object):
+    """
+    The pool of warm workers, along with the renders pending on it.
+
+    Renders are keyed by a hash of the payload and the options. A request for a render that is already pending waits for that render instead of queueing another one.
+    """
+
+    def __init__(self, workers : int, queue : int, limit : int | None, maxpixels : int):
+        self.workers : int = workers
+        self.queue : int = queue
+        self.limit : int | None = limit
+        self.maxpixels : int = maxpixels
+        self.executor : futures.ProcessPoolExecutor = futures.ProcessPoolExecutor(workers)
+
+        self.__lock : threading.Lock = threading.Lock()
+        self.__pending : dict[bytes, futures.Future] = {}
+        self.counters : dict[str, int] = dict.fromkeys(("requests", "renders", "coalesced", "rejected", "failures", "restarts"), 0)
+
+    def warm(self):
+        """
+        Start every worker and have it import vqsx before the first request comes in.
+        """
+        list(self.executor.map(_warm, range(self.workers)))
+
+    def __count(self, counter : str):
+        with self.__lock:
+            self.counters[counter] += 1
+
+    def __replace(self, broken : futures.ProcessPoolExecutor):
+        """
+        Replace the pool once a worker died and broke it, as a broken pool never recovers. The lock must be held.
+        """
+        if self.executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = futures.ProcessPoolExecutor(self.workers)
+            self.counters["restarts"] += 1
+
+    def __done(self, key : bytes, executor : futures.ProcessPoolExecutor, future : futures.Future):
+        with self.__lock:
+            if self.__pending.get(key) is future:
+                del self.__pending[key]
+            if not future.cancelled() and isinstance(future.exception(), futures.process.BrokenProcessPool):
+                self.__replace(executor)
+
+    def submit(self, payload : bytes, fmt : str, width : int, height : int, nullmode : vqsx.NullOpBehavior) -> tuple[futures.Future, bool]:
+        """
+        Queue a render, or join the identical render already pending. Returns the future of the render and whether it was joined.
+
+        Raises Busy if the queue is full.
+        """
+        digest = hashlib.sha256(payload)
+        digest.update(f"\0{fmt}\0{width}x{height}\0{nullmode.name}".encode())
+        key = digest.digest()
+
+        with self.__lock:
+            self.counters["requests"] += 1
+            future = self.__pending.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return future, True
+            if len(self.__pending) >= self.queue:
+                self.counters["rejected"] += 1
+                raise Busy()
+            executor = self.executor
+            try:
+                future = executor.submit(_render, payload, fmt, width, height, nullmode, self.limit, self.maxpixels)
+            except futures.process.BrokenProcessPool:
+                self.__replace(executor)
+                executor = self.executor
+                future = executor.submit(_render, payload, fmt, width, height, nullmode, self.limit, self.maxpixels)
+            self.__pending[key] = future
+            self.counters["renders"] += 1
+        future.add_done_callback(lambda future: self.__done(key, executor, future))
+        return future, False
+
+    def status(self) -> dict:
+        with self.__lock:
+            return {**self.counters, "pending": len(self.__pending), "queue": self.queue, "workers": self.workers}
+
+    def failed(self):
+        self.__count("failures")
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Handler of the HTTP requests to the daemon.
+    """
+    server_version = "vqsxd"
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def reply(self, code : int, body : bytes, content_type : str = "text/plain; charset=utf-8", headers : dict[str, str] = {}):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/status":
+            return self.reply(404, b"Not found!\n")
+        self.reply(200, json.dumps(self.server.renderer.status()).encode() + b"\n", "application/json")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/render":
+            return self.reply(404, b"Not found!\n")
+
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self.reply(411, b"Content-Length is required!\n")
+        if length < 0:
+            self.close_connection = True
+            return self.reply(400, b"Content-Length can't be negative!\n")
+        if length > self.server.maxbytes:
+            self.close_connection = True
+            return self.reply(413, f"Payloads are limited to {self.server.maxbytes} bytes!\n".encode())
+        payload = self.rfile.read(length)
+
+        try:
+            fmt = query.get("format", "png")
+            if fmt not in CONTENT_TYPES:
+                raise ValueError(f"Unknown format {fmt}!")
+            width, height = (int(value) for value in query.get("size", self.server.size).lower().split("x"))
+            if width <= 0 or height <= 0 or width * height > self.server.renderer.maxpixels:
+                raise ValueError(f"Sizes must be positive and at most {self.server.renderer.maxpixels} pixels!")
+            nullmode = vqsx.NullOpBehavior[query.get("nullmode", "fault").upper()]
+        except (ValueError, KeyError) as e:
+            return self.reply(400, f"Invalid options: {e}\n".encode())
+
+        try:
+            future, coalesced = self.server.renderer.submit(payload, fmt, width, height, nullmode)
+        except Busy:
+            return self.reply(503, b"Too many pending renders, try again later!\n", headers={"Retry-After": "1"})
+
+        try:
+            output, steps, segments, error = future.result()
+        except futures.process.BrokenProcessPool:
+            self.server.renderer.failed()
+            return self.reply(500, b"The worker died while rendering!\n")
+        except Exception as e: # Such as running out of memory in the worker
+            self.server.renderer.failed()
+            return self.reply(500, f"Rendering failed: {type(e).__name__}\n".encode())
+        if error is not None:
+            self.server.renderer.failed()
+            return self.reply(422, f"{error}\n".encode())
+        self.reply(200, output, CONTENT_TYPES[fmt], {"X-VQsX-Steps": str(steps),
+                                                    "X-VQsX-Segments": str(segments),
+                                                    "X-VQsX-Coalesced": str(int(coalesced))})
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt() # Shut down like on Ctrl+C
+
+def main(args) -> int:
+    try:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+    except ValueError:
+        print(f"Invalid size {args.size}, expected WIDTHxHEIGHT!", file=sys.stderr)
+        return 2
+
+    workers = max(1, args.jobs or os.cpu_count() or 1)
+    if width * height > args.maxpixels:
+        print(f"The size {args.size} is larger than the {args.maxpixels} pixels allowed!", file=sys.stderr)
+        return 2
+
+    renderer = Renderer(workers, args.queue or workers * 4, args.limit, args.maxpixels)
+    renderer.warm()
+
+    try:
+        if args.unix is not None:
+            if os.path.exists(args.unix):
+                os.unlink(args.unix) # Left behind by a daemon that didn't shut down cleanly
+            server = UnixServer(args.unix, Handler)
+            where = args.unix
+        else:
+            server = TCPServer((args.host, args.port), Handler)
+            where = f"http://{args.host}:{server.server_address[1]}"
+    except OSError as e:
+        print(e, file=sys.stderr)
+        renderer.shutdown()
+        return 2
+
+    server.renderer, server.size, server.maxbytes = renderer, f"{width}x{height}", args.maxbytes
+    print(f"Serving renders on {where} with {workers} workers", file=sys.stderr)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        renderer.shutdown()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.unlink(args.unix)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
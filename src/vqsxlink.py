@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+The VQsX Linker CLI.
+
+This linker uses the VQsX linker API to combine several binaries into a single one that runs them one after another.
+Byte-identical subroutines are folded into a single copy, and the result can be wrapped into a VQsXi image.
+"""
+
+import vqsx
+import argparse, sys
+
+parser = argparse.ArgumentParser("vqsxlink",
+                                 description="The VQsX Linker.")
+
+parser.add_argument("-o", "--output",
+                    dest="output",
+                    help="Where to output the linked binary. Pass '-' to output to stdout.",
+                    type=str,
+                    default="a.vBin")
+
+parser.add_argument("-n", "--null",
+                    dest="null",
+                    help="How the VM that runs the binary treats the NULL opcode.",
+                    choices=[mode.name.lower() for mode in vqsx.NullOpBehavior],
+                    default=vqsx.NullOpBehavior.FAULT.name.lower())
+
+parser.add_argument("--initialize",
+                    dest="initialize",
+                    help="Reset the pen state and center it before each binary after the first.",
+                    action="store_true")
+
+parser.add_argument("--no-fold",
+                    dest="fold",
+                    help="Don't fold byte-identical subroutines into a single copy.",
+                    action="store_false")
+
+parser.add_argument("--vxi",
+                    dest="vxi",
+                    help="Wrap the linked binary into a VQsXi image of the given dimensions, like 640x480.",
+                    type=str,
+                    default=None)
+
+parser.add_argument("--wb",
+                    dest="wb",
+                    help="Make the VQsXi image use WB graphics instead of indexed-color graphics.",
+                    action="store_true")
+
+parser.add_argument("-V", "--verbosity",
+                    dest="verbosity",
+                    help="The verbosity of the linker. 0 is silent, 1 shows errors and 2 shows the size of the linked binary.",
+                    type=int,
+                    choices=range(3),
+                    default=1)
+
+parser.add_argument("input",
+                    help="Input VQsX binaries, linked in the given order.",
+                    type=str,
+                    nargs="+")
+
+def dimensions(value : str) -> tuple[int, int]:
+    """
+    Parse dimensions given as WIDTHxHEIGHT.
+    """
+    width, sep, height = value.lower().partition("x")
+    if not sep or not width.isdigit() or not height.isdigit():
+        raise ValueError(f"Invalid dimensions '{value}', expected WIDTHxHEIGHT!")
+    return int(width), int(height)
+
+def main(args) -> int:
+    try:
+        size = dimensions(args.vxi) if args.vxi is not None else None
+    except ValueError as e:
+        if args.verbosity >= 1: print(e, file=sys.stderr)
+        return 2
+
+    objects = []
+    try:
+        for path in args.input:
+            with open(path, "rb") as f:
+                objects.append(f.read())
+    except OSError as e:
+        if args.verbosity >= 1: print(e, file=sys.stderr)
+        return 2
+
+    try:
+        linked = vqsx.link(objects, vqsx.NullOpBehavior[args.null.upper()], args.initialize, args.fold)
+    except vqsx.VQsXOptimizerException as e:
+        if args.verbosity >= 1:
+            print(e, file=sys.stderr)
+            for issue in e.issues:
+                print(f"    0x{issue.address:08X}: {issue.message}", file=sys.stderr)
+        return 1
+
+    output = linked if size is None else vqsx.wrap_vqsxi(linked, *size, not args.wb)
+    try:
+        if args.output == "-":
+            sys.stdout.buffer.write(output)
+        else:
+            with open(args.output, "wb") as f:
+                f.write(output)
+    except OSError as e:
+        if args.verbosity >= 1: print(e, file=sys.stderr)
+        return 2
+
+    if args.verbosity >= 2:
+        print(f"Linked {len(objects)} binaries ({sum(map(len, objects))} bytes) -> {len(linked)} bytes", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+The VQsX Optimizer CLI.
+
+This optimizer uses the VQsX optimizer API to rewrite a binary into a smaller one that draws the same.
+Optionally, repeated runs of instructions are outlined into subroutines.
+"""
+
+import vqsx
+import argparse, sys
+
+parser = argparse.ArgumentParser("vqsxopt",
+                                 description="The VQsX Optimizer.")
+
+parser.add_argument("-o", "--output",
+                    dest="output",
+                    help="Where to output the optimized binary. Pass '-' to output to stdout.",
+                    type=str,
+                    default="a.vBin")
+
+parser.add_argument("-n", "--null",
+                    dest="null",
+                    help="How the VM that runs the binary treats the NULL opcode.",
+                    choices=[mode.name.lower() for mode in vqsx.NullOpBehavior],
+                    default=vqsx.NullOpBehavior.FAULT.name.lower())
+
+parser.add_argument("--outline",
+                    dest="outline",
+                    help="Also outline repeated runs of instructions into subroutines.",
+                    action="store_true")
+
+parser.add_argument("-V", "--verbosity",
+                    dest="verbosity",
+                    help="The verbosity of the optimizer. 0 is silent, 1 shows errors and 2 shows how much smaller the binary got.",
+                    type=int,
+                    choices=range(3),
+                    default=1)
+
+parser.add_argument("input",
+                    help="Input VQsX binary. Pass '-' to read from stdin.",
+                    type=str)
+
+def main(args) -> int:
+    try:
+        if args.input == "-":
+            bytecode = sys.stdin.buffer.read()
+        else:
+            with open(args.input, "rb") as f:
+                bytecode = f.read()
+    except OSError as e:
+        if args.verbosity >= 1: print(e, file=sys.stderr)
+        return 2
+
+    try:
+        nullmode = vqsx.NullOpBehavior[args.null.upper()]
+        optimized = vqsx.peephole(bytecode, nullmode)
+        if args.outline:
+            optimized = vqsx.outline(optimized, nullmode)
+    except vqsx.VQsXOptimizerException as e:
+        if args.verbosity >= 1:
+            print(f"{args.input}: {e}", file=sys.stderr)
+            for issue in e.issues:
+                print(f"    0x{issue.address:08X}: {issue.message}", file=sys.stderr)
+        return 1
+
+    try:
+        if args.output == "-":
+            sys.stdout.buffer.write(optimized)
+        else:
+            with open(args.output, "wb") as f:
+                f.write(optimized)
+    except OSError as e:
+        if args.verbosity >= 1: print(e, file=sys.stderr)
+        return 2
+
+    if args.verbosity >= 2:
+        print(f"{args.input}: {len(bytecode)} -> {len(optimized)} bytes", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
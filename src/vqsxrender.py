@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+The VQsX batch renderer.
+
+This renderer renders whole directories of VQsX binaries (.vBin) and VQsXi images (.vxi) to PNG, PBM, SVG or segment listings, without any GUI.
+Images in WB graphics are drawn on 1-bit framebuffers, and their PNGs are 1-bit too.
+The files are rendered on a pool of processes that is started once and kept warm for the whole batch, and handed out in chunks to keep the overhead per file low.
+Each worker writes its own output, so only the paths and a few counters travel between processes.
+With --tiles, files are rendered one at a time instead, with every worker drawing a band of the same canvas in shared memory, for drawings too large to render in a single process.
+"""
+
+import vqsx
+import vqsx.shared
+import argparse, sys, os, glob, time
+import concurrent.futures as futures
+import typing
+
+EXTENSIONS = (".vbin", ".vxi")
+
+parser = argparse.ArgumentParser("vqsxrender",
+                                 description="Render many VQsX binaries and images at once.")
+
+parser.add_argument("-o", "--output",
+                    dest="output",
+                    help="The directory to write the renders into. Defaults to next to each input.",
+                    type=str,
+                    default=None)
+
+parser.add_argument("-f", "--format",
+                    dest="format",
+                    help="The format to render to, PNG, PBM, SVG, or a listing of the segments.",
+                    choices=vqsx.raster.FORMATS,
+                    default="png")
+
+parser.add_argument("-s", "--size",
+                    dest="size",
+                    help="The size of the drawing area of binaries, as WIDTHxHEIGHT. Images bring their own.",
+                    type=str,
+                    default="640x480")
+
+parser.add_argument("-n", "--nullmode",
+                    dest="nullmode",
+                    help="What NULL does, fault, noop or halt.",
+                    choices=[mode.name.lower() for mode in vqsx.NullOpBehavior],
+                    default="fault")
+
+parser.add_argument("-l", "--limit",
+                    dest="limit",
+                    help="The most instructions a file may run before it fails, so files that never halt can't stall the batch.",
+                    type=int,
+                    default=10_000_000)
+
+parser.add_argument("-j", "--jobs",
+                    dest="jobs",
+                    help="How many processes to render with. Defaults to the number of CPUs.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-c", "--chunksize",
+                    dest="chunksize",
+                    help="How many files are handed to a process at once. Defaults to spreading the batch over four chunks per process.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-t", "--tiles",
+                    dest="tiles",
+                    help="Render PNGs or PBMs one at a time, split into this many tiles drawn at once on a shared canvas.",
+                    type=int,
+                    default=None)
+
+parser.add_argument("-m", "--manifest",
+                    dest="manifest",
+                    help="A file listing more inputs, one per line.",
+                    type=str,
+                    default=None)
+
+parser.add_argument("input",
+                    help="Input files, directories or glob patterns. Directories are searched for .vBin and .vxi files.",
+                    type=str,
+                    nargs="*")
+
+class Job(typing.NamedTuple):
+    """
+    Class for representing a single file to render.
+    """
+    source : str
+    destination : str
+
+class Result(typing.NamedTuple):
+    """
+    Class for representing the outcome of rendering a single file.
+    """
+    source : str
+    steps : int # Instructions evaluated
+    segments : int
+    error : str | None
+
+# Settings of the worker process, set once by _init_worker
+_settings : dict = {}
+_rasters : dict[tuple[int, int, bool], vqsx.Raster | vqsx.MonoRaster] = {} # Framebuffers by size and whether they are 1-bit, reused between files
+
+def _init_worker(fmt : str, width : int, height : int, nullmode : vqsx.NullOpBehavior, limit : int | None):
+    _settings.update(format=fmt, width=width, height=height, nullmode=nullmode, limit=limit)
+
+def _read(path : str) -> tuple[bytes, int, int, int | None]:
+    """
+    Read a file into its bytecode, the size of its drawing area and its color depth, if it is an image.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(vqsx.VQSXI_MAGIC)] == bytes(vqsx.VQSXI_MAGIC):
+        return vqsx.unwrap_vqsxi(data)
+    return data, _settings["width"], _settings["height"], None
+
+def _render(job : Job) -> Result:
+    """
+    Render a single file in a worker, failures are reported rather than raised so they don't take down the batch.
+    """
+    try:
+        bytecode, width, height, colordepth = _read(job.source)
+        evaluator = vqsx.GeometryEvaluator(bytecode, width, height, _settings["nullmode"], limit=_settings["limit"])
+        geometry = evaluator.evaluate()
+
+        fmt = _settings["format"]
+        mono = colordepth == 0 or fmt == "pbm"
+        raster = _rasters.get((width, height, mono))
+        if raster is None and fmt in ("png", "pbm"):
+            raster = _rasters[(width, height, mono)] = (vqsx.MonoRaster if mono else vqsx.Raster)(width, height)
+        output = vqsx.raster.encode(geometry, width, height, fmt, raster, mono)
+
+        with open(job.destination, "wb") as f:
+            f.write(output)
+        return Result(job.source, evaluator.steps, len(geometry), None)
+    except (vqsx.VQsXException, OSError, ValueError) as e:
+        return Result(job.source, 0, 0, f"{type(e).__name__}: {e}")
+
+def _render_tiled(job : Job, executor : futures.ProcessPoolExecutor, tiles : int) -> Result:
+    """
+    Render a single file split into tiles, which the workers draw straight into a shared canvas that this process saves.
+    """
+    try:
+        bytecode, width, height, colordepth = _read(job.source)
+        evaluator = vqsx.GeometryEvaluator(bytecode, width, height, _settings["nullmode"], limit=_settings["limit"])
+        geometry = evaluator.evaluate()
+        pbm = _settings["format"] == "pbm"
+        with vqsx.shared.render_tiles(geometry, width, height, tiles, executor=executor, mono=colordepth == 0 or pbm) as canvas, open(job.destination, "wb") as f:
+            f.write(canvas.raster.pbm() if pbm else canvas.raster.png())
+        return Result(job.source, evaluator.steps, len(geometry), None)
+    except (vqsx.VQsXException, OSError, ValueError) as e:
+        return Result(job.source, 0, 0, f"{type(e).__name__}: {e}")
+
+def collect(inputs : typing.Iterable[str]) -> list[str]:
+    """
+    Expand files, directories and glob patterns into a sorted list of files, without duplicates.
+    """
+    found : dict[str, None] = {}
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                for name in sorted(files):
+                    if name.lower().endswith(EXTENSIONS):
+                        found[os.path.join(root, name)] = None
+        elif glob.has_magic(entry):
+            for path in sorted(glob.glob(entry, recursive=True)):
+                if os.path.isfile(path):
+                    found[path] = None
+        else:
+            found[entry] = None
+    return list(found)
+
+def destination(source : str, output : str | None, fmt : str) -> str:
+    """
+    The path a render of a file is written to.
+    """
+    stem = os.path.splitext(source)[0]
+    if output is not None:
+        stem = os.path.join(output, os.path.basename(stem))
+    return f"{stem}.{fmt}"
+
+def main(args) -> int:
+    try:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+    except ValueError:
+        print(f"Invalid size {args.size}, expected WIDTHxHEIGHT!", file=sys.stderr)
+        return 2
+
+    inputs = list(args.input)
+    try:
+        if args.manifest is not None:
+            with open(args.manifest, "r") as f:
+                inputs.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    jobs = [Job(source, destination(source, args.output, args.format)) for source in collect(inputs)]
+    if not jobs:
+        print("Nothing to render!", file=sys.stderr)
+        return 2
+
+    if args.tiles is not None and args.format not in ("png", "pbm"):
+        print("Only PNGs and PBMs can be rendered in tiles!", file=sys.stderr)
+        return 2
+
+    workers = max(1, args.jobs or os.cpu_count() or 1)
+    if args.tiles is None:
+        workers = min(workers, len(jobs))
+    chunksize = args.chunksize or max(1, len(jobs) // (workers * 4))
+    nullmode = vqsx.NullOpBehavior[args.nullmode.upper()]
+    initargs = (args.format, width, height, nullmode, args.limit)
+
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+        if args.tiles is None:
+            results = list(executor.map(_render, jobs, chunksize=chunksize))
+        else:
+            _init_worker(*initargs)
+            results = [_render_tiled(job, executor, args.tiles) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    failures = [result for result in results if result.error is not None]
+    steps = sum(result.steps for result in results)
+    segments = sum(result.segments for result in results)
+    for result in failures:
+        print(f"{result.source}: {result.error}", file=sys.stderr)
+    print(f"{len(results) - len(failures)}/{len(results)} files, {segments} segments in {elapsed:.3f}s "
+          f"with {workers} processes: {len(results) / elapsed:.1f} files/s, {steps / elapsed:.0f} instructions/s, {len(failures)} failures")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+The VQsX startup budget check.
+
+This check imports vqsx and vqsx.vm in fresh interpreters, measures how long the imports take with -X importtime, and fails if they take longer than their budget or pull in modules that headless users shouldn't pay for, like turtle and Tk.
+It also checks the invariants of the enums of vqsx with enum.verify, on top of the cheaper checks vqsx does whenever it is imported. tests/test_startup.py runs the same checks under pytest.
+"""
+
+import argparse, sys, os, subprocess, json, enum
+
+parser = argparse.ArgumentParser("vqsxstartup",
+                                 description="Check that importing vqsx stays within its startup budget.")
+
+parser.add_argument("-b", "--budget",
+                    dest="budget",
+                    help="The most milliseconds each import may take.",
+                    type=float,
+                    default=60.0)
+
+parser.add_argument("-r", "--runs",
+                    dest="runs",
+                    help="How many times each import is measured, the fastest run counts.",
+                    type=int,
+                    default=5)
+
+parser.add_argument("-V", "--verbosity",
+                    dest="verbosity",
+                    help="The verbosity of the check. 0 only shows failures, 1 shows every import and 2 also shows the slowest modules.",
+                    type=int,
+                    choices=range(3),
+                    default=1)
+
+MODULES = ("vqsx", "vqsx.vm") # Imports that must stay cheap
+
+# Modules importing vqsx must not load, GUI toolkits and what only some of the submodules need
+FORBIDDEN = ("turtle", "tkinter", "_tkinter", "PIL", "numpy",
+             "concurrent.futures", "multiprocessing", "asyncio", "http.server",
+             "hashlib", "pickle", "tempfile")
+
+def measure(module : str) -> tuple[float, list[tuple[float, str]], list[str]]:
+    """
+    Import a module in a fresh interpreter. Returns the milliseconds the import took, the milliseconds spent in each module imported along with it, and the forbidden modules that got imported.
+    """
+    code = f"import {module}, sys, json; sys.stdout.write(json.dumps(sorted(m for m in {FORBIDDEN!r} if m in sys.modules)))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))) # Next to the vqsx package, like the other scripts
+
+    total = 0.0
+    modules : list[tuple[float, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            own, cumulative = int(fields[0]), int(fields[1])
+        except ValueError: # The header
+            continue
+        name = fields[2]
+        if name.strip().startswith("vqsx") and not name[1:].startswith(" "): # Top level, the indentation shows what imported what
+            total += cumulative / 1000
+        modules.append((own / 1000, name.strip()))
+    return total, sorted(modules, reverse=True), json.loads(result.stdout)
+
+def check_enums() -> list[str]:
+    """
+    Check the enums of vqsx the way enum.verify would. Returns the problems found.
+    """
+    import vqsx
+
+    problems = []
+    checks = ((vqsx.Colors, enum.CONTINUOUS), (vqsx.Instructions, enum.CONTINUOUS),
+              (vqsx.StatusFlags, enum.CONTINUOUS), (vqsx.StatusFlags, enum.NAMED_FLAGS),
+              (vqsx.NullOpBehavior, enum.CONTINUOUS))
+    for cls, check in checks:
+        try:
+            enum.verify(check)(cls)
+        except ValueError as e:
+            problems.append(f"{cls.__name__}: {e}")
+    return problems
+
+def main(args) -> int:
+    failures = 0
+    for module in MODULES:
+        try:
+            runs = [measure(module) for _ in range(max(args.runs, 1))]
+        except subprocess.CalledProcessError as e:
+            print(f"import {module} failed:", e.stderr.strip().splitlines()[-1])
+            failures += 1
+            continue
+        total, modules, forbidden = min(runs, key=lambda run: run[0])
+
+        over = total > args.budget
+        if args.verbosity >= 1 or over or forbidden:
+            print(f"import {module}: {total:.1f}ms of {args.budget:.1f}ms{' OVER BUDGET' if over else ''}")
+        if forbidden:
+            print(f"import {module} imported {', '.join(forbidden)}")
+        if args.verbosity >= 2:
+            for own, name in modules[:10]:
+                print(f"    {own:7.2f}ms {name}")
+        failures += over + bool(forbidden)
+
+    for problem in check_enums():
+        print(problem)
+        failures += 1
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args(sys.argv[1:])))
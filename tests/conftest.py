@@ -0,0 +1,4 @@
+import os, sys
+
+# The package isn't installed, it is imported straight from the source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
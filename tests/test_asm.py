@@ -0,0 +1,264 @@
+import vqsx
+import vqsxasm
+import os, sys, json, pickle, subprocess, pytest
+
+def write(path, *lines) -> str:
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return str(path)
+
+def assemble(path, include=(), cache=None) -> tuple[bytes, dict]:
+    with vqsx.Assembler(include=include, cache=cache) as asm, open(path, "r") as f:
+        asm.assemble(f)
+        return asm.dump(), dict(asm.deps)
+
+def listing(bytecode : bytes) -> list[str]:
+    return [line.strip() for line in vqsx.Disassembler(bytecode).listing()]
+
+@pytest.fixture
+def sources(tmp_path):
+    """
+    A main source including a file next to it, which includes one from an include directory in turn.
+    """
+    os.makedirs(tmp_path / "lib")
+    write(tmp_path / "lib" / "inner.vS", ":INNER:", "    DRAWFORWARD 3", "    RET")
+    write(tmp_path / "shape.vS", ".include <inner.vS>", ":SHAPE:", "    CALL INNER", "    ROTATEDEG 90.0", "    RET")
+    main = write(tmp_path / "main.vS", "    CALL SHAPE", "    HALT", ".include \"shape.vS\"")
+    return tmp_path, main
+
+def test_include_resolution(sources):
+    root, main = sources
+    bytecode, deps = assemble(main, include=[str(root / "lib")])
+    assert listing(bytecode) == ["CALLIPC 11", "HALT", "DRAWFORWARD 3", "RETURN", "CALLIPC -19", "ROTATEDEG 90.0", "RETURN"]
+    assert set(deps) == {os.path.realpath(root / "shape.vS"), os.path.realpath(root / "lib" / "inner.vS")}
+
+    with pytest.raises(vqsx.VQsXAssemblerSyntaxException, match="not found"):
+        assemble(main) # Without the include directory
+
+    write(root / "loop.vS", ".include <loop.vS>")
+    with pytest.raises(vqsx.VQsXAssemblerSyntaxException, match="includes itself"):
+        assemble(root / "loop.vS")
+
+def cached(root) -> list[str]:
+    return sorted(name for name in os.listdir(root / "cache") if name.endswith(".vfrag"))
+
+def test_cache_hits(sources):
+    root, main = sources
+    include = [str(root / "lib")]
+    expected, _ = assemble(main, include)
+
+    assert assemble(main, include, vqsx.FragmentCache(root / "cache"))[0] == expected
+    fragments = cached(root)
+    assert len(fragments) == 2
+
+    # A fresh cache reads the fragments back from disk. Tampering with one shows that it was used instead of the source.
+    path = max((root / "cache" / name for name in fragments), key=os.path.getsize) # The fragment of the file main includes
+    content = bytearray(path.read_bytes())
+    content[content.rindex(int(vqsx.Instructions.RETURN))] = int(vqsx.Instructions.HALT)
+    path.write_bytes(bytes(content))
+    tampered, _ = assemble(main, include, vqsx.FragmentCache(root / "cache"))
+    assert tampered != expected and len(tampered) == len(expected)
+
+def test_cache_invalidation(sources):
+    root, main = sources
+    include = [str(root / "lib")]
+    cache = vqsx.FragmentCache(root / "cache")
+    assemble(main, include, cache)
+
+    # Changing a file included by an included file invalidates both fragments
+    write(root / "lib" / "inner.vS", ":INNER:", "    DRAWFORWARD 4", "    RET")
+    bytecode, _ = assemble(main, include, vqsx.FragmentCache(root / "cache"))
+    assert "DRAWFORWARD 4" in listing(bytecode)
+    assert len(cached(root)) == 3 # A new fragment of the inner file, the one of the including file is replaced
+
+    # And the same for a long-lived cache, which keeps its fragments in memory
+    write(root / "lib" / "inner.vS", ":INNER:", "    DRAWFORWARD 5", "    RET")
+    os.utime(root / "lib" / "inner.vS", ns=(1, 1)) # Make sure the modification time differs
+    bytecode, _ = assemble(main, include, cache)
+    assert "DRAWFORWARD 5" in listing(bytecode)
+
+class _Exploit(object):
+    def __reduce__(self):
+        return (open, (_Exploit.path, "w"))
+
+def test_cache_never_unpickles(sources, tmp_path):
+    root, main = sources
+    include = [str(root / "lib")]
+    expected, _ = assemble(main, include, vqsx.FragmentCache(root / "cache"))
+
+    # Replace every cached fragment with a pickle that creates a file when loaded, and with garbage
+    _Exploit.path = str(tmp_path / "pwned")
+    for i, name in enumerate(cached(root)):
+        with open(root / "cache" / name, "wb") as f:
+            if i % 2:
+                f.write(b"VQsF\x02\x00\x00\x00\xff\xff\xff\xff{")
+            else:
+                pickle.dump(_Exploit(), f)
+
+    assert assemble(main, include, vqsx.FragmentCache(root / "cache"))[0] == expected
+    assert not os.path.exists(_Exploit.path)
+
+def test_builder_starts_after_initial_chunks():
+    prefix = vqsx.Builder().drawforward(5).rotatedeg(90.0).dump()
+    builder = vqsx.Builder(prefix)
+    assert builder.tell() == len(prefix)
+    assert builder.dump() == prefix
+
+    builder.drawforward(vqsx.Parameter("side", 1))
+    assert builder.dump() == prefix + vqsx.Builder().drawforward(1).dump()
+    assert builder.template().instantiate(side=9) == prefix + vqsx.Builder().drawforward(9).dump()
+
+    mark = builder.mark()
+    builder.drawforward(2)
+    builder.rollback(mark)
+    assert builder.dump() == prefix + vqsx.Builder().drawforward(1).dump()
+
+def test_template_substitution():
+    def build(side, turn, half, color) -> bytes:
+        return vqsx.Builder().drawforward(side).rotatedeg(turn).drawforward(half).color(color).drawforward(side).dump()
+
+    side = vqsx.Parameter("side", 10)
+    builder = (vqsx.Builder().drawforward(side).rotatedeg(vqsx.Parameter("turn", 90.0))
+               .drawforward(vqsx.Parameter("side", 10, lambda value: value // 2)).color(vqsx.Parameter("color", 1)).drawforward(side))
+    template = builder.template()
+    assert template.parameters == {"side", "turn", "color"}
+    assert len(template.patches["side"]) == 3
+    assert template.bytecode == builder.dump() == build(10, 90.0, 5, 1)
+
+    assert template.instantiate(side=20, turn=45.5, color=3) == build(20, 45.5, 10, 3)
+    assert template.instantiate(turn=30.0) == build(10, 30.0, 5, 1) # The others keep their defaults
+    assert template.bytecode == build(10, 90.0, 5, 1) # Instantiating works on a copy
+
+    buffer = template.instantiate(side=20)
+    template.patch(buffer, side=40)
+    assert buffer == build(40, 90.0, 20, 1)
+    with pytest.raises(vqsx.VQsXTemplateException):
+        template.instantiate(length=3)
+
+def test_nested_checkpoints():
+    builder = vqsx.Builder().drawforward(1)
+    outer = builder.mark()
+    builder.drawforward(vqsx.Parameter("a", 2))
+    kept = builder.dump()
+    inner = builder.mark()
+    builder.rotatedeg(vqsx.Parameter("b", 3.0)).drawforward(4)
+
+    builder.rollback() # The innermost one
+    assert builder.marks == [outer]
+    assert builder.tell() == len(kept)
+    assert builder.dump() == kept
+    assert builder.template().parameters == {"a"}
+    with pytest.raises(vqsx.VQsXBuilderException, match="not open"):
+        builder.rollback(inner)
+
+    # Emitting after a rollback writes where the discarded code started
+    builder.drawforward(vqsx.Parameter("c", 5))
+    assert builder.template().instantiate(a=6, c=7) == vqsx.Builder().drawforward(1).drawforward(6).drawforward(7).dump()
+
+    builder.mark()
+    builder.drawforward(8)
+    builder.rollback(outer) # Closes the inner mark along with it
+    assert builder.marks == []
+    assert builder.tell() == outer.length
+    assert builder.dump() == vqsx.Builder().drawforward(1).dump()
+    assert builder.template().parameters == frozenset()
+    with pytest.raises(vqsx.VQsXBuilderException):
+        builder.rollback()
+    with pytest.raises(vqsx.VQsXBuilderException):
+        builder.commit()
+
+def test_transactions():
+    builder = vqsx.Builder()
+    with builder.transaction():
+        builder.drawforward(1)
+        with pytest.raises(KeyError):
+            with builder.transaction():
+                builder.drawforward(vqsx.Parameter("a", 2))
+                raise KeyError()
+        with builder.transaction() as mark:
+            builder.drawforward(3)
+            builder.rollback(mark)
+        with builder.transaction():
+            builder.drawforward(4)
+    assert builder.marks == []
+    assert builder.dump() == vqsx.Builder().drawforward(1).drawforward(4).dump()
+    assert builder.template().parameters == frozenset()
+
+    with pytest.raises(KeyError):
+        with builder.transaction():
+            builder.drawforward(5)
+            raise KeyError()
+    assert builder.dump() == vqsx.Builder().drawforward(1).drawforward(4).dump()
+
+def run(*args) -> int:
+    return vqsxasm.main(vqsxasm.parser.parse_args(list(args)))
+
+@pytest.fixture
+def large(tmp_path) -> str:
+    """
+    A source larger than the assembler buffers, with a forward jump over nearly all of it.
+    """
+    lines = ["    JUMP END"] + ["    DRAWFORWARD 1", "    ROTATEDEG 1.5"] * (vqsx.Assembler.FLUSH_THRESHOLD // 8) + [":END:", "    HALT"]
+    return write(tmp_path / "large.vS", *lines)
+
+def test_cli_streams_to_a_file(large, tmp_path):
+    output = tmp_path / "large.vBin"
+    assert run(large, "-o", str(output)) == 0
+    assert output.stat().st_size > vqsx.Assembler.FLUSH_THRESHOLD
+    assert output.read_bytes() == assemble(large)[0]
+
+def test_cli_streams_to_stdout(large):
+    with open(large, "rb") as f:
+        process = subprocess.run([sys.executable, os.path.join(os.path.dirname(vqsxasm.__file__), "vqsxasm.py"), "-", "-o", "-"],
+                                 stdin=f, capture_output=True, timeout=60)
+    assert process.returncode == 0
+    assert process.stdout == assemble(large)[0]
+
+# Errors come after enough code that part of the binary was already written out
+BAD = [b"    DRAWFORWARD 1\n" * vqsx.Assembler.FLUSH_THRESHOLD + b"    BOGUS 2\n",
+       b"    DRAWFORWARD 1\n" * vqsx.Assembler.FLUSH_THRESHOLD + b"# \xff\xfe\n"]
+
+@pytest.mark.parametrize("content", BAD, ids=["syntax", "undecodable"])
+def test_cli_drops_failed_binaries(tmp_path, content, capsys):
+    (tmp_path / "bad.vS").write_bytes(content)
+    output = tmp_path / "bad.vBin"
+    assert run(str(tmp_path / "bad.vS"), "-o", str(output)) == 1
+    assert "bad.vS" in capsys.readouterr().err
+    assert not output.exists()
+
+def test_cli_batch(sources, tmp_path, capsys):
+    root, main = sources
+    os.makedirs(root / "more")
+    write(root / "more" / "square.vS", "    DRAWFORWARD 4", "    ROTATEDEG 90.0", "    HALT")
+    out = tmp_path / "out"
+    include = str(root / "lib")
+    assert run("-j", "2", "-V", "2", "-I", include, "-o", str(out), str(root)) == 0
+    expected = {"main.vBin": assemble(main, include=[include])[0],
+                "shape.vBin": assemble(root / "shape.vS", include=[include])[0],
+                os.path.join("lib", "inner.vBin"): assemble(root / "lib" / "inner.vS")[0],
+                os.path.join("more", "square.vBin"): assemble(root / "more" / "square.vS")[0]}
+    for relative, bytecode in expected.items():
+        assert (out / relative).read_bytes() == bytecode
+    assert capsys.readouterr().err.count("Assembled ") == 5 # Each source and the summary
+
+    assert run("-j", "2", "-V", "2", "-I", include, "-o", str(out), str(root)) == 0
+    assert "Assembled 0, skipped 4, failed 0" in capsys.readouterr().err
+
+    write(root / "lib" / "inner.vS", ":INNER:", "    DRAWFORWARD 6", "    RET")
+    assert run("-j", "2", "-V", "2", "-I", include, "-o", str(out), str(root)) == 0
+    assert "Assembled 3, skipped 1, failed 0" in capsys.readouterr().err # Everything including inner.vS, but square.vS
+    assert (out / "main.vBin").read_bytes() == assemble(main, include=[include])[0]
+
+@pytest.mark.parametrize("content", BAD, ids=["syntax", "undecodable"])
+def test_cli_batch_reports_bad_sources(tmp_path, content, capsys):
+    root, out = tmp_path / "src", tmp_path / "out"
+    os.makedirs(root)
+    good = write(root / "good.vS", "    DRAWFORWARD 4", "    HALT")
+    (root / "bad.vS").write_bytes(content)
+
+    assert run("-j", "2", "-o", str(out), str(root)) == 1
+    assert "bad.vS" in capsys.readouterr().err
+    assert (out / "good.vBin").read_bytes() == assemble(good)[0]
+    assert not (out / "bad.vBin").exists()
+    with open(out / vqsxasm.MANIFEST) as f:
+        assert list(json.load(f)["entries"]) == ["good.vBin"]
@@ -0,0 +1,11 @@
+import vqsx
+import vqsxstartup
+
+def test_enums_are_contiguous():
+    # The decoding and dispatch tables index by opcode, color and status
+    assert vqsxstartup.check_enums() == []
+
+def test_tables_cover_every_value():
+    assert len(vqsx.constants.INSTRUCTION_LENGTHS) == len(vqsx.Instructions)
+    assert len(vqsx.PALETTE) == 256 and len(vqsx.PALETTE_LUT) == 256 * vqsx.BRIGHTNESS_LEVELS * 3
+    assert all(vqsx.PALETTE[color] == vqsx.ColorMap[color] for color in vqsx.Colors)
@@ -0,0 +1,138 @@
+import vqsx
+import vqsxd
+import os, json, signal, threading, time, http.client
+import pytest
+
+from test_geometry import program
+
+@pytest.fixture
+def server():
+    """
+    A daemon with a single worker and room for two pending renders, serving on a free port.
+    """
+    renderer = vqsxd.Renderer(1, 2, 1_000_000, 64 * 64)
+    renderer.warm()
+    server = vqsxd.TCPServer(("127.0.0.1", 0), vqsxd.Handler)
+    server.renderer, server.size, server.maxbytes = renderer, "64x48", 1 << 16
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    renderer.shutdown()
+
+def post(server, payload : bytes, query : str = "", length : int | None = None) -> tuple[int, http.client.HTTPMessage, bytes]:
+    """
+    POST a payload to /render, returning the status, headers and body of the reply.
+    """
+    connection = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        connection.putrequest("POST", f"/render?{query}")
+        connection.putheader("Content-Length", str(len(payload) if length is None else length))
+        connection.endheaders(payload)
+        response = connection.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        connection.close()
+
+def status(server) -> dict:
+    connection = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        connection.request("GET", "/status")
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+def background(server, payload : bytes, query : str = "") -> tuple[threading.Thread, list]:
+    """
+    POST in a thread, the reply ends up in the list.
+    """
+    replies = []
+    thread = threading.Thread(target=lambda: replies.append(post(server, payload, query)))
+    thread.start()
+    return thread, replies
+
+def settle(server, pending : int):
+    """
+    Wait until the daemon has this many renders pending.
+    """
+    deadline = time.monotonic() + 10
+    while status(server)["pending"] != pending:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_render(server):
+    code, headers, body = post(server, program())
+    assert code == 200
+    assert headers["Content-Type"] == "image/png"
+    assert body == vqsx.raster.encode(vqsx.GeometryEvaluator(program(), 64, 48).evaluate(), 64, 48)
+
+    code, headers, body = post(server, vqsx.wrap_vqsxi(program(), 40, 30, indexed=False), "format=seg")
+    assert code == 200
+    assert body == vqsx.raster.segments(vqsx.GeometryEvaluator(program(), 40, 30).evaluate()).encode()
+
+def test_identical_requests_coalesce(server):
+    server.renderer.executor.submit(time.sleep, 1) # Keeps the only worker busy, so the renders stay pending
+    first, firsts = background(server, program())
+    settle(server, 1)
+    second, seconds = background(server, program())
+    first.join()
+    second.join()
+
+    assert firsts[0][2] == seconds[0][2]
+    assert {firsts[0][1]["X-VQsX-Coalesced"], seconds[0][1]["X-VQsX-Coalesced"]} == {"0", "1"}
+    counters = status(server)
+    assert (counters["requests"], counters["renders"], counters["coalesced"]) == (2, 1, 1)
+
+def test_full_queue_rejects(server):
+    server.renderer.executor.submit(time.sleep, 1)
+    threads = [background(server, program(), f"size={size}") for size in ("32x32", "48x48")]
+    settle(server, 2)
+
+    code, headers, _ = post(server, program(), "size=16x16")
+    assert code == 503
+    assert headers["Retry-After"] == "1"
+    joined = background(server, program(), "size=32x32") # Identical to a pending render, so it still gets in
+    for thread, replies in threads + [joined]:
+        thread.join()
+        assert replies[0][0] == 200
+    assert post(server, program(), "size=16x16")[0] == 200 # Once the queue drained
+    assert status(server)["rejected"] == 1
+
+def test_dead_worker_is_replaced(server):
+    pid = server.renderer.executor.submit(os.getpid).result()
+    server.renderer.executor.submit(time.sleep, 1)
+    thread, replies = background(server, program())
+    settle(server, 1)
+    os.kill(pid, signal.SIGKILL)
+    thread.join()
+
+    assert replies[0][0] == 500
+    assert b"died" in replies[0][2]
+    assert post(server, program())[0] == 200
+    counters = status(server)
+    assert (counters["failures"], counters["restarts"]) == (1, 1)
+
+def test_worker_exceptions_fail(server):
+    server.renderer.limit = "many" # Not a number, so the render raises TypeError in the worker, like a MemoryError would
+    code, _, body = post(server, program())
+    assert code == 500
+    assert body == b"Rendering failed: TypeError\n"
+    assert status(server)["failures"] == 1
+
+@pytest.mark.parametrize("query, length, expected", [("", -1, 400),
+                                                     ("", (1 << 16) + 1, 413),
+                                                     ("size=65x64", None, 400),
+                                                     ("size=0x10", None, 400),
+                                                     ("format=gif", None, 400),
+                                                     ("nullmode=never", None, 400)])
+def test_bad_requests(server, query, length, expected):
+    assert post(server, b"" if length is not None else program(), query, length)[0] == expected
+    assert status(server)["renders"] == 0
+
+def test_large_images_are_refused(server):
+    code, _, body = post(server, vqsx.wrap_vqsxi(program(), 65, 64))
+    assert code == 422
+    assert b"larger than" in body
+    assert status(server)["failures"] == 1
@@ -0,0 +1,71 @@
+import vqsx
+from vqsx.constants import OperandMapping
+import pytest
+
+# An operand for every struct fmt code, picked so every instruction is legal to emit
+_OPERANDS = {"b": -3, "q": 0x123456789, "d": 1.5}
+
+def every_opcode() -> bytes:
+    """
+    A binary holding every instruction once, in opcode order.
+    """
+    with vqsx.Builder() as b:
+        for inst in vqsx.Instructions:
+            b.instruction(inst, *(_OPERANDS[code] for code in OperandMapping[inst]))
+        return b.dump()
+
+def assemble(listing) -> bytes:
+    with vqsx.Assembler() as asm:
+        asm.assemble("\n".join(listing) + "\n")
+        return asm.dump()
+
+def test_every_opcode_is_present():
+    bytecode = every_opcode()
+    assert [record.inst for record in vqsx.Disassembler(bytecode).sweep()] == list(vqsx.Instructions)
+
+@pytest.mark.parametrize("jump", list(vqsx.JumpTranslation))
+def test_listing_round_trip(jump):
+    bytecode = every_opcode()
+    with vqsx.Assembler(jump) as asm:
+        asm.assemble("\n".join(vqsx.Disassembler(bytecode).listing()) + "\n")
+        assert asm.dump() == bytecode
+
+def test_graph_listing_round_trip():
+    # Jumps and calls to labels, including the absolute ones
+    with vqsx.Builder() as b:
+        b.forward(1)
+        b.instruction(vqsx.Instructions.CALL, 55)
+        b.instruction(vqsx.Instructions.JUMPIPC, 9)
+        b.instruction(vqsx.Instructions.JUMPMST, 46)
+        b.instruction(vqsx.Instructions.JUMP, 0)
+        b.halt()
+        b.instruction(vqsx.Instructions.CALLIPC, 1)
+        b.instruction(vqsx.Instructions.RETURN)
+        b.instruction(vqsx.Instructions.RETURN)
+        bytecode = b.dump()
+
+    disassembler = vqsx.Disassembler(bytecode)
+    listing = list(disassembler.analyze().listing(bytecode))
+    assert any(line.strip().startswith(("JUMPABS", "CALLABS")) for line in listing)
+    assert assemble(listing) == bytecode
+
+def test_decode_array_matches_sweep():
+    np = pytest.importorskip("numpy")
+
+    # Every opcode, an illegal one, and an instruction cut short by the end of the binary
+    bytecode = every_opcode() + bytes([0xFF]) + bytes([int(vqsx.Instructions.POSITION), 1, 2, 3])
+    disassembler = vqsx.Disassembler(bytecode)
+    records = list(disassembler.sweep())
+    assert records[-1].operands is None
+
+    decoded = disassembler.decode_array()
+    expected = [record for record in records if record.operands is not None] # decode_array() leaves out the truncated one
+    assert len(decoded) == len(expected)
+    for row, record in zip(decoded, expected):
+        assert (int(row["address"]), int(row["opcode"])) == (record.address, record.opcode)
+        fmt = OperandMapping[record.inst] if record.inst is not None else ""
+        integers = [operand for operand, code in zip(record.operands, fmt) if code != "d"]
+        floats = [operand for operand, code in zip(record.operands, fmt) if code == "d"]
+        assert [int(row["op1"]), int(row["op2"])][:len(integers)] == integers
+        assert float(row["fop"]) == (floats[0] if floats else 0.0)
+    assert np.array_equal(decoded["address"], np.array([record.address for record in expected], dtype=np.uint64))
@@ -0,0 +1,98 @@
+import vqsx
+import pytest
+
+def program() -> bytes:
+    """
+    A long straight-line start full of cut points, followed by a subroutine drawn a few times.
+    """
+    with vqsx.Builder() as b:
+        for i in range(200):
+            b.position(i % 20 * 30 - 300, i // 20 * 40 - 200)
+            b.color(vqsx.Colors(i % len(vqsx.Colors)))
+            b.brightness(i % 11)
+            b.rotatedeg(7.5 * i)
+            for _ in range(3):
+                b.drawforward(12)
+                b.rotaterdeg(100.0)
+        b.position(0, 0)
+        subroutine = b.tell() + 4 * 18 + 1 # After four calls and rotations, and the halt
+        for _ in range(4):
+            b.callipc(subroutine - (b.tell() + 9)) # Relative to the end of the call
+            b.rotatedeg(90.0)
+        b.halt()
+        b.drawforward(25)
+        b.drawbackwards(5)
+        b.ret()
+        return b.dump()
+
+def test_cut_points_are_found():
+    assert len(vqsx.cut_points(program(), 640, 480)) > 100
+
+def test_parallel_matches_serial():
+    bytecode = program()
+    serial = list(vqsx.GeometryEvaluator(bytecode, 640, 480).evaluate())
+    assert len(serial) > 600
+    for workers, chunks in ((2, None), (3, 17), (4, 200)):
+        assert list(vqsx.evaluate_parallel(bytecode, 640, 480, workers=workers, chunks=chunks)) == serial
+
+def nested() -> bytes:
+    """
+    Replayable subroutines called at different headings and scales, from a subroutine that can't be replayed itself.
+    """
+    with vqsx.Builder() as b:
+        b.callipc(0) # Patched below
+        b.scale(3)
+        b.rotatedeg(33.0)
+        b.callipc(0)
+        b.halt()
+
+        outer = b.tell()
+        for turn in (15.0, 40.0, 75.0):
+            b.rotatedeg(turn)
+            b.color(vqsx.Colors(int(turn) % 14)) # Keeps the outer subroutine from being replayed
+            b.callipc(0)
+            b.drawforward(4)
+        b.ret()
+
+        inner = b.tell()
+        for _ in range(20): # Enough segments to be replayed with NumPy, when it is installed
+            b.drawforward(6)
+            b.rotaterdeg(18.0)
+            b.forward(2)
+        b.ret()
+        bytecode = bytearray(b.dump())
+
+    # Point the first two calls at the outer subroutine and the rest at the inner one
+    calls = [record for record in vqsx.Disassembler(bytecode).sweep() if record.inst == vqsx.Instructions.CALLIPC]
+    for i, record in enumerate(calls):
+        target = outer if i < 2 else inner
+        bytecode[record.address + 1:record.address + 9] = (target - (record.address + 9)).to_bytes(8, "little", signed=True)
+    return bytes(bytecode)
+
+def test_memoized_matches_plain():
+    bytecode = nested()
+    memoized = vqsx.GeometryEvaluator(bytecode, 640, 480)
+    segments = list(memoized.evaluate())
+    plain = list(vqsx.GeometryEvaluator(bytecode, 640, 480, memoize=False).evaluate())
+
+    assert memoized.hits > 0 and memoized.misses == 2 # The inner subroutine, once per scale
+    assert len(segments) == len(plain) == 2 * 3 * 21
+    for segment, reference in zip(segments, plain):
+        assert segment[:4] == pytest.approx(reference[:4], abs=1e-9)
+        assert segment[4:] == reference[4:]
+
+def test_initial_heading_faces_the_rotational_origin():
+    with vqsx.Builder() as b:
+        b.drawforward(10)
+        b.rotateorigin()
+        b.drawforward(10)
+        b.rotatesetorigin(0)
+        b.rotateorigin()
+        b.drawforward(10)
+        b.instruction(vqsx.Instructions.INITIALIZE)
+        b.drawforward(10)
+        bytecode = b.dump()
+
+    directions = [(round(s.x2 - s.x1, 9), round(s.y2 - s.y1, 9)) for s in vqsx.GeometryEvaluator(bytecode).evaluate()]
+    assert directions == [(0, 10), (0, 10), (10, 0), (0, 10)]
+    assert vqsx.geometry.INITIAL_STATE.heading == 90.0
@@ -0,0 +1,72 @@
+import vqsx
+from vqsx.constants import Instructions
+from test_optimize import run, insts
+
+def subroutine_object(distance : int) -> bytes:
+    """
+    An object that calls the same leaf subroutine twice, which sits behind its HALT.
+    """
+    with vqsx.Builder() as b:
+        b.drawforward(distance)
+        b.callipc(19) # Over the second call and the halt
+        b.rotatedeg(45.0)
+        b.callipc(1) # Over the halt
+        b.halt()
+        b.drawforward(10)
+        b.rotatedeg(90.0)
+        b.drawforward(10)
+        b.ret()
+        return b.dump()
+
+def expected(*objects : bytes) -> list:
+    """
+    The events of running each object on its own, one after another, without their halts.
+    """
+    events = []
+    for bytecode in objects:
+        status, drawn = run(bytecode)
+        assert status == vqsx.STATUS_HALTED
+        events.extend(event for event in drawn if event[0] != "halt")
+    return events
+
+def check(linked : bytes, *objects : bytes):
+    status, drawn = run(linked)
+    assert status == vqsx.STATUS_HALTED
+    assert [event for event in drawn if event[0] != "halt"] == expected(*objects)
+
+def test_halts_continue_with_the_next_object():
+    first = vqsx.Builder().drawforward(5).halt().dump()
+    second = vqsx.Builder().drawforward(7).dump()
+    linked = vqsx.link([first, second])
+    assert insts(linked) == [Instructions.DRAWFORWARD, Instructions.DRAWFORWARD] # No jump to the next instruction is left behind
+    check(linked, first, second)
+
+def test_halts_in_the_middle_jump_to_the_next_object():
+    with vqsx.Builder() as b:
+        b.drawforward(5)
+        b.halt()
+        b.drawforward(1000) # Unreachable
+        first = b.dump()
+    with vqsx.Builder() as b:
+        b.rotatedeg(30.0)
+        b.jump(18) # Absolute, so it is relocated along with the object
+        b.drawforward(1000)
+        b.drawforward(3)
+        b.halt()
+        second = b.dump()
+
+    linked = vqsx.link([first, second, first])
+    check(linked, first, second, first)
+
+def test_identical_subroutines_are_folded():
+    first, second = subroutine_object(5), subroutine_object(7)
+    folded = vqsx.link([first, second])
+    unfolded = vqsx.link([first, second], fold=False)
+    assert len(folded) < len(unfolded)
+    assert insts(folded).count(Instructions.RETURN) == 1
+    check(folded, first, second)
+    check(unfolded, first, second)
+
+def test_vqsxi_round_trip():
+    bytecode = subroutine_object(5)
+    assert vqsx.unwrap_vqsxi(vqsx.wrap_vqsxi(bytecode, 320, 200)) == (bytecode, 320, 200, 1)
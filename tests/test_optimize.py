@@ -0,0 +1,144 @@
+import vqsx
+from vqsx.constants import Instructions
+import pytest
+
+def geometry(bytecode : bytes, nullmode : vqsx.NullOpBehavior = vqsx.NullOpBehavior.FAULT) -> list[vqsx.Segment]:
+    return list(vqsx.GeometryEvaluator(bytecode, 640, 480, nullmode, memoize=False).evaluate())
+
+def insts(bytecode : bytes) -> list[Instructions]:
+    return [record.inst for record in vqsx.Disassembler(bytecode).sweep()]
+
+def assert_same_drawing(optimized : bytes, original : bytes, nullmode : vqsx.NullOpBehavior = vqsx.NullOpBehavior.FAULT):
+    expected = geometry(original, nullmode)
+    drawn = geometry(optimized, nullmode)
+    assert len(drawn) == len(expected)
+    for segment, reference in zip(drawn, expected):
+        assert segment[:4] == pytest.approx(reference[:4], abs=1e-9)
+        assert segment[4:] == reference[4:]
+
+def build(*steps) -> bytes:
+    with vqsx.Builder() as b:
+        for inst, *operands in steps:
+            b.instruction(inst, *operands)
+        return b.dump()
+
+def test_noops_are_removed():
+    original = build((Instructions.DRAWFORWARD, 5), (Instructions.NOOP,), (Instructions.NULL,), (Instructions.DRAWFORWARD, 7))
+    optimized = vqsx.peephole(original, vqsx.NullOpBehavior.NOOP)
+    assert insts(optimized) == [Instructions.DRAWFORWARD, Instructions.DRAWFORWARD]
+    assert_same_drawing(optimized, original, vqsx.NullOpBehavior.NOOP)
+
+def test_moves_and_turns_are_folded():
+    original = build((Instructions.ROTATEDEG, 30.0), (Instructions.ROTATERDEG, 10.0), (Instructions.ROTATERAD, 0.25),
+                     (Instructions.FORWARD, 9), (Instructions.BACKWARDS, 4), (Instructions.FORWARD, 2),
+                     (Instructions.DRAWFORWARD, 20),
+                     (Instructions.ROTATEDEG, 45.0), (Instructions.ROTATERDEG, 45.0), # Cancel out
+                     (Instructions.DRAWFORWARD, 20))
+    optimized = vqsx.peephole(original)
+    assert insts(optimized) == [Instructions.ROTATEDEG, Instructions.ROTATERAD, Instructions.FORWARD, Instructions.DRAWFORWARD, Instructions.DRAWFORWARD]
+    assert_same_drawing(optimized, original)
+
+def test_dead_colors_are_removed():
+    original = build((Instructions.COLOR, 3), (Instructions.COLOR, 5), (Instructions.FORWARD, 1), (Instructions.DRAWFORWARD, 10),
+                     (Instructions.COLOR, 5), (Instructions.DRAWFORWARD, 10))
+    optimized = vqsx.peephole(original)
+    assert insts(optimized).count(Instructions.COLOR) == 1
+    assert_same_drawing(optimized, original)
+
+def test_jumps_to_next_and_unreachable_code_are_removed():
+    with vqsx.Builder() as b:
+        b.drawforward(5)
+        b.jumpipc(9) # Over the unreachable draw
+        b.drawforward(99)
+        b.jumpipc(0) # To the next instruction
+        b.rotatedeg(90.0)
+        b.drawforward(5)
+        original = b.dump()
+
+    optimized = vqsx.peephole(original)
+    assert insts(optimized) == [Instructions.DRAWFORWARD, Instructions.ROTATEDEG, Instructions.DRAWFORWARD]
+    assert_same_drawing(optimized, original)
+
+def test_jumps_are_encoded_for_the_new_layout():
+    # A loop-free jump backwards over code that shrinks, ending in a subroutine
+    with vqsx.Builder() as b:
+        b.drawforward(5)
+        b.nop()
+        b.nop()
+        b.jumpipc(19) # Past the halt and the subroutine's NOOPs
+        b.callipc(-28) # Back to the start of the subroutine
+        b.halt()
+        subroutine = b.tell()
+        b.nop()
+        b.rotatedeg(45.0)
+        b.drawforward(3)
+        b.ret()
+        original = b.dump()
+
+    # The call goes back to the subroutine, then control ends up at the halt
+    original = bytearray(original)
+    call = original.index(int(Instructions.CALLIPC))
+    original[call + 1:call + 9] = (subroutine - (call + 9)).to_bytes(8, "little", signed=True)
+    jump = original.index(int(Instructions.JUMPIPC))
+    original[jump + 1:jump + 9] = (call - (jump + 9)).to_bytes(8, "little", signed=True)
+    original = bytes(original)
+
+    optimized = vqsx.peephole(original)
+    assert len(optimized) < len(original)
+    assert Instructions.NOOP not in insts(optimized)
+    assert_same_drawing(optimized, original)
+
+def test_faulting_binaries_are_refused():
+    with pytest.raises(vqsx.VQsXOptimizerException):
+        vqsx.peephole(build((Instructions.DRAWFORWARD, 5), (Instructions.JUMPIPC, 100)))
+
+def repetitive() -> bytes:
+    """
+    The same little shape drawn all over, with a jump in between.
+    """
+    with vqsx.Builder() as b:
+        for i in range(12):
+            b.position(i * 40 - 240, i * 10)
+            b.color(vqsx.Colors(i % 4))
+            for _ in range(3):
+                b.drawforward(15)
+                b.rotatedeg(120.0)
+                b.drawforward(5)
+                b.rotaterdeg(30.0)
+                b.backward(2)
+            if i == 5:
+                b.jumpipc(9) # Over an unreachable draw
+                b.drawforward(1000)
+        return b.dump()
+
+def run(bytecode : bytes) -> tuple[int, list]:
+    """
+    Run a binary on the VM, returning its status and the events that draw or change the pen.
+    """
+    from test_vm import Recorder, drawing
+
+    vm = vqsx.VQsXExecutor()
+    recorder = Recorder()
+    vm.register(recorder)
+    vm.load(0, bytecode)
+    vm.run()
+    return int(vm.status), drawing(recorder.log)
+
+def test_outlined_code_runs():
+    original = repetitive()
+    outlined = vqsx.outline(original)
+    assert len(outlined) < len(original)
+    assert Instructions.CALLIPC in insts(outlined) and Instructions.RETURN in insts(outlined)
+
+    assert_same_drawing(outlined, original)
+    status, events = run(outlined)
+    assert status == vqsx.STATUS_HALTED
+    assert events == run(original)[1]
+
+def test_outlined_code_optimizes_again():
+    original = repetitive()
+    outlined = vqsx.outline(vqsx.peephole(original))
+    again = vqsx.peephole(outlined)
+    assert len(again) <= len(outlined)
+    assert_same_drawing(again, original)
+    assert run(again) == run(original)
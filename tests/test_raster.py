@@ -0,0 +1,141 @@
+import vqsx, vqsx.shared
+import vqsxrender
+import os, struct, zlib
+import pytest
+
+from test_geometry import program
+
+@pytest.mark.parametrize("mono", [False, True])
+@pytest.mark.parametrize("tiles", [1, 3, 7])
+def test_tiles_match_whole_render(tiles, mono):
+    width, height = 331, 257
+    geometry = vqsx.GeometryEvaluator(program(), width, height).evaluate()
+    whole = (vqsx.MonoRaster if mono else vqsx.Raster)(width, height)
+    whole.draw(geometry)
+
+    shm = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    with vqsx.shared.render_tiles(geometry, width, height, tiles, workers=2, mono=mono) as canvas:
+        assert bytes(canvas.raster.pixels[:len(whole.pixels)]) == bytes(whole.pixels)
+        assert canvas.raster.png() == whole.png()
+    if os.path.isdir("/dev/shm"):
+        assert set(os.listdir("/dev/shm")) <= shm # Nothing leaked
+
+def lit(raster) -> set[tuple[int, int]]:
+    """
+    The pixels of a raster that aren't black.
+    """
+    if isinstance(raster, vqsx.MonoRaster):
+        return {(x, y) for y in range(raster.height) for x in range(raster.width) if raster.pixels[y * raster.stride + (x >> 3)] & (0x80 >> (x & 7))}
+    return {(x, y) for y in range(raster.height) for x in range(raster.width) if any(raster.pixels[(y * raster.width + x) * 3:(y * raster.width + x + 1) * 3])}
+
+def unpng(data : bytes) -> tuple[tuple, bytes]:
+    """
+    Decode a PNG of unfiltered rows back into its header fields and packed pixels.
+    """
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    chunks, offset = {}, 8
+    while offset < len(data):
+        length, = struct.unpack_from(">I", data, offset)
+        kind, body = data[offset + 4:offset + 8], data[offset + 8:offset + 8 + length]
+        assert struct.unpack_from(">I", data, offset + 8 + length)[0] == zlib.crc32(kind + body)
+        chunks[kind] = body
+        offset += 12 + length
+    assert list(chunks) == [b"IHDR", b"IDAT", b"IEND"]
+    width, height, bitdepth, colortype, *_ = header = struct.unpack(">IIBBBBB", chunks[b"IHDR"])
+    stride = (width * bitdepth * (3 if colortype == 2 else 1) + 7) // 8
+    raw = zlib.decompress(chunks[b"IDAT"])
+    assert len(raw) == height * (stride + 1)
+    assert all(raw[row * (stride + 1)] == 0 for row in range(height))
+    return header, b"".join(raw[row * (stride + 1) + 1:(row + 1) * (stride + 1)] for row in range(height))
+
+LINES = [((0, 0, 4, 2), {(0, 0), (1, 1), (2, 1), (3, 2), (4, 2)}),
+         ((4, 2, 0, 0), {(4, 2), (3, 1), (2, 1), (1, 0), (0, 0)}),
+         ((1, 0, 2, 5), {(1, 0), (1, 1), (1, 2), (2, 3), (2, 4), (2, 5)}),
+         ((0, 5, 5, 0), {(0, 5), (1, 4), (2, 3), (3, 2), (4, 1), (5, 0)}),
+         ((3, 3, 3, 3), {(3, 3)}),
+         ((0, 7, 9, 7), {(x, 7) for x in range(10)})]
+
+@pytest.mark.parametrize("kind", [vqsx.Raster, vqsx.MonoRaster])
+@pytest.mark.parametrize("ends, pixels", LINES)
+def test_line_pixels(kind, ends, pixels):
+    raster = kind(10, 8)
+    raster.line(*ends, vqsx.RGBColor(255, 0, 0) if kind is vqsx.Raster else True)
+    assert lit(raster) == pixels
+
+@pytest.mark.parametrize("kind", [vqsx.Raster, vqsx.MonoRaster])
+def test_line_regions(kind):
+    color = vqsx.RGBColor(255, 255, 255) if kind is vqsx.Raster else True
+    whole, parts = kind(10, 8), kind(10, 8)
+    whole.line(0, 5, 9, 0, color)
+    parts.line(0, 5, 9, 0, color, (0, 0, 10, 3))
+    assert lit(parts) == {(x, y) for x, y in lit(whole) if y < 3}
+    parts.line(0, 5, 9, 0, color, (0, 3, 10, 8))
+    assert bytes(parts.pixels) == bytes(whole.pixels)
+
+def test_mono_black_lines():
+    raster = vqsx.MonoRaster(10, 8, background=True)
+    raster.line(0, 0, 4, 2, False)
+    assert lit(raster) == {(x, y) for y in range(8) for x in range(10)} - LINES[0][1]
+
+@pytest.mark.parametrize("kind", [vqsx.Raster, vqsx.MonoRaster])
+def test_segments_are_clipped(kind):
+    raster = kind(8, 6)
+    segments = [vqsx.Segment(-100, 0, 100, 0, 1, 10), # Across the whole width, on row 3
+                vqsx.Segment(-3, 50, -3, -50, 1, 10), # Across the whole height, on column 1
+                vqsx.Segment(20, 20, 30, 30, 1, 10), # Off the canvas
+                vqsx.Segment(-5, -1, -5, 1, 1, 10)] # Just off the left edge
+    assert raster.draw(segments) == 2
+    assert lit(raster) == {(x, 3) for x in range(8)} | {(1, y) for y in range(6)}
+
+def test_png_round_trip():
+    geometry = vqsx.GeometryEvaluator(program(), 61, 43).evaluate()
+    raster = vqsx.Raster(61, 43)
+    raster.draw(geometry)
+    header, pixels = unpng(raster.png())
+    assert header == (61, 43, 8, 2, 0, 0, 0)
+    assert pixels == bytes(raster.pixels)
+
+    mono = vqsx.MonoRaster(61, 43)
+    mono.draw(geometry)
+    header, pixels = unpng(mono.png(level=9))
+    assert header == (61, 43, 1, 0, 0, 0, 0)
+    assert pixels == bytes(mono.pixels)
+    assert lit(mono) == lit(raster)
+
+def test_encode_formats():
+    geometry = vqsx.GeometryEvaluator(program(), 61, 43).evaluate()
+    raster = vqsx.Raster(61, 43)
+    raster.draw(geometry)
+    mono = vqsx.MonoRaster(61, 43)
+    mono.draw(geometry)
+
+    assert vqsx.raster.encode(geometry, 61, 43, "png") == raster.png()
+    assert vqsx.raster.encode(geometry, 61, 43, "png", mono=True) == mono.png()
+    assert vqsx.raster.encode(geometry, 61, 43, "pbm") == mono.pbm()
+    assert mono.pbm().startswith(b"P4\n61 43\n")
+    assert vqsx.raster.encode(geometry, 61, 43, "svg") == vqsx.raster.svg(geometry, 61, 43).encode()
+    assert vqsx.raster.encode(geometry, 61, 43, "svg").count(b"<line ") == len(geometry)
+    listing = vqsx.raster.encode(geometry, 61, 43, "seg").decode().splitlines()
+    assert len(listing) == len(geometry)
+    assert [float(field) for field in listing[0].split()] == pytest.approx(list(next(iter(geometry))), abs=1e-5)
+
+    reused = vqsx.Raster(61, 43, background=vqsx.RGBColor(9, 9, 9))
+    assert vqsx.raster.encode(geometry, 61, 43, "png", reused) == raster.png() # Cleared before drawing
+
+    with pytest.raises(ValueError, match="Unknown format"):
+        vqsx.raster.encode(geometry, 61, 43, "gif")
+
+def test_render_cli(tmp_path, capsys):
+    (tmp_path / "a.vBin").write_bytes(program())
+    (tmp_path / "b.vxi").write_bytes(vqsx.wrap_vqsxi(program(), 61, 43))
+    output = tmp_path / "out"
+    assert vqsxrender.main(vqsxrender.parser.parse_args(["-j", "1", "-s", "64x48", "-o", str(output), str(tmp_path)])) == 0
+    assert "2/2 files" in capsys.readouterr().out
+    assert (output / "a.png").read_bytes() == vqsx.raster.encode(vqsx.GeometryEvaluator(program(), 64, 48).evaluate(), 64, 48)
+    assert (output / "b.png").read_bytes() == vqsx.raster.encode(vqsx.GeometryEvaluator(program(), 61, 43).evaluate(), 61, 43)
+
+    (tmp_path / "c.vBin").write_bytes(b"\xff" * 7)
+    assert vqsxrender.main(vqsxrender.parser.parse_args(["-j", "1", "-f", "seg", "-o", str(output), str(tmp_path)])) == 1
+    assert "c.vBin" in capsys.readouterr().err
+    assert not (output / "c.seg").exists()
+    assert vqsxrender.main(vqsxrender.parser.parse_args(["-s", "big", str(tmp_path)])) == 2
@@ -0,0 +1,64 @@
+import vqsx
+from vqsx import render
+import sys, threading
+import pytest
+
+from test_vm import Recorder, drawing
+from test_geometry import program, nested
+
+THREADS = 8
+
+@pytest.fixture
+def switching():
+    """
+    Switch threads very often, so the threads interleave as much as they can.
+    """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+def test_render_matches_serial(switching):
+    programs = [program(), nested()] * (THREADS // 2)
+    expected = [list(vqsx.GeometryEvaluator(bytecode, 640, 480).evaluate()) for bytecode in programs]
+
+    rendered = render.render(programs, 640, 480, workers=THREADS)
+    assert [list(geometry) for geometry in rendered] == expected
+
+def test_render_raises_the_first_fault():
+    faulty = vqsx.Builder().drawforward(1).instruction(vqsx.Instructions.RETURN).dump()
+    with pytest.raises(vqsx.VQsXGeometryException, match="RETURN"):
+        render.render([program(), faulty, program()], workers=3)
+
+class ThreadRecorder(Recorder):
+    """
+    Records every event, along with every thread that notified it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def onstep(self, post : bool):
+        self.threads.add(threading.get_ident())
+
+def test_run_matches_serial(switching):
+    bytecode = program() # Shared by every VM
+    vm = vqsx.VQsXExecutor()
+    reference = Recorder()
+    vm.register(reference)
+    vm.load(0, bytecode)
+    vm.run()
+
+    executors, recorders = [], []
+    for _ in range(THREADS):
+        vm = vqsx.VQsXExecutor()
+        recorder = ThreadRecorder()
+        vm.register(recorder)
+        vm.load(0, bytecode)
+        executors.append(vm)
+        recorders.append(recorder)
+
+    assert render.run(executors, workers=THREADS) == [vqsx.STATUS_HALTED] * THREADS
+    for recorder in recorders:
+        assert drawing(recorder.log) == drawing(reference.log)
+        assert len(recorder.threads) == 1 # Each VM and its observers stay on a single thread
@@ -0,0 +1,81 @@
+import vqsx
+import pytest
+
+from test_vm import Recorder, drawing, waiting
+from test_geometry import program as subroutines
+
+def long_program(distance : int, count : int = 100) -> bytes:
+    with vqsx.Builder() as b:
+        for _ in range(count):
+            b.drawforward(distance)
+            b.rotatedeg(10.0)
+        return b.dump()
+
+def serial(bytecode : bytes) -> list:
+    vm = vqsx.VQsXExecutor()
+    recorder = Recorder()
+    vm.register(recorder)
+    vm.load(0, bytecode)
+    vm.reset()
+    vm.spin()
+    while not vm.status & vqsx.STATUS_HALTED:
+        vm.run_slice(1000)
+        vm.trignext() # Right away, the scheduler wakes its VMs later but that doesn't change the drawing
+    return drawing(recorder.log)
+
+def test_round_robin_is_fair():
+    scheduler = vqsx.Scheduler(budget=10)
+    handles = [scheduler.add(long_program(distance)) for distance in range(3)]
+
+    order = [scheduler.step() for _ in range(9)]
+    assert order == handles * 3
+    assert [progress.steps for progress in scheduler] == [30, 30, 30]
+    assert [progress.slices for progress in scheduler] == [3, 3, 3]
+
+def test_weighted_shares_by_weight():
+    scheduler = vqsx.Scheduler(budget=10, policy=vqsx.SchedulingPolicy.WEIGHTED)
+    light = scheduler.add(long_program(1, 1000), weight=1)
+    heavy = scheduler.add(long_program(2, 1000), weight=3)
+
+    scheduler.run(slices=40)
+    assert scheduler.progress(light).slices == 10
+    assert scheduler.progress(heavy).slices == 30
+
+def test_halted_and_faulted_vms_are_dropped():
+    scheduler = vqsx.Scheduler(budget=10)
+    short = scheduler.add(vqsx.Builder().drawforward(1).halt().dump())
+    faulty = scheduler.add(bytes([int(vqsx.Instructions.DRAWFORWARD)]) + bytes(8) + bytes([0xFF]))
+    long = scheduler.add(long_program(1))
+    assert scheduler.pending == 3
+
+    assert [scheduler.step() for _ in range(3)] == [short, faulty, long]
+    assert scheduler.progress(short).halted and not scheduler.progress(short).faulted
+    assert scheduler.progress(faulty).faulted
+    assert scheduler.pending == 1
+
+    # Only the VM that didn't halt gets slices from now on
+    assert {scheduler.step() for _ in range(5)} == {long}
+    assert scheduler.progress(short).slices == scheduler.progress(faulty).slices == 1
+
+    # Removing a VM hands it back and stops scheduling it
+    vm = scheduler.remove(long)
+    assert isinstance(vm, vqsx.VQsXExecutor) and not vm.status & vqsx.STATUS_HALTED
+    assert scheduler.step() is None
+    assert len(scheduler) == 2
+
+@pytest.mark.parametrize("policy", list(vqsx.SchedulingPolicy))
+def test_interleaved_matches_serial(policy):
+    programs = [long_program(3, 57), subroutines(), long_program(5, 13), waiting(), long_program(3, 57)]
+    scheduler = vqsx.Scheduler(budget=7, policy=policy)
+    recorders = [Recorder() for _ in programs]
+    handles = [scheduler.add(bytecode, weight=i + 1, observers=[recorder]) for i, (bytecode, recorder) in enumerate(zip(programs, recorders))]
+
+    while True:
+        scheduler.run()
+        if not scheduler.parked:
+            break
+        scheduler.trignext()
+
+    for handle, bytecode, recorder in zip(handles, programs, recorders):
+        assert scheduler.progress(handle).halted and not scheduler.progress(handle).faulted
+        assert drawing(recorder.log) == serial(bytecode)
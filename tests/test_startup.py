@@ -0,0 +1,9 @@
+import vqsxstartup
+import pytest
+
+@pytest.mark.parametrize("module", vqsxstartup.MODULES)
+def test_import_stays_light(module):
+    # In a fresh interpreter, as this one already imported whatever the other tests needed
+    total, modules, forbidden = vqsxstartup.measure(module)
+    assert forbidden == []
+    assert any(name == module for own, name in modules)
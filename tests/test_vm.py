@@ -0,0 +1,189 @@
+import vqsx
+from vqsx.verify import verify, fast_path_eligible
+from vqsx.observers import VQsXStubObserver
+import pytest
+
+from test_geometry import program as subroutines
+
+class Recorder(VQsXStubObserver):
+    """
+    Records every event the VM notifies.
+    """
+    def __init__(self):
+        self.log = []
+
+def _record(name : str):
+    return lambda self, *args: self.log.append((name, args))
+
+for _name in ("onstep", "fetchinst", "fetchdecodedinst", "halt", "position", "center", "origin", "setorigin", "brightness", "scale", "color",
+              "draw", "forward", "backward", "drawforward", "drawbackward", "rotatedeg", "rotaterad", "rotaterdeg", "rotaterrad", "rotateorigin", "rotatesetorigin"):
+    setattr(Recorder, _name, _record(_name))
+
+def program() -> bytes:
+    with vqsx.Builder() as b:
+        for i in range(20):
+            b.position(i * 10 - 100, 0)
+            b.color(vqsx.Colors(i % len(vqsx.Colors)))
+            b.brightness(i % 11)
+            b.setorigin(vqsx.SetOriginValues(i % 3))
+            b.drawforward(8)
+            b.rotatedeg(90.0)
+            b.nop()
+        return b.dump()
+
+def trace(bytecode : bytes, nullmode : vqsx.NullOpBehavior, verified : bool):
+    vm = vqsx.VQsXExecutor(nullmode)
+    recorder = Recorder()
+    vm.register(recorder)
+    vm.load(0, bytecode)
+    if verified:
+        vm.verify()
+    vm.reset()
+    vm.spin()
+    steps = vm.run_slice(10**6)
+    return steps, int(vm.status), vm.ipc, recorder.log
+
+def drawing(log : list) -> list:
+    """
+    The events of a trace that draw or change the pen, leaving out the stepping.
+    """
+    return [event for event in log if event[0] not in ("onstep", "fetchinst", "fetchdecodedinst")]
+
+def test_recorder_records():
+    steps, status, ipc, log = trace(program(), vqsx.NullOpBehavior.FAULT, False)
+    assert len(log) > steps > 100
+
+@pytest.mark.parametrize("bytecode", [program(), subroutines(), bytes([0x21, 0x20, 0x21]), bytes([0x21, 0, 0x21]), b""], ids=["program", "subroutines", "waitnext", "null", "empty"])
+@pytest.mark.parametrize("nullmode", list(vqsx.NullOpBehavior), ids=lambda mode: mode.name)
+def test_verified_matches_unverified(bytecode, nullmode):
+    assert trace(bytecode, nullmode, True) == trace(bytecode, nullmode, False)
+
+def test_unimplemented_instructions_miss_the_fast_path():
+    with vqsx.Builder() as b:
+        b.forward(1)
+        b.statepush()
+        b.forward(1)
+        bytecode = b.dump()
+
+    verification = verify(bytecode)
+    assert verification.ok # Structurally fine
+    assert not fast_path_eligible(verification)
+    assert fast_path_eligible(verify(program()))
+
+    for verified in (False, True):
+        steps, status, ipc, log = trace(bytecode, vqsx.NullOpBehavior.FAULT, verified)
+        assert status & vqsx.STATUS_FAULT
+
+def test_assigning_bytecode_drops_verification():
+    vm = vqsx.VQsXExecutor()
+    vm.load(0, program())
+    assert vm.verify().ok
+
+    vm.bytecode = bytes(vm.bytecode) # Equal bytecode keeps its verification
+    assert vm.verification is not None
+    vm.bytecode = bytes([0x99])
+    assert vm.verification is None
+
+def test_subroutines_run():
+    bytecode = subroutines()
+    assert fast_path_eligible(verify(bytecode))
+
+    steps, status, ipc, log = trace(bytecode, vqsx.NullOpBehavior.FAULT, False)
+    assert status == vqsx.STATUS_HALTED
+    drawn = [event for event in drawing(log) if event[0] in ("draw", "drawforward", "drawbackward")]
+    assert len(drawn) == len(vqsx.GeometryEvaluator(bytecode, 640, 480).evaluate())
+
+def control(*steps) -> bytes:
+    with vqsx.Builder() as b:
+        b.forward(1)
+        for inst, *operands in steps:
+            b.instruction(inst, *operands)
+        b.forward(2)
+        return b.dump()
+
+@pytest.mark.parametrize("bytecode, status", [
+    (control((vqsx.Instructions.RETURN,)), vqsx.STATUS_HALTED | vqsx.STATUS_FAULT), # Empty call stack
+    (control((vqsx.Instructions.JUMPIPC, -100)), vqsx.STATUS_HALTED | vqsx.STATUS_FAULT), # Before the start
+    (control((vqsx.Instructions.CALLIPC, -9)), vqsx.STATUS_HALTED | vqsx.STATUS_FAULT), # Recursion overflows the call stack
+    (control((vqsx.Instructions.JUMPIPC, 9)), vqsx.STATUS_HALTED), # Right to the end
+    (control((vqsx.Instructions.JUMPMST, 1000)), vqsx.STATUS_HALTED), # Past the end
+    (control((vqsx.Instructions.JUMP, 27)), vqsx.STATUS_HALTED), # Over the last move, to the end
+], ids=["return", "before", "recursion", "end", "past", "absolute"])
+def test_control_flow(bytecode, status):
+    vm = vqsx.VQsXExecutor()
+    recorder = Recorder()
+    vm.register(recorder)
+    vm.load(0, bytecode)
+    vm.run()
+    assert vm.status == status
+    assert ("forward", (2,)) not in recorder.log
+
+def test_waiting_after_a_fault():
+    vm = vqsx.VQsXExecutor()
+    vm.load(0, bytes([0x99]))
+    vm.run()
+    assert vm.status == vqsx.STATUS_HALTED | vqsx.STATUS_FAULT
+    vm.waitnext()
+    assert vm.status == vqsx.STATUS_HALTED | vqsx.STATUS_NEXT | vqsx.STATUS_FAULT
+
+def waiting() -> bytes:
+    with vqsx.Builder() as b:
+        for distance in range(1, 6):
+            b.drawforward(distance)
+            b.waitnext()
+        b.drawforward(6)
+        return b.dump()
+
+def test_run_async_waits_for_next():
+    import asyncio, threading
+
+    vm = vqsx.VQsXExecutor()
+    recorder = Recorder()
+    vm.register(recorder)
+    vm.load(0, waiting())
+
+    async def main():
+        runner = asyncio.ensure_future(vm.run_async(every=1))
+        waits = 0
+        while not runner.done():
+            await asyncio.sleep(0.001)
+            if vm.status & vqsx.STATUS_NEXT:
+                drawn = [event for event in recorder.log if event[0] == "drawforward"]
+                assert len(drawn) == waits + 1 # Asleep right after the draw before the WAITNEXT
+                waits += 1
+                # From another thread, like the TRIGNEXT pin
+                trigger = threading.Thread(target=vm.trignext)
+                trigger.start()
+                trigger.join()
+        await runner
+        return waits
+
+    assert asyncio.run(main()) == 5
+    assert vm.status == vqsx.STATUS_HALTED
+    assert [args for name, args in recorder.log if name == "drawforward"] == [(distance,) for distance in range(1, 7)]
+
+def test_trignext_races_with_halting():
+    # A VM halting on one thread while another keeps triggering NEXT must stay halted
+    import sys, threading
+
+    vm = vqsx.VQsXExecutor()
+    vm.load(0, bytes([0x20]) * 200) # Nothing but WAITNEXT
+    vm.reset()
+    vm.spin()
+
+    done = threading.Event()
+    def trigger():
+        while not done.is_set():
+            vm.trignext()
+    trigger = threading.Thread(target=trigger)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5) # Switch threads often, so the writes interleave
+    trigger.start()
+    try:
+        while not (vm.status & vqsx.STATUS_HALTED):
+            vm.step()
+    finally:
+        done.set()
+        trigger.join()
+        sys.setswitchinterval(interval)
+    assert vm.status == vqsx.STATUS_HALTED